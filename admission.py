@@ -0,0 +1,158 @@
+"""
+Admission control for /api/chat: reject early and cheaply instead of letting every request time out.
+
+- RateLimiter: a token bucket per client (session or IP address), answered with 429 when it is empty.
+- ConcurrencyLimiter: a cap on the chat requests that are in their LLM pipeline at the same time, with a bounded
+  wait queue in front of it. A request that finds the queue full, or waits longer than the queue timeout, is
+  answered with 503.
+
+Both rejections carry a Retry-After estimate. The limits apply per worker process.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is not admitted.
+
+    Attributes:
+    - reason (str): "rate_limited", "queue_full" or "queue_timeout".
+    - status (int): The HTTP status to answer with (429 or 503).
+    - retry_after (int): Seconds after which the client should retry.
+    """
+
+    def __init__(self, reason, status, retry_after):
+        super().__init__(f"Request rejected: {reason}")
+        self.reason = reason
+        self.status = status
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by client: each holds up to `burst` tokens and refills at `rate` tokens per second.
+
+    Attributes:
+    - rate (float): Tokens added per second.
+    - burst (int): Bucket capacity, i.e. the requests a client may send at once after being idle.
+    - max_clients (int): Buckets kept in memory; the least recently seen clients are forgotten (a forgotten
+      client starts again with a full bucket).
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._rejected = 0
+
+    def acquire(self, key):
+        """
+        Take a token from the client's bucket.
+
+        Parameters:
+        - key (str): The client identifier.
+
+        Raises:
+        - AdmissionRejected: 429 if the bucket is empty.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+            else:
+                self._buckets[key] = (tokens, now)
+                self._rejected += 1
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        if tokens < 1:
+            raise AdmissionRejected("rate_limited", 429, (1 - tokens) / self.rate)
+
+    def stats(self):
+        with self._lock:
+            return {"clients": len(self._buckets), "rejected": self._rejected, "rate": self.rate, "burst": self.burst}
+
+
+class ConcurrencyLimiter:
+    """
+    At most max_concurrent holders at a time; up to max_queue more wait (FIFO) for at most queue_timeout seconds.
+
+    Retry-After of a rejection is the expected time until the queue drains: the queue length times the average
+    time a slot is held, divided by the number of slots.
+
+    Attributes:
+    - max_concurrent (int): Number of slots.
+    - max_queue (int): Requests allowed to wait for a slot; further requests are rejected immediately.
+    - queue_timeout (float): Seconds a request waits for a slot before it is rejected.
+    """
+
+    def __init__(self, max_concurrent, max_queue, queue_timeout):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._condition = threading.Condition()
+        self._waiters = []
+        self._in_flight = 0
+        self._hold_seconds_avg = 1.0
+        self._stats = {"admitted": 0, "queued": 0, "queue_full": 0, "queue_timeout": 0}
+
+    def _retry_after(self):
+        """ Caller holds the lock """
+        return (len(self._waiters) + 1) * self._hold_seconds_avg / self.max_concurrent
+
+    def acquire(self):
+        """
+        Take a slot, waiting in the queue if none is free.
+
+        Returns:
+        - float: The time the slot was taken (pass it to release()).
+
+        Raises:
+        - AdmissionRejected: 503 if the queue is full or the wait timed out.
+        """
+        with self._condition:
+            if self._in_flight < self.max_concurrent and not self._waiters:
+                self._in_flight += 1
+                self._stats["admitted"] += 1
+                return time.monotonic()
+            if len(self._waiters) >= self.max_queue:
+                self._stats["queue_full"] += 1
+                raise AdmissionRejected("queue_full", 503, self._retry_after())
+
+            waiter = object()
+            self._waiters.append(waiter)
+            self._stats["queued"] += 1
+            deadline = time.monotonic() + self.queue_timeout
+            while self._waiters[0] is not waiter or self._in_flight >= self.max_concurrent:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(waiter)
+                    self._stats["queue_timeout"] += 1
+                    self._condition.notify_all()
+                    raise AdmissionRejected("queue_timeout", 503, self._retry_after())
+                self._condition.wait(remaining)
+            self._waiters.pop(0)
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            self._condition.notify_all()
+            return time.monotonic()
+
+    def release(self, acquired_at):
+        """ Give a slot back and wake the head of the queue """
+        with self._condition:
+            self._in_flight -= 1
+            self._hold_seconds_avg = 0.9 * self._hold_seconds_avg + 0.1 * (time.monotonic() - acquired_at)
+            self._condition.notify_all()
+
+    def stats(self):
+        """ Slots in use, queue depth, admission and rejection counters, and the average time a slot is held """
+        with self._condition:
+            return dict(self._stats, in_flight=self._in_flight, queue_depth=len(self._waiters),
+                        max_concurrent=self.max_concurrent, max_queue=self.max_queue,
+                        hold_seconds_avg=round(self._hold_seconds_avg, 3))
@@ -1,133 +1,399 @@
 import os
 import requests
 import json
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session
+from flask import Flask, Blueprint, request, jsonify, render_template, redirect, url_for, session, Response, \
+    stream_with_context
 from flask_cors import CORS
-from openai import OpenAI
+from openai import OpenAI, APITimeoutError
 import inspect
 import re
+import time
+import random
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from transformers import pipeline
+from schema_cache import FunctionSchemaCache, RedisFunctionSchemaCache
+from chat_store import create_chat_store, page_bounds
+from chat_archive import ChatArchive, ArchivingChatStore
+from sentiment_service import SentimentBatcher, SentimentAnalyzer, LazyModel
+from sentiment_backends import load_sentiment_backend
+from tool_http import ToolHTTPClient, CircuitOpenError
+from tool_cache import TTLCache, RedisTTLCache
+from tool_registry import ToolRegistry, format_tool_result
+from shared_state import KEY_PREFIX, connect_redis
+from response_cache import ResponseCache, context_scope, load_sentence_embedder
+from admission import AdmissionRejected, RateLimiter, ConcurrencyLimiter
+from request_budget import RequestAborted, RequestBudget, CompletionLengths, connection_probe
+from context_builder import ContextBuilder, count_tokens, count_message_tokens
+from prompt_builder import PromptBuilder, PromptCacheStats
+from metrics import REGISTRY, Counter, Histogram, CallbackMetric, RequestTimings
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask
-app = Flask(__name__)
-CORS(app)
-app.secret_key = os.getenv("FLASK_SECRET_KEY", "your_default_secret_key")  # Used for session authentication
+# Routes are registered on a blueprint; create_app() builds the Flask application and its services, so importing
+# this module has no side effects beyond reading the configuration
+bp = Blueprint("chatbot", __name__)
+
+# OpenAI API client, chat store and schema cache, created by create_app()
+client = None
+chat_store = None
+schema_cache = None
+
+# Timeout of a single OpenAI API call in seconds (serve.py derives it from its per-request timeout)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+
+# Logging: per-request details are only logged for a LOG_SAMPLE_RATE share of requests
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+logger = logging.getLogger("chatbot")
+
+
+def log_sampled(level, message, *args):
+    """ Log a per-request detail for a sample of requests only """
+    if random.random() < LOG_SAMPLE_RATE:
+        logger.log(level, message, *args)
+
+
+# Latency and token metrics, exposed on /metrics in the Prometheus text format
+STAGE_SECONDS = Histogram("chatbot_stage_seconds", "Time spent in each stage of /api/chat",
+                          ["stage", "function"])
+LLM_CALL_SECONDS = Histogram("chatbot_llm_call_seconds", "Duration of OpenAI completion calls", ["call"])
+LLM_TOKENS = Counter("chatbot_llm_tokens_total", "Tokens reported by response.usage", ["call", "type"])
+LLM_CALLS_ABORTED = Counter("chatbot_llm_calls_aborted_total",
+                            "OpenAI calls cut short or skipped because their chat request was stopped early",
+                            ["call", "reason"])
+LLM_TOKENS_SAVED = Counter("chatbot_llm_tokens_saved_total",
+                           "Estimated tokens not spent because calls were cut short or skipped", ["call", "reason"])
+completion_lengths = CompletionLengths()
+
+
+def record_token_usage(call, usage, budget=None):
+    """ Add the prompt and completion tokens of one OpenAI call to the token counters (and the request's budget) """
+    if usage is None:
+        return
+    LLM_TOKENS.labels(call=call, type="prompt").inc(usage.prompt_tokens or 0)
+    LLM_TOKENS.labels(call=call, type="completion").inc(usage.completion_tokens or 0)
+    # Prompt tokens served from the provider's prompt cache (absent from older API versions and other providers)
+    cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+    LLM_TOKENS.labels(call=call, type="cached").inc(cached_tokens)
+    prompt_cache.record(call, usage.prompt_tokens or 0, cached_tokens)
+    completion_lengths.observe(call, usage.completion_tokens or 0)
+    if budget is not None:
+        budget.charge((usage.prompt_tokens or 0) + (usage.completion_tokens or 0))
+
+
+def record_aborted_call(call, reason, prompt_tokens=0, completion_tokens=0):
+    """
+    Count an OpenAI call that was skipped (prompt_tokens: its estimated prompt) or cut short after
+    completion_tokens tokens; the tokens it would still have generated are estimated from earlier calls.
+    """
+    LLM_CALLS_ABORTED.labels(call=call, reason=reason).inc()
+    LLM_TOKENS_SAVED.labels(call=call, reason=reason).inc(
+        prompt_tokens + max(0, completion_lengths.expected(call) - completion_tokens))
 
-# Initialize OpenAI API
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+def budget_call_limits(call, budget, messages):
+    """ The timeout and max_tokens of a call within the request's budget, see RequestBudget.call_limits() """
+    prompt_tokens = sum(count_message_tokens(message) for message in messages)
+    try:
+        return budget.call_limits(prompt_tokens, LLM_TIMEOUT)
+    except RequestAborted as e:
+        record_aborted_call(call, e.reason, prompt_tokens=prompt_tokens)
+        raise
+
+
+def timed_completion(call, budget=None, **kwargs):
+    """
+    client.chat.completions.create() with its duration and token usage recorded under the given call name.
+    With the budget of a chat request, the call is skipped or cut short when the request has to stop early.
+    """
+    if budget is not None:
+        limits = budget_call_limits(call, budget, kwargs["messages"])
+        if "max_tokens" in kwargs and "max_tokens" in limits:
+            limits["max_tokens"] = min(kwargs["max_tokens"], limits["max_tokens"])
+        kwargs.update(limits)
+    try:
+        with LLM_CALL_SECONDS.labels(call=call).time():
+            response = client.chat.completions.create(**kwargs)
+    except APITimeoutError:
+        if budget is not None and budget.expired():
+            record_aborted_call(call, "deadline")
+            raise budget.abort("deadline")
+        raise
+    record_token_usage(call, getattr(response, "usage", None), budget)
+    return response
+
+
+def budgeted_chunks(stream, budget):
+    """ The chunks of a streamed completion, checking the request's budget before passing each one on """
+    try:
+        for chunk in stream:
+            budget.check()
+            yield chunk
+    except RequestAborted:
+        raise
+    except Exception:
+        # A read timeout surfaces as the transport's own exception here, not as APITimeoutError. If the request
+        # was stopped, report that with the reason the budget recorded (or finds now) instead of the error
+        budget.check()
+        raise
+
+
+def truncated_by_budget(response, budget):
+    """ Whether a completion ended because it reached the max_tokens set by the request's token budget """
+    return bool(budget.token_budget) and response.choices[0].finish_reason == "length"
 
 # Access password
 ACCESS_TOKEN = os.getenv("ACCESS_TOKEN", "hanliangdeng")  # password
 
 # API Keys
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")  # OpenWeather API Key
-NEWS_API_KEY = os.environ["NEWS_API_KEY"]
-
-# Limit the length of the conversation history
+NEWS_API_KEY = os.getenv("NEWS_API_KEY")
+
+# Upstream base URLs (overridable, e.g. to point the tools at local stub servers)
+OPENWEATHER_BASE_URL = os.getenv("OPENWEATHER_BASE_URL", "https://api.openweathermap.org")
+NEWS_API_BASE_URL = os.getenv("NEWS_API_BASE_URL", "https://newsapi.org")
+
+# Pooled keep-alive sessions with timeouts, retries and a circuit breaker, one per upstream
+TOOL_CONNECT_TIMEOUT = float(os.getenv("TOOL_CONNECT_TIMEOUT", 3.05))
+TOOL_READ_TIMEOUT = float(os.getenv("TOOL_READ_TIMEOUT", 10))
+TOOL_MAX_RETRIES = int(os.getenv("TOOL_MAX_RETRIES", 2))
+weather_http = ToolHTTPClient(OPENWEATHER_BASE_URL, connect_timeout=TOOL_CONNECT_TIMEOUT,
+                              read_timeout=TOOL_READ_TIMEOUT, max_retries=TOOL_MAX_RETRIES)
+news_http = ToolHTTPClient(NEWS_API_BASE_URL, connect_timeout=TOOL_CONNECT_TIMEOUT,
+                           read_timeout=TOOL_READ_TIMEOUT, max_retries=TOOL_MAX_RETRIES)
+
+# Limit the length of the conversation history: at most MAX_HISTORY messages and CONTEXT_TOKEN_BUDGET tokens are
+# sent verbatim, older messages are folded into a rolling summary
 MAX_HISTORY = 20
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 300))
 
-# File for storing chat history
+# File for storing chat history (legacy format, imported into the chat store once)
 CHAT_HISTORY_FILE = "chat_history.json"
 
-# Load Hugging Face pre-trained sentiment analysis model
-sentiment_pipeline = pipeline("sentiment-analysis", model="distilbert/distilbert-base-uncased-finetuned-sst-2-english")
+# Chat storage backend ("sqlite", "json" or "redis") and the SQLite database file
+CHAT_STORE_BACKEND = os.getenv("CHAT_STORE_BACKEND", "sqlite")
+CHAT_STORE_FILE = os.getenv("CHAT_STORE_FILE", "chat_history.db")
+
+# Chats not updated for CHAT_ARCHIVE_IDLE_DAYS (0 disables archiving) are moved to the compressed archive in
+# CHAT_ARCHIVE_DIR by a sweep every CHAT_ARCHIVE_SWEEP_INTERVAL seconds; they are restored when opened again
+CHAT_ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR", "chat_archive")
+CHAT_ARCHIVE_IDLE_DAYS = float(os.getenv("CHAT_ARCHIVE_IDLE_DAYS", 0))
+CHAT_ARCHIVE_SWEEP_INTERVAL = float(os.getenv("CHAT_ARCHIVE_SWEEP_INTERVAL", 3600))
+
+# Redis server for state shared by all workers: with REDIS_URL set, tool responses and function schemas are
+# shared through it, and CHAT_STORE_BACKEND=redis keeps the chats there too
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Hugging Face pre-trained sentiment analysis model and when to load it:
+# "background" - warm up on a thread when the app is created (requests wait for it, /ready reports "warming")
+# "lazy"       - load on the first request
+# "preload"    - load synchronously in create_app(); with `gunicorn --preload` the workers share the parent's copy
+SENTIMENT_MODEL = os.getenv("SENTIMENT_MODEL", "distilbert/distilbert-base-uncased-finetuned-sst-2-english")
+SENTIMENT_LOAD_MODE = os.getenv("SENTIMENT_LOAD_MODE", "background")
+# Inference backend: "pytorch", "int8" (dynamically quantized), "onnx" (ONNX Runtime) or "stub" (keywords, no model
+# download; for offline benchmarks), see sentiment_backends.py
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "pytorch")
+
+
+def load_sentiment_pipeline():
+    """ Load the sentiment backend; transformers is imported there because importing it alone takes seconds """
+    return load_sentiment_backend(SENTIMENT_BACKEND, SENTIMENT_MODEL)
+
+
+sentiment_model = LazyModel(load_sentiment_pipeline)
+
+# Sentiment requests are micro-batched: wait up to SENTIMENT_BATCH_WAIT_MS for up to SENTIMENT_BATCH_SIZE texts
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", 16))
+SENTIMENT_BATCH_WAIT_MS = float(os.getenv("SENTIMENT_BATCH_WAIT_MS", 5))
+# Forward passes are skipped for repeated texts (LRU memo of SENTIMENT_MEMO_SIZE texts, 0 to disable) and for
+# trivial ones: emoji, "ok", "thanks" and non-CJK texts of at most SENTIMENT_PRECLASSIFY_CHARS characters (-1 to
+# disable)
+SENTIMENT_MEMO_SIZE = int(os.getenv("SENTIMENT_MEMO_SIZE", 4096))
+SENTIMENT_PRECLASSIFY_CHARS = int(os.getenv("SENTIMENT_PRECLASSIFY_CHARS", 2))
+# Texts over the model's maximum length are truncated, or with "chunk" split into SENTIMENT_CHUNK_CHARS pieces
+SENTIMENT_LONG_INPUT = os.getenv("SENTIMENT_LONG_INPUT", "truncate")
+SENTIMENT_CHUNK_CHARS = int(os.getenv("SENTIMENT_CHUNK_CHARS", 1000))
+
+
+def classify_sentiment_batch(texts):
+    """ Run one batched forward pass; inputs longer than the model's maximum length are truncated """
+    return sentiment_model.get()(texts)
+
+
+sentiment_batcher = SentimentBatcher(classify_sentiment_batch, max_batch_size=SENTIMENT_BATCH_SIZE,
+                                     max_wait_ms=SENTIMENT_BATCH_WAIT_MS)
+sentiment_analyzer = SentimentAnalyzer(sentiment_batcher, memo_size=SENTIMENT_MEMO_SIZE,
+                                       preclassify_chars=SENTIMENT_PRECLASSIFY_CHARS,
+                                       long_input=SENTIMENT_LONG_INPUT, chunk_chars=SENTIMENT_CHUNK_CHARS)
 
 
 def analyze_sentiment(text):
-    """ Use Hugging Face for sentiment analysis """
-    result = sentiment_pipeline(text)
-    return result[0]["label"], result[0]["score"]  # return sentiment and confidence
+    """ Use Hugging Face for sentiment analysis (memoized, and batched with concurrent requests) """
+    return sentiment_analyzer.analyze(text)  # return sentiment and confidence
 
 
 ### ========================== 1. Login & Log out ========================== ###
 
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('login.html')  # Render the login page
 
 
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login():
     password = request.form.get('password')
     if password == ACCESS_TOKEN:
         session["authenticated"] = True  # Set user as logged in
-        return redirect(url_for('chat_page'))
+        session["client_id"] = uuid.uuid4().hex  # Identifies the session for rate limiting
+        return redirect(url_for('chatbot.chat_page'))
     else:
         return render_template('login.html', error="Invalid password")
 
 
-@app.route('/logout', methods=['POST'])
+@bp.route('/logout', methods=['POST'])
 def logout():
     session.pop("authenticated", None)
-    return redirect(url_for('index'))
+    return redirect(url_for('chatbot.index'))
 
 
 ### ========================== 2. Chat Page ========================== ###
 
-@app.route('/chat')
+@bp.route('/chat')
 def chat_page():
     if not session.get("authenticated"):
-        return redirect(url_for('index'))  # Redirect unauthenticated users to the login page
+        return redirect(url_for('chatbot.index'))  # Redirect unauthenticated users to the login page
     return render_template('chat.html')
 
 
 # ========================== 3. Chat management API ========================== #
 def load_chat_history():
-    """ Load chat history from a JSON file """
-    if os.path.exists(CHAT_HISTORY_FILE):
-        with open(CHAT_HISTORY_FILE, "r", encoding="utf-8") as file:
-            return json.load(file)
-    return {}
+    """ Load the whole chat history (legacy adapter over the chat store) """
+    return chat_store.load_all()
 
 
 def save_chat_history(history):
-    """ Save chat history to a JSON file """
-    with open(CHAT_HISTORY_FILE, "w", encoding="utf-8") as file:
-        json.dump(history, file, ensure_ascii=False, indent=4)
+    """ Save the whole chat history (legacy adapter; only new messages are written) """
+    chat_store.replace_all(history)
+
+
+def int_arg(name):
+    """ Read an optional non-negative integer query parameter; raises ValueError if it is malformed """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value.isdigit():
+        raise ValueError(f"{name} must be a non-negative integer")
+    return int(value)
+
+
+def conditional_response(payload, etag):
+    """ JSON response with an ETag; answers 304 Not Modified when the client's If-None-Match still matches """
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True  # Browsers revalidate every time and reuse their copy on 304
+    return response.make_conditional(request)
 
 
-@app.route('/api/get_chats', methods=['GET'])
+@bp.route('/api/get_chats', methods=['GET'])
 def get_chats():
-    """ Retrieve all chat history """
-    history = load_chat_history()
-    chat_list = [{"id": chat_id, "title": chat["title"]} for chat_id, chat in history.items()]
-    return jsonify(chat_list)
+    """
+    Retrieve the chat list, oldest first.
+
+    Optional query parameters:
+    - limit: Return at most this many chats (the newest ones, unless after is given).
+    - before / after: Chat id cursors to page to older or newer chats.
+
+    The X-Has-More header tells whether more chats lie beyond the page in the paging direction.
+    """
+    try:
+        limit = int_arg("limit")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    before, after = request.args.get("before"), request.args.get("after")
+
+    version = chat_store.chats_version()
+    chats = chat_store.list_chats(limit + 1 if limit is not None else None, before, after)
+    has_more = limit is not None and len(chats) > limit
+    if has_more:
+        chats = chats[:limit] if after is not None else chats[1:]
+
+    response = conditional_response(chats, f"chats-{version}-{limit}-{before}-{after}")
+    response.headers["X-Has-More"] = "true" if has_more else "false"
+    return response
 
 
-@app.route('/api/get_chat/<chat_id>', methods=['GET'])
+@bp.route('/api/get_chat/<chat_id>', methods=['GET'])
 def get_chat(chat_id):
-    """ Retrieve specific chat content """
-    history = load_chat_history()
-    if chat_id in history:
-        return jsonify({"messages": history[chat_id]["messages"]})
-    return jsonify({"error": "Chat not found"}), 404
+    """
+    Retrieve specific chat content.
 
+    Optional query parameters (message indexes start at 0):
+    - limit: Return at most this many messages (the newest ones, unless after or since is given).
+    - before / after: Only messages below / above this index.
+    - since: Only messages from this index on, i.e. the number of messages the client already has.
+    """
+    try:
+        limit, before, after, since = (int_arg(name) for name in ("limit", "before", "after", "since"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if since is not None:
+        after = max(after if after is not None else -1, since - 1)
+
+    info = chat_store.get_chat_info(chat_id)
+    if info is None:
+        return jsonify({"error": "Chat not found"}), 404
+    start, end = page_bounds(info["message_count"], limit, before, after)
+    messages = chat_store.get_messages(chat_id, start, end)
+    if messages is None:
+        return jsonify({"error": "Chat not found"}), 404
+
+    # More messages in the paging direction: older ones when paging backwards, newer ones when paging forwards
+    upper = min(info["message_count"], before) if before is not None else info["message_count"]
+    payload = {"messages": messages, "start": start, "total": info["message_count"],
+               "has_more": start > 0 if after is None else end < upper}
+    return conditional_response(payload, f"chat-{info['message_count']}-{info['updated_at']}-{start}-{end}")
+
+
+@bp.route('/api/search_chats', methods=['GET'])
+def search_chats():
+    """
+    Full-text search over chat titles and messages (Chinese and English).
 
-@app.route('/api/delete_chat/<chat_id>', methods=['DELETE'])
+    Query parameters: q (the search terms, all of which must match) and limit (default 20, at most 100).
+    Returns the best matches first, each with its chat id and title, the message's position and role (None for
+    a title match) and a snippet with the offsets of the matched terms.
+    """
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Query cannot be empty"}), 400
+    try:
+        limit = min(int_arg("limit") or 20, 100)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    started = time.perf_counter()
+    results = chat_store.search(query, limit)
+    return jsonify({"query": query, "results": results, "took_ms": round((time.perf_counter() - started) * 1000, 2)})
+
+
+@bp.route('/api/delete_chat/<chat_id>', methods=['DELETE'])
 def delete_chat(chat_id):
     """ Delete the chat """
-    history = load_chat_history()
-    if chat_id in history:
-        del history[chat_id]
-        save_chat_history(history)
+    if chat_store.delete_chat(chat_id):
         return jsonify({"message": "Chat deleted successfully"})
     return jsonify({"error": "Chat not found"}), 404
 
 
-@app.route('/api/rename_chat/<chat_id>', methods=['POST'])
+@bp.route('/api/rename_chat/<chat_id>', methods=['POST'])
 def rename_chat(chat_id):
     """ Rename the chat """
-    history = load_chat_history()
     data = request.json
     new_title = data.get("title")
 
-    if chat_id in history and new_title:
-        history[chat_id]["title"] = new_title
-        save_chat_history(history)
+    if new_title and chat_store.rename_chat(chat_id, new_title):
         return jsonify({"message": "Chat renamed successfully"})
     return jsonify({"error": "Chat not found or invalid title"}), 400
 
@@ -152,12 +418,9 @@ def query_openweather_function(city="Beijing", units="metric", language="zh_cn",
     api_key = os.getenv("OPENWEATHER_API_KEY")
 
     if not api_key:
-        print("OpenWeatherAPI Key not set or invalid")
+        logger.warning("OpenWeatherAPI Key not set or invalid")
         return json.dumps({"error": "OpenWeatherAPI Key is missing or invalid."})
 
-    # Build the request URL
-    url = "https://api.openweathermap.org/data/2.5/weather"
-
     # Set query parameters
     params = {
         "q": city,
@@ -166,17 +429,21 @@ def query_openweather_function(city="Beijing", units="metric", language="zh_cn",
         "lang": language
     }
 
-    # Send a GET request
-    response = requests.get(url, params=params)
+    # Send a GET request (pooled session with timeouts and retries)
+    try:
+        response = weather_http.get("/data/2.5/weather", params=params)
+    except (CircuitOpenError, requests.RequestException) as e:
+        logger.warning("OpenWeather API Error: %s", e)
+        return json.dumps({"error": f"Query failed: {e}"})
 
     # Check the response status
     if response.status_code == 200:
         # Parse the response data
         data = response.json()
-        print("✅ OpenWeather API Response:", data)  # Print the data returned by the API
+        log_sampled(logging.DEBUG, "✅ OpenWeather API Response: %s", data)  # Log the data returned by the API
 
-        # Convert the result to a JSON-formatted string
-        return json.dumps(data)
+        # Convert the result to a JSON-formatted string (the units are kept for rendering the weather card)
+        return json.dumps(dict(data, units=units))
     else:
         # create an error message
         error_message = {
@@ -184,11 +451,61 @@ def query_openweather_function(city="Beijing", units="metric", language="zh_cn",
             "Response data": response.text
         }
 
-        print("OpenWeather API Error:", error_message)
+        logger.warning("OpenWeather API Error: %s", error_message)
         # Convert error messages to JSON-formatted strings
         return json.dumps(error_message)
 
 
+# Symbol of the temperature unit for each value of the "units" parameter
+TEMPERATURE_UNITS = {"metric": "°C", "imperial": "°F", "standard": "K"}
+
+# Labels of the weather card in each language a user message can be detected in (see message_language())
+WEATHER_CARD_LABELS = {
+    "zh": {"title": "实时天气", "temperature": "温度", "feels_like": "体感", "humidity": "湿度", "wind": "风速"},
+    "en": {"title": "current weather", "temperature": "Temperature", "feels_like": "feels like",
+           "humidity": "Humidity", "wind": "Wind"},
+}
+
+_KANA_OR_HANGUL = re.compile("[\u3040-\u30ff\uac00-\ud7af]")
+_HAN = re.compile("[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+
+def message_language(text):
+    """ "zh" for text with Chinese characters, "en" for text without any CJK, None for Japanese and Korean """
+    if _KANA_OR_HANGUL.search(text or ""):
+        return None
+    return "zh" if _HAN.search(text or "") else "en"
+
+
+def render_weather_card(result, language="zh"):
+    """
+    Format an OpenWeather response as a Markdown weather card, so that the reply needs no second GPT-4o call.
+
+    Parameters:
+    - result (str): The JSON string returned by query_openweather_function.
+    - language (str): The language of the user's message, see message_language().
+
+    Returns:
+    - str: The weather card, or None for error responses and languages without labels (GPT-4o answers those).
+    """
+    data = json.loads(result)
+    labels = WEATHER_CARD_LABELS.get(language)
+    if not isinstance(data, dict) or "main" not in data or labels is None:
+        return None
+    units = data.get("units", "metric")
+    temperature_unit = TEMPERATURE_UNITS.get(units, "°C")
+    wind_unit = "mph" if units == "imperial" else "m/s"
+    description = ", ".join(item.get("description", "") for item in data.get("weather", []))
+    main = data["main"]
+    return "\n".join([
+        f"**{data.get('name', '')} {labels['title']}**: {description}",
+        f"- {labels['temperature']}: {main.get('temp')}{temperature_unit} "
+        f"({labels['feels_like']} {main.get('feels_like')}{temperature_unit})",
+        f"- {labels['humidity']}: {main.get('humidity')}%",
+        f"- {labels['wind']}: {data.get('wind', {}).get('speed')} {wind_unit}",
+    ])
+
+
 ### ========================== 5. Real-time news query (based on NewsAPI) ========================== ###
 def query_news_function(topic="technology", language="zh", page_size=5, api_key=None):
     """
@@ -207,11 +524,9 @@ def query_news_function(topic="technology", language="zh", page_size=5, api_key=
     api_key = os.getenv("NEWS_API_KEY")
 
     if not api_key:
-        print("NewsAPI Key not set or invalid")
+        logger.warning("NewsAPI Key not set or invalid")
         return json.dumps({"error": "NewsAPI Key is missing or invalid."})
 
-    url = "https://newsapi.org/v2/everything"
-
     params = {
         "q": topic,
         "language": language,
@@ -219,7 +534,11 @@ def query_news_function(topic="technology", language="zh", page_size=5, api_key=
         "apiKey": api_key
     }
 
-    response = requests.get(url, params=params)
+    try:
+        response = news_http.get("/v2/everything", params=params)
+    except (CircuitOpenError, requests.RequestException) as e:
+        logger.warning("NewsAPI Error: %s", e)
+        return json.dumps({"error": f"Query failed: {e}"})
 
     if response.status_code == 200:
         data = response.json()
@@ -243,6 +562,234 @@ def query_news_function(topic="technology", language="zh", page_size=5, api_key=
         })
 
 
+def render_news_summary(result, language="zh"):
+    """
+    The news summary is already the finished Markdown reply; error responses and empty summaries (no articles
+    found) return None, so the LLM answers instead of an empty message
+    """
+    data = json.loads(result)
+    summary = data.get("summary") if isinstance(data, dict) else None
+    return summary if summary and summary.strip() else None
+
+
+### ========================== Tool response caches ========================== ###
+
+# Per-tool TTL in seconds; weather changes slowly, news a little faster
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", 600))
+NEWS_CACHE_TTL = float(os.getenv("NEWS_CACHE_TTL", 300))
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", 1024))
+
+weather_cache = TTLCache(maxsize=TOOL_CACHE_SIZE, ttl=WEATHER_CACHE_TTL)
+news_cache = TTLCache(maxsize=TOOL_CACHE_SIZE, ttl=NEWS_CACHE_TTL)
+
+# Chinese city names mapped to the English names OpenWeather uses, so both spellings share a cache entry
+CITY_ALIASES = {
+    "北京": "beijing", "上海": "shanghai", "广州": "guangzhou", "深圳": "shenzhen", "天津": "tianjin",
+    "重庆": "chongqing", "杭州": "hangzhou", "南京": "nanjing", "苏州": "suzhou", "武汉": "wuhan",
+    "成都": "chengdu", "西安": "xi'an", "长沙": "changsha", "青岛": "qingdao", "厦门": "xiamen",
+    "香港": "hong kong", "澳门": "macau", "台北": "taipei",
+}
+
+
+def normalize_text_argument(value):
+    """ Case-fold and collapse whitespace """
+    return " ".join(str(value).split()).casefold()
+
+
+def normalize_weather_arguments(arguments):
+    """ "Shanghai", "shanghai", "上海" and "上海市" all become "shanghai" """
+    city = normalize_text_argument(arguments["city"])
+    city = city[:-1] if city.endswith("市") else city
+    city = city[:-5] if city.endswith(" city") else city
+    return dict(arguments, city=CITY_ALIASES.get(city, city),
+                units=normalize_text_argument(arguments["units"]),
+                language=normalize_text_argument(arguments["language"]))
+
+
+def normalize_news_arguments(arguments):
+    return dict(arguments, topic=normalize_text_argument(arguments["topic"]),
+                language=normalize_text_argument(arguments["language"]),
+                page_size=int(arguments["page_size"]))
+
+
+def is_cacheable_tool_result(result):
+    """ Upstream errors are never cached """
+    try:
+        data = json.loads(result)
+    except (TypeError, json.JSONDecodeError):
+        return False
+    return isinstance(data, dict) and "error" not in data and "Error" not in data
+
+
+### ========================== Tool registry ========================== ###
+
+# The tool calls of one turn run in parallel on TOOL_WORKERS threads; each tool has a timeout in seconds
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", 16))
+WEATHER_TOOL_TIMEOUT = float(os.getenv("WEATHER_TOOL_TIMEOUT", 15))
+NEWS_TOOL_TIMEOUT = float(os.getenv("NEWS_TOOL_TIMEOUT", 15))
+
+# Render mode of each tool: "template" answers with the locally formatted result (weather card, news summary),
+# "llm" lets GPT-4o phrase the reply in a second call. A turn skips the second call only if all its tools use
+# "template" and all results could be rendered.
+WEATHER_RENDER_MODE = os.getenv("WEATHER_RENDER_MODE", "template")
+NEWS_RENDER_MODE = os.getenv("NEWS_RENDER_MODE", "template")
+TOOL_REPLIES = Counter("chatbot_tool_replies_total", "Replies to tool calls by how they were produced", ["mode"])
+
+tool_registry = ToolRegistry(max_workers=TOOL_WORKERS)
+
+
+def register_tools():
+    """ Register the tools with their current caches (create_app() calls this again after replacing them) """
+    tool_registry.register(query_openweather_function, cache=weather_cache, normalize=normalize_weather_arguments,
+                           should_cache=is_cacheable_tool_result, timeout=WEATHER_TOOL_TIMEOUT,
+                           render=render_weather_card if WEATHER_RENDER_MODE == "template" else None)
+    tool_registry.register(query_news_function, cache=news_cache, normalize=normalize_news_arguments,
+                           should_cache=is_cacheable_tool_result, timeout=NEWS_TOOL_TIMEOUT,
+                           render=render_news_summary if NEWS_RENDER_MODE == "template" else None)
+
+
+register_tools()
+
+
+### ========================== Response cache ========================== ###
+
+# Opt-in: answer a question asked again in the same conversation state from the cache, without calling GPT-4o
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1024))
+
+# A local sentence-transformers model (e.g. "sentence-transformers/all-MiniLM-L6-v2") to also match paraphrases
+# whose cosine similarity reaches RESPONSE_CACHE_SIMILARITY; empty to match normalized questions only
+RESPONSE_CACHE_EMBEDDING_MODEL = os.getenv("RESPONSE_CACHE_EMBEDDING_MODEL", "")
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.92))
+
+embedding_model = LazyModel(lambda: load_sentence_embedder(RESPONSE_CACHE_EMBEDDING_MODEL))
+response_cache = ResponseCache(
+    maxsize=RESPONSE_CACHE_SIZE,
+    ttl=RESPONSE_CACHE_TTL,
+    embed=(lambda text: embedding_model.get()(text)) if RESPONSE_CACHE_EMBEDDING_MODEL else None,
+    similarity_threshold=RESPONSE_CACHE_SIMILARITY
+)
+
+
+def response_cache_scope(user_input, context, system_messages):
+    """
+    The response cache scope of a question: everything the model sees before it (summary, earlier turns and
+    sentiment hints). Returns None if the reply must not come from or go into the cache.
+    """
+    if not RESPONSE_CACHE_ENABLED or not response_cache.is_cacheable_question(user_input):
+        return None
+    return context_scope(context[:-1] + system_messages)
+
+
+### ========================== Admission control ========================== ###
+
+# Chat requests per minute and burst size allowed per session (or IP address); 0 disables the rate limit
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", 20))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", 5))
+
+# Chat requests in the LLM pipeline (summary, completions, tools) at the same time, and how many more may wait
+# for a slot and for how many seconds. Limits are per worker process: keep LLM_MAX_CONCURRENCY plus
+# ADMISSION_QUEUE_SIZE below the worker's thread count so that other endpoints and rejections always find a thread.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 8))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 10))
+
+rate_limiter = RateLimiter(rate=RATE_LIMIT_PER_MINUTE / 60, burst=RATE_LIMIT_BURST) if RATE_LIMIT_PER_MINUTE else None
+llm_limiter = ConcurrencyLimiter(max_concurrent=LLM_MAX_CONCURRENCY, max_queue=ADMISSION_QUEUE_SIZE,
+                                 queue_timeout=ADMISSION_QUEUE_TIMEOUT)
+ADMISSION_REJECTIONS = Counter("chatbot_admission_rejections_total", "Chat requests rejected by admission control",
+                               ["reason"])
+
+
+def client_key():
+    """ The rate limit key: the session's client id, or the IP address for sessions without one """
+    return session.get("client_id") or request.remote_addr or "unknown"
+
+
+def admit_chat_request():
+    """
+    Apply the client's rate limit, then take a slot in the LLM pipeline (waiting in the queue if needed).
+
+    Returns:
+    - float: The slot's acquisition time, to pass to llm_limiter.release().
+
+    Raises:
+    - AdmissionRejected: The request must be answered with its status and Retry-After.
+    """
+    if rate_limiter is not None:
+        rate_limiter.acquire(client_key())
+    return llm_limiter.acquire()
+
+
+def rejection_response(rejection):
+    """ 429 or 503 with a Retry-After header """
+    ADMISSION_REJECTIONS.labels(reason=rejection.reason).inc()
+    log_sampled(logging.WARNING, "Chat request rejected: %s (retry after %ss)", rejection.reason,
+                rejection.retry_after)
+    response = jsonify({"error": "Too many requests, please retry later.", "reason": rejection.reason,
+                        "retry_after": rejection.retry_after})
+    response.status_code = rejection.status
+    response.headers["Retry-After"] = str(rejection.retry_after)
+    return response
+
+
+### ========================== Request budget ========================== ###
+
+# Per-request limits of /api/chat, counted from admission: the seconds after which the pipeline stops with a
+# partial answer, and the prompt and completion tokens all of its OpenAI calls may use together (0 disables either)
+CHAT_DEADLINE = float(os.getenv("CHAT_DEADLINE", 0))
+CHAT_TOKEN_BUDGET = int(os.getenv("CHAT_TOKEN_BUDGET", 0))
+# Stop the OpenAI calls of a request whose client has disconnected (closed tab, retry)
+CANCEL_ON_DISCONNECT = os.getenv("CANCEL_ON_DISCONNECT", "1") == "1"
+REQUESTS_ABORTED = Counter("chatbot_requests_aborted_total", "Chat requests stopped early", ["reason"])
+
+# Shown when a request is stopped before any part of the reply was generated
+PARTIAL_REPLY_NOTICE = "Sorry, I had to stop before I could answer this. Please try again."
+
+
+def new_request_budget():
+    """ The budget of the current chat request """
+    probe = connection_probe(request.environ) if CANCEL_ON_DISCONNECT else None
+    return RequestBudget(CHAT_DEADLINE, CHAT_TOKEN_BUDGET, probe)
+
+
+def abort_chat_turn(reason, partial_reply, chat_id, new_chat, user_message, sentiment, confidence):
+    """
+    End a chat turn that was stopped early.
+
+    A turn stopped by its deadline or token budget is saved with the partial reply (or a notice if nothing was
+    generated yet). A turn whose client disconnected is not saved, so no title is generated for a new chat.
+
+    Returns:
+    - str or None: The reply to send, or None if the client is gone.
+    """
+    REQUESTS_ABORTED.labels(reason=reason).inc()
+    if reason == "client_disconnected":
+        if new_chat:
+            record_aborted_call("title", reason, prompt_tokens=count_tokens(user_message["content"]))
+        return None
+    bot_reply = partial_reply or PARTIAL_REPLY_NOTICE
+    save_chat_turn(chat_id, new_chat, user_message, bot_reply, sentiment, confidence)
+    return bot_reply
+
+
+### ========================== Prompt assembly ========================== ###
+
+# Fixed system prompt at the start of every chat completion; with the tool definitions it forms the prompt prefix
+# that the provider's prompt cache can reuse across all chats
+SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT", "You are a helpful assistant. Reply in the language of the user's "
+                                           "message and use the tools for real-time weather and news.")
+# Savings estimates of /api/prompt_cache_stats: USD per million uncached and cached prompt tokens, and the
+# prefill time of a thousand uncached prompt tokens
+PROMPT_PRICE_PER_MTOK = float(os.getenv("PROMPT_PRICE_PER_MTOK", 2.5))
+CACHED_PROMPT_PRICE_PER_MTOK = float(os.getenv("CACHED_PROMPT_PRICE_PER_MTOK", 1.25))
+PREFILL_MS_PER_1K_TOKENS = float(os.getenv("PREFILL_MS_PER_1K_TOKENS", 25))
+
+prompt_builder = PromptBuilder(SYSTEM_PROMPT)
+prompt_cache = PromptCacheStats(PROMPT_PRICE_PER_MTOK, CACHED_PROMPT_PRICE_PER_MTOK, PREFILL_MS_PER_1K_TOKENS)
+
+
 ### ========================== 6. OpenAI Function Calling ========================== ###
 
 class AutoFunctionGenerator:
@@ -330,28 +877,28 @@ class AutoFunctionGenerator:
             response = self._call_openai_api(messages)
 
             if response is None:
-                print("Error: API returned None")
+                logger.error("API returned None")
                 return []
 
             if not hasattr(response, "choices") or not response.choices:
-                print("Error: No choices field in the API response")
+                logger.error("No choices field in the API response")
                 return []
 
             if not response or not response.choices:
-                print("Error: OpenAI API returned an empty response")
+                logger.error("OpenAI API returned an empty response")
                 continue
 
             content = response.choices[0].message.content.strip()
 
             if not content:
-                print("Error: OpenAI API returned an empty response")
+                logger.error("OpenAI API returned an empty response")
                 continue
 
             try:
                 # **Remove Markdown code blocks** (to prevent json.loads() from failing)
                 cleaned_content = re.sub(r"^```json\n|\n```$", "", content)
 
-                print("🔵 Parsed JSON Schema:", cleaned_content)
+                logger.debug("🔵 Parsed JSON Schema: %s", cleaned_content)
 
                 schema_json = json.loads(cleaned_content)  # parse JSON
 
@@ -365,8 +912,8 @@ class AutoFunctionGenerator:
                 functions.append(schema_json)
 
             except json.JSONDecodeError as e:
-                print(f"JSONDecodeError: {e}")
-                print(f"API response content: {content}")  # print API response
+                logger.error("JSONDecodeError: %s", e)
+                logger.error("API response content: %s", content)  # log API response
                 continue
 
         return functions
@@ -382,7 +929,8 @@ class AutoFunctionGenerator:
         - object: The response object from the API call.
         """
 
-        return client.chat.completions.create(
+        return timed_completion(
+            "schema",
             model="gpt-4o",
             messages=messages,
         )
@@ -404,12 +952,21 @@ class AutoFunctionGenerator:
                 return functions
             except Exception as e:
                 attempts += 1
-                print(f"Error occurred: {e}")
+                logger.warning("Error occurred: %s", e)
                 if attempts >= self.max_attempts:
-                    print("Reached maximum number of attempts. Terminating.")
+                    logger.error("Reached maximum number of attempts. Terminating.")
                     raise
                 else:
-                    print("Retrying...")
+                    logger.info("Retrying...")
+
+
+# External functions that require GPT-4o to call
+FUNCTION_LIST = tool_registry.functions()
+
+# Generated JSON Schemas are shared by all requests and only regenerated when a function's declaration changes
+# (the schema cache itself is created by create_app())
+def generate_function_schemas(functions_list):
+    return AutoFunctionGenerator(functions_list).auto_generate()
 
 
 ### ========================== 7. GPT-4o Chatbot ========================== ###
@@ -418,7 +975,8 @@ def generate_chat_title(first_message):
     Have GPT-4o generate a brief conversation topic based on the first sentence.
     """
     try:
-        response = client.chat.completions.create(
+        response = timed_completion(
+            "title",
             model="gpt-4o",
             messages=[
                 {"role": "system",
@@ -430,12 +988,296 @@ def generate_chat_title(first_message):
         )
         return response.choices[0].message.content.strip()
     except Exception as e:
-        print(f"Failed to generate chat title: {e}")
+        logger.warning("Failed to generate chat title: %s", e)
         return first_message[:20]  # Use the first 20 characters of the first sentence in case of failure
 
 
-@app.route('/api/chat', methods=['POST'])
+def summarize_conversation(previous_summary, messages, budget=None):
+    """
+    Fold older messages into the rolling summary of a conversation.
+
+    Parameters:
+    - previous_summary (str): The current summary (may be empty).
+    - messages (list): The messages that no longer fit in the context window, oldest first.
+    - budget (RequestBudget): The budget of the chat request that needs the summary.
+
+    Returns:
+    - str: The updated summary.
+    """
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    response = timed_completion(
+        "summary",
+        budget,
+        model="gpt-4o",
+        messages=[
+            {"role": "system",
+             "content": "Update the summary of a conversation between a user and an assistant with the new messages. Keep facts, names, preferences and open questions, drop pleasantries, and write it in the language of the conversation."},
+            {"role": "user", "content": f"Current summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"}
+        ],
+        temperature=0.3,
+        max_tokens=SUMMARY_MAX_TOKENS,
+    )
+    return response.choices[0].message.content.strip()
+
+
+context_builder = ContextBuilder(token_budget=CONTEXT_TOKEN_BUDGET, max_messages=MAX_HISTORY,
+                                 summarize=summarize_conversation)
+
+
+def build_chat_context(chat_id, messages, summary, summary_upto, budget=None):
+    """
+    Trim the history to the token budget, storing the rolling summary when it was extended. The summary call
+    counts against the request's budget; if the request stops, the older messages are left out unsummarized.
+    """
+    context, new_summary, new_upto = context_builder.build(
+        messages, summary, summary_upto,
+        summarize=lambda previous_summary, older: summarize_conversation(previous_summary, older, budget))
+    if new_upto != summary_upto:
+        chat_store.set_summary(chat_id, new_summary, new_upto)
+    return context
+
+
+# Pool for pipeline stages that overlap within a request, and for work deferred until after the reply
+background_executor = ThreadPoolExecutor(max_workers=int(os.getenv("BACKGROUND_WORKERS", 8)),
+                                         thread_name_prefix="chat-background")
+
+
+def update_chat_title(chat_id, first_message):
+    """ Replace the provisional title of a new chat with one generated by GPT-4o (runs after the reply) """
+    chat_store.rename_chat(chat_id, generate_chat_title(first_message))
+
+
+def build_system_messages(sentiment, confidence):
+    """ Adding sentiment analysis influence during GPT invocation """
+    system_messages = []
+    if sentiment == "NEGATIVE" and confidence > 0.75:
+        system_messages.append({"role": "system",
+                                "content": "The user may be feeling down; please try to respond with comfort and encouragement."})
+    elif sentiment == "POSITIVE":
+        system_messages.append({"role": "system",
+                                "content": "The user is in a great mood; please respond in a more enthusiastic and lively manner!"})
+    return system_messages
+
+
+def tool_calls_to_dicts(tool_calls):
+    """ The tool calls of a completion message in the request format of the chat completions API """
+    return [{"id": call.id, "type": "function",
+             "function": {"name": call.function.name, "arguments": call.function.arguments}}
+            for call in tool_calls]
+
+
+def run_tool_calls(tool_calls, timings, budget=None, user_input=""):
+    """
+    Run every tool call of a completion at the same time.
+
+    Parameters:
+    - tool_calls (list): The calls, as returned by tool_calls_to_dicts().
+    - timings (RequestTimings): The request's stage timings; the functions called become its "function" label.
+    - budget (RequestBudget): The request's budget; the calls are not started once it ran out, and are given
+      at most the time left until its deadline.
+    - user_input (str): The user's message; a locally rendered reply uses its language.
+
+    Returns:
+    - tuple: (messages, rendered reply). The messages are the assistant message with the calls followed by one
+      "tool" message per result, to append to the context of the follow-up completion. The rendered reply is
+      the locally formatted answer if every tool supports it (no follow-up completion is needed), else None.
+    """
+    for call in tool_calls:
+        log_sampled(logging.INFO, "✅ Trigger Function Calling: %s，Arguments: %s",
+                    call["function"]["name"], call["function"]["arguments"])
+    timings.function = ",".join(sorted({call["function"]["name"] for call in tool_calls}))
+    calls = [(call["function"]["name"], call["function"]["arguments"]) for call in tool_calls]
+    if budget is not None:
+        budget.check()
+    with timings.stage("tool"):
+        results = tool_registry.run_calls(calls, budget.remaining_seconds() if budget is not None else None)
+        rendered_reply = tool_registry.render(calls, results, message_language(user_input))
+    TOOL_REPLIES.labels(mode="template" if rendered_reply is not None else "llm").inc()
+
+    messages = [{"role": "assistant", "content": None, "tool_calls": tool_calls}] + [
+        {"role": "tool", "tool_call_id": call["id"], "content": format_tool_result(result)}
+        for call, result in zip(tool_calls, results)
+    ]
+    return messages, rendered_reply
+
+
+def save_chat_turn(chat_id, new_chat, user_message, bot_reply, sentiment, confidence):
+    """
+    Store the user message and the bot reply (only the two new messages are written).
+    A new chat starts with its first 20 characters as title; the GPT-4o title is generated in the background
+    so that it never delays the reply.
+    """
+    assistant_message = {
+        "role": "assistant",
+        "content": bot_reply,
+        "sentiment": sentiment,
+        "confidence": confidence
+    }
+    if new_chat:
+        chat_store.create_chat(chat_id, user_message["content"][:20])
+    chat_store.append_messages(chat_id, [user_message, assistant_message])
+    if new_chat:
+        background_executor.submit(update_chat_title, chat_id, user_message["content"])
+
+
+def wants_event_stream():
+    """ Stream the reply when the client asks for Server-Sent Events or sets "stream" in the request body """
+    if request.accept_mimetypes.best == "text/event-stream":
+        return True
+    return bool((request.get_json(silent=True) or {}).get("stream"))
+
+
+def sse_event(event, data):
+    """ Format a single Server-Sent Event with a JSON payload """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_chat_reply(chat_id, new_chat, user_message, prompt, tools, sentiment, confidence, timings, budget,
+                      cache_scope=None):
+    """
+    Generator behind the streaming mode of /api/chat.
+
+    The first completion is streamed with the tool definitions. Content deltas are forwarded to the browser
+    immediately; if the model calls tools instead, their names and arguments are accumulated, all of them are
+    run in parallel, and the second completion (the prompt extended by the tool messages) is streamed in the
+    same way. The full reply is saved to the
+    chat history once the stream ends, and put into the response cache under cache_scope if no tool was used.
+
+    The request's budget is checked between chunks. When it runs out, the reply streamed so far ends with a
+    "done" event marked partial; when the server closes the generator because the client went away, the
+    upstream stream is closed with it and nothing is saved.
+
+    Yields:
+    - str: "delta" events with the next piece of the reply, then a "done" (or "error") event.
+    """
+    reply_parts = []
+    active_call, streamed = None, 0
+    turn = (chat_id, new_chat, user_message, sentiment, confidence)
+    try:
+        with timings.stage("llm_first"), LLM_CALL_SECONDS.labels(call="first_stream").time(), \
+                client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=prompt,
+                    tools=tools,
+                    tool_choice="auto",
+                    parallel_tool_calls=True,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **budget_call_limits("first_stream", budget, prompt)
+                ) as stream:
+            active_call = "first_stream"
+
+            # Tool calls arrive in pieces: the first delta of a call carries its id and name, later ones append
+            # to its arguments
+            tool_calls = {}
+            finish_reason = None
+            for chunk in budgeted_chunks(stream, budget):
+                if chunk.usage:
+                    record_token_usage("first_stream", chunk.usage, budget)
+                if not chunk.choices:
+                    continue
+                streamed += 1
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta
+                if delta.tool_calls:
+                    for call_delta in delta.tool_calls:
+                        call = tool_calls.setdefault(call_delta.index, {
+                            "id": None, "type": "function", "function": {"name": None, "arguments": ""}})
+                        call["id"] = call["id"] or call_delta.id
+                        if call_delta.function:
+                            call["function"]["name"] = call["function"]["name"] or call_delta.function.name
+                            call["function"]["arguments"] += call_delta.function.arguments or ""
+                elif delta.content:
+                    reply_parts.append(delta.content)
+                    yield sse_event("delta", {"content": delta.content})
+            active_call = None
+        if budget.token_budget and finish_reason == "length":
+            raise budget.abort("token_budget")
+
+        # **The tool-call detour: run all tools in parallel, then stream the rendered or second response**
+        rendered_reply = None
+        if tool_calls:
+            tool_messages, rendered_reply = run_tool_calls([tool_calls[index] for index in sorted(tool_calls)],
+                                                           timings, budget, user_message["content"])
+        if rendered_reply is not None:
+            reply_parts.append(rendered_reply)
+            yield sse_event("delta", {"content": rendered_reply})
+        elif tool_calls:
+            with timings.stage("llm_second"), LLM_CALL_SECONDS.labels(call="second_stream").time(), \
+                    client.chat.completions.create(
+                        model="gpt-4o",
+                        messages=prompt + tool_messages,
+                        tools=tools,  # Unused, but part of the cached prompt prefix
+                        tool_choice="none",
+                        stream=True,
+                        stream_options={"include_usage": True},
+                        **budget_call_limits("second_stream", budget, prompt + tool_messages)
+                    ) as second_stream:
+                active_call, streamed = "second_stream", 0
+                for chunk in budgeted_chunks(second_stream, budget):
+                    if chunk.usage:
+                        record_token_usage("second_stream", chunk.usage, budget)
+                    if not chunk.choices:
+                        continue
+                    streamed += 1
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                    if chunk.choices[0].delta.content:
+                        reply_parts.append(chunk.choices[0].delta.content)
+                        yield sse_event("delta", {"content": chunk.choices[0].delta.content})
+                active_call = None
+            if budget.token_budget and finish_reason == "length":
+                raise budget.abort("token_budget")
+
+        bot_reply = "".join(reply_parts)
+        with timings.stage("history_save"):
+            save_chat_turn(chat_id, new_chat, user_message, bot_reply, sentiment, confidence)
+        turn = None
+        if cache_scope is not None and not tool_calls and bot_reply:
+            response_cache.store(cache_scope, user_message["content"], bot_reply)
+        yield sse_event("done", {"reply": bot_reply, "sentiment": sentiment, "confidence": confidence})
+
+    except RequestAborted as e:
+        if active_call is not None:
+            record_aborted_call(active_call, e.reason, completion_tokens=streamed)
+        bot_reply = abort_chat_turn(e.reason, "".join(reply_parts), *turn)
+        if bot_reply is not None:
+            if not reply_parts:
+                yield sse_event("delta", {"content": bot_reply})
+            yield sse_event("done", {"reply": bot_reply, "sentiment": sentiment, "confidence": confidence,
+                                     "partial": True, "stopped": e.reason})
+    except GeneratorExit:
+        # The server stopped the response because the client went away; leaving the `with` blocks above has
+        # closed the upstream stream, which ends the completion
+        if turn is not None:
+            if active_call is not None:
+                record_aborted_call(active_call, "client_disconnected", completion_tokens=streamed)
+            abort_chat_turn("client_disconnected", "", *turn)
+        raise
+    except Exception as e:
+        logger.exception("Streaming chat failed")
+        yield sse_event("error", {"error": f"An error occurred: {str(e)}"})
+    finally:
+        timings.observe()
+
+
+def stream_cached_reply(bot_reply, sentiment, confidence):
+    """ The streaming mode's events for a reply served from the response cache """
+    yield sse_event("delta", {"content": bot_reply})
+    yield sse_event("done", {"reply": bot_reply, "sentiment": sentiment, "confidence": confidence, "cached": True})
+
+
+def run_stage(timings, stage, function, *args):
+    """ Run one pipeline stage (possibly on another thread) and record its duration """
+    with timings.stage(stage):
+        return function(*args)
+
+
+@bp.route('/api/chat', methods=['POST'])
 def chat():
+    timings = RequestTimings(STAGE_SECONDS)
+    streaming = False
+    admitted_at = None
+    turn = None
     try:
         if not session.get("authenticated"):
             return jsonify({"error": "Unauthorized access"}), 401  # Unauthorized users are denied access
@@ -447,117 +1289,246 @@ def chat():
         if not user_input:
             return jsonify({"error": "Message cannot be empty"}), 400
 
-        # **Perform sentiment analysis**
-        sentiment, confidence = analyze_sentiment(user_input)
-        print(f"User Sentiment: {sentiment}, Confidence: {confidence:.2f}")  # print the result of sentiment analysis
+        # **Admission control: reject at once when the client is over its rate limit or the queue is full**
+        with timings.stage("admission"):
+            admitted_at = admit_chat_request()
+        budget = new_request_budget()
+
+        # **Run the independent stages concurrently: sentiment analysis, schema lookup and history load**
+        sentiment_started = time.perf_counter()
+        sentiment_future = sentiment_analyzer.submit(user_input)
+        sentiment_future.add_done_callback(
+            lambda future: timings.record("sentiment", time.perf_counter() - sentiment_started))
+        functions_future = background_executor.submit(run_stage, timings, "schema",
+                                                      schema_cache.get_schemas, FUNCTION_LIST)
+
+        # Load chat history: only the messages after the rolling summary (the title of a new chat is generated
+        # after the reply)
+        with timings.stage("history_load"):
+            summary_state = chat_store.get_summary(chat_id)
+            new_chat = summary_state is None
+            summary, summary_upto = summary_state or ("", 0)
+            messages = [] if new_chat else chat_store.get_messages(chat_id, start=summary_upto)
 
-        # Load chat history
-        history = load_chat_history()
-        if chat_id not in history:
-            history[chat_id] = {
-                "title": generate_chat_title(user_input),  # Use GPT to generate the title
-                "messages": []
-            }
+        # **Perform sentiment analysis**
+        sentiment, confidence = sentiment_future.result()
+        log_sampled(logging.INFO, "User Sentiment: %s, Confidence: %.2f", sentiment, confidence)
 
         # Add user messages to history
-        history[chat_id]["messages"].append({"role": "user", "content": user_input})
+        user_message = {"role": "user", "content": user_input}
+        messages.append(user_message)
+
+        # Keep the prompt within the token budget; only role and content are sent to the API
+        with timings.stage("context"):
+            context = build_chat_context(chat_id, messages, summary, summary_upto, budget)
 
         # **Adding sentiment analysis influence during GPT invocation**
-        system_messages = []
-        if sentiment == "NEGATIVE" and confidence > 0.75:
-            system_messages.append({"role": "system",
-                                    "content": "The user may be feeling down; please try to respond with comfort and encouragement."})
-        elif sentiment == "POSITIVE":
-            system_messages.append({"role": "system",
-                                    "content": "The user is in a great mood; please respond in a more enthusiastic and lively manner!"})
-
-        # parse Function Calling
-        function_list = [query_openweather_function,
-                         query_news_function]  # External functions that require GPT-4o to call
-        generator = AutoFunctionGenerator(function_list)  # generate JSON Schema
-        functions = generator.auto_generate()
-        print("Generated function descriptions:", functions)
+        system_messages = build_system_messages(sentiment, confidence)
+        turn = (chat_id, new_chat, user_message, sentiment, confidence)
+
+        # **Answer repeated questions from the response cache (opt-in; tool and time-sensitive answers excluded)**
+        cache_scope = response_cache_scope(user_input, context, system_messages)
+        if cache_scope is not None:
+            with timings.stage("response_cache"):
+                cached_reply = response_cache.lookup(cache_scope, user_input)
+            if cached_reply is not None:
+                timings.function = "cached"
+                with timings.stage("history_save"):
+                    save_chat_turn(chat_id, new_chat, user_message, cached_reply, sentiment, confidence)
+                if wants_event_stream():
+                    return Response(stream_cached_reply(cached_reply, sentiment, confidence),
+                                    mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+                return jsonify({"reply": cached_reply, "sentiment": sentiment, "confidence": confidence,
+                                "cached": True})
+
+        # parse Function Calling (JSON Schemas are generated once and served from the cache)
+        functions = functions_future.result()
+        log_sampled(logging.DEBUG, "Generated function descriptions: %s", functions)
 
         # **Check if functions is empty**
         if not functions:
             return jsonify({"error": "Function descriptions are empty."}), 500
+        # **Tools, fixed system prompt, history, then the per-turn hints: the prompt prefix stays cacheable**
+        tools = prompt_builder.tools(tool_registry.tool_definitions(functions))
+        prompt = prompt_builder.messages(context, system_messages)
+
+        # **Streaming mode: forward tokens as Server-Sent Events**
+        if wants_event_stream():
+            streaming = True
+            response = Response(
+                stream_with_context(stream_chat_reply(chat_id, new_chat, user_message, prompt, tools, sentiment,
+                                                      confidence, timings, budget, cache_scope)),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+            # The LLM slot is held until the stream ends (or the client goes away)
+            response.call_on_close(lambda: llm_limiter.release(admitted_at))
+            return response
 
         # **The first call to GPT-4o**
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=history[chat_id]["messages"] + system_messages,
-            functions=functions,
-            function_call="auto"
-        )
+        with timings.stage("llm_first"):
+            response = timed_completion(
+                "first",
+                budget,
+                model="gpt-4o",
+                messages=prompt,
+                tools=tools,
+                tool_choice="auto",
+                parallel_tool_calls=True
+            )
 
-        # **Print OpenAI API Responses**
-        print("🟢 OpenAI API Response:", response)
+        # **Log OpenAI API Responses**
+        log_sampled(logging.DEBUG, "🟢 OpenAI API Response: %s", response)
 
         response_message = response.choices[0].message
+        if truncated_by_budget(response, budget):
+            raise budget.abort("token_budget", response_message.content)
 
-        # **Check if an external function needs to be called**
-        if response_message.function_call:
-            function_name = response_message.function_call.name
-            function_args = json.loads(response_message.function_call.arguments)
+        # **Check if external functions need to be called (all of them run in parallel)**
+        if response_message.tool_calls:
+            tool_messages, rendered_reply = run_tool_calls(tool_calls_to_dicts(response_message.tool_calls),
+                                                           timings, budget, user_input)
 
-            print(f"✅ Trigger Function Calling: {function_name}，Arguments: {function_args}")
-
-            if function_name == "query_news_function" and "api_key" not in function_args:
-                function_args["api_key"] = os.getenv("NEWS_API_KEY")
-            if function_name == "query_openweather_function" and "api_key" not in function_args:
-                function_args["api_key"] = os.getenv("OPENWEATHER_API_KEY")
-
-            # **Call different APIs**
-            if function_name == "query_openweather_function":
-                function_response = query_openweather_function(**function_args)
-            elif function_name == "query_news_function":
-                function_response = query_news_function(**function_args)
+            if rendered_reply is not None:
+                # **Directly renderable results (weather card, news summary) need no second call**
+                bot_reply = rendered_reply
             else:
-                function_response = json.dumps({"error": f"Unknown Function: {function_name}"})
-
-            # **Parse the API response**
-            try:
-                function_response_data = json.loads(function_response)
-                if isinstance(function_response_data, dict) and "summary" in function_response_data:
-                    function_response = function_response_data["summary"]
-                elif isinstance(function_response_data, dict):
-                    function_response = json.dumps(function_response_data, ensure_ascii=False, indent=2)
-            except json.JSONDecodeError:
-                pass
-
-            # **The second call to GPT-4o, let it process the return value of the function call**
-            second_response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=history[chat_id]["messages"] + [
-                    {"role": "function", "name": function_name, "content": function_response}
-                ]
-            )
-
-            bot_reply = second_response.choices[0].message.content
+                # **The second call to GPT-4o, let it process the return values of the tool calls**
+                with timings.stage("llm_second"):
+                    second_response = timed_completion(
+                        "second",
+                        budget,
+                        model="gpt-4o",
+                        messages=prompt + tool_messages,
+                        tools=tools,  # Unused, but part of the cached prompt prefix
+                        tool_choice="none"
+                    )
+                bot_reply = second_response.choices[0].message.content
+                if truncated_by_budget(second_response, budget):
+                    raise budget.abort("token_budget", bot_reply)
         else:
-            print("❌ OpenAI did not trigger Function Calling, returned standard chat content")
+            log_sampled(logging.DEBUG, "❌ OpenAI did not trigger Function Calling, returned standard chat content")
             bot_reply = response_message.content
+            if cache_scope is not None and bot_reply:
+                response_cache.store(cache_scope, user_input, bot_reply)
 
-        # **Update chat history**
-        history[chat_id]["messages"].append({
-            "role": "assistant",
-            "content": bot_reply,
-            "sentiment": sentiment,
-            "confidence": confidence
-        })
-
-        # *Store chat history**
-        save_chat_history(history)
+        # **Update and store chat history**
+        with timings.stage("history_save"):
+            save_chat_turn(chat_id, new_chat, user_message, bot_reply, sentiment, confidence)
 
         return jsonify({"reply": bot_reply, "sentiment": sentiment, "confidence": confidence})
 
+    except AdmissionRejected as e:
+        return rejection_response(e)
+    except RequestAborted as e:
+        # **Stopped early: a partial answer, or nothing at all if the client has gone away**
+        bot_reply = abort_chat_turn(e.reason, e.partial_reply, *turn)
+        if bot_reply is None:
+            return jsonify({"error": "Client closed the request"}), 499
+        return jsonify({"reply": bot_reply, "sentiment": sentiment, "confidence": confidence, "partial": True,
+                        "stopped": e.reason})
     except Exception as e:
+        logger.exception("Chat request failed")
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+    finally:
+        if not streaming:
+            timings.observe()
+            if admitted_at is not None:
+                llm_limiter.release(admitted_at)
+
+
+@bp.route('/api/tool_cache_stats', methods=['GET'])
+def tool_cache_stats():
+    """ Hit and miss counters of the weather and news caches """
+    return jsonify({"weather": weather_cache.stats(), "news": news_cache.stats()})
+
+
+@bp.route('/api/response_cache_stats', methods=['GET'])
+def response_cache_stats():
+    """ Exact and semantic hits, misses, stores and evictions of the response cache """
+    return jsonify(dict(response_cache.stats(), enabled=RESPONSE_CACHE_ENABLED))
+
+
+@bp.route('/api/archive_stats', methods=['GET'])
+def archive_stats():
+    """ Size and compression of the chat archive, and the chats archived and restored by this process """
+    if not isinstance(chat_store, ArchivingChatStore):
+        return jsonify({"enabled": False})
+    return jsonify(dict(chat_store.stats(), enabled=True, idle_days=CHAT_ARCHIVE_IDLE_DAYS))
+
+
+@bp.route('/api/prompt_cache_stats', methods=['GET'])
+def prompt_cache_stats():
+    """ Prompt cache hit ratio per OpenAI call and the estimated cost and latency it saved """
+    return jsonify(prompt_cache.report())
+
+
+@bp.route('/api/admission_stats', methods=['GET'])
+def admission_stats():
+    """ LLM slots in use, queue depth and rejections, and the number of rate-limited clients """
+    return jsonify({"llm": llm_limiter.stats(), "rate_limit": rate_limiter.stats() if rate_limiter else None})
+
+
+@bp.route('/ready', methods=['GET'])
+def ready():
+    """ Readiness probe: 503 while the sentiment model is still warming up """
+    state = sentiment_model.state
+    if state == "ready" or (state == "cold" and SENTIMENT_LOAD_MODE == "lazy"):
+        return jsonify({"status": state, "backend": SENTIMENT_BACKEND})
+    return jsonify({"status": state, "backend": SENTIMENT_BACKEND, "error": sentiment_model.error}), 503
+
+
+@bp.route('/api/sentiment_stats', methods=['GET'])
+def sentiment_stats():
+    """ Memo and pre-classifier hits, and queue depth, batch size and per-batch latency of the sentiment batcher """
+    return jsonify(dict(sentiment_batcher.stats(), **sentiment_analyzer.stats()))
+
+
+# Component statistics exported alongside the request metrics
+CallbackMetric("chatbot_sentiment_queue_depth", "Texts waiting for the sentiment batcher",
+               lambda: sentiment_batcher.stats()["queue_depth"])
+CallbackMetric("chatbot_sentiment_batches_total", "Sentiment forward passes",
+               lambda: sentiment_batcher.stats()["batches_total"], type="counter")
+CallbackMetric("chatbot_sentiment_batch_size_avg", "Average texts per sentiment forward pass",
+               lambda: sentiment_batcher.stats()["batch_size_avg"])
+CallbackMetric("chatbot_sentiment_batch_latency_ms_avg", "Average sentiment forward pass latency",
+               lambda: sentiment_batcher.stats()["batch_latency_ms_avg"])
+for _name, _doc in (("memo_hits", "Sentiment requests answered from the memo"),
+                   ("preclassified", "Sentiment requests answered by the pre-classifier"),
+                   ("chunked", "Long sentiment inputs split into chunks"),
+                   ("model_texts", "Texts sent to the sentiment model")):
+    CallbackMetric(f"chatbot_sentiment_{_name}_total", _doc, lambda name=_name: sentiment_analyzer.stats()[name],
+                   type="counter")
+for _name in ("hits", "misses", "coalesced"):
+    CallbackMetric(f"chatbot_tool_cache_{_name}_total", f"Tool cache {_name}",
+                   lambda name=_name: {("weather",): weather_cache.stats()[name], ("news",): news_cache.stats()[name]},
+                   type="counter", labelnames=["tool"])
+
+for _name in ("hits", "semantic_hits", "misses", "evictions"):
+    CallbackMetric(f"chatbot_response_cache_{_name}_total", f"Response cache {_name.replace('_', ' ')}",
+                   lambda name=_name: response_cache.stats()[name], type="counter")
+CallbackMetric("chatbot_admission_in_flight", "Chat requests holding an LLM slot",
+               lambda: llm_limiter.stats()["in_flight"])
+CallbackMetric("chatbot_admission_queue_depth", "Chat requests waiting for an LLM slot",
+               lambda: llm_limiter.stats()["queue_depth"])
+CallbackMetric("chatbot_admission_queued_total", "Chat requests that had to wait for an LLM slot",
+               lambda: llm_limiter.stats()["queued"], type="counter")
+CallbackMetric("chatbot_admission_hold_seconds_avg", "Average time a chat request holds an LLM slot",
+               lambda: llm_limiter.stats()["hold_seconds_avg"])
+CallbackMetric("chatbot_prompt_cache_hit_ratio", "Share of prompt tokens served from the provider's prompt cache",
+               lambda: prompt_cache.report()["total"]["hit_ratio"])
+CallbackMetric("chatbot_response_cache_size", "Replies in the response cache", lambda: response_cache.stats()["size"])
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """ Prometheus scrape endpoint """
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 
 ### ========================== 8. Clear chat history ========================== ###
 
-@app.route('/api/clear', methods=['POST'])
+@bp.route('/api/clear', methods=['POST'])
 def clear_chat():
     """
     Clear user chat history
@@ -568,6 +1539,88 @@ def clear_chat():
 
 ### ==========================  9. Start the Flask server ========================== ###
 
+def create_app(config=None, warm_up=True):
+    """
+    Application factory: create the Flask app and the services it uses.
+
+    Parameters:
+    - config (dict): Flask configuration overrides, e.g. {"TESTING": True}.
+    - warm_up (bool): Start loading the sentiment model according to SENTIMENT_LOAD_MODE. Pass False in
+      processes that never serve requests (such as the debug reloader's watcher process).
+
+    Returns:
+    - Flask: The application.
+    """
+    global client, chat_store, schema_cache, weather_cache, news_cache
+
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # Initialize Flask
+    app = Flask(__name__)
+    CORS(app)
+    app.secret_key = os.getenv("FLASK_SECRET_KEY", "your_default_secret_key")  # Used for session authentication
+    app.config.update(config or {})
+    if "FLASK_SECRET_KEY" not in os.environ:
+        # Sessions are signed cookies: every worker and node must use the same key to accept them
+        logger.warning("FLASK_SECRET_KEY is not set, using the insecure default key")
+
+    # Initialize OpenAI API
+    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), timeout=LLM_TIMEOUT)
+
+    shared_redis = connect_redis(REDIS_URL) if REDIS_URL else None
+
+    if CHAT_STORE_BACKEND == "json":
+        chat_store = create_chat_store("json", path=CHAT_HISTORY_FILE)
+    elif CHAT_STORE_BACKEND == "redis":
+        if shared_redis is None:
+            raise RuntimeError("CHAT_STORE_BACKEND=redis requires REDIS_URL")
+        chat_store = create_chat_store("redis", redis=shared_redis, prefix=KEY_PREFIX, import_file=CHAT_HISTORY_FILE)
+    else:
+        chat_store = create_chat_store(CHAT_STORE_BACKEND, path=CHAT_STORE_FILE, import_file=CHAT_HISTORY_FILE)
+
+    # An existing archive stays readable after archiving is switched off
+    if CHAT_ARCHIVE_IDLE_DAYS > 0 or os.path.isdir(CHAT_ARCHIVE_DIR):
+        chat_store = ArchivingChatStore(chat_store, ChatArchive(CHAT_ARCHIVE_DIR))
+        if warm_up and CHAT_ARCHIVE_IDLE_DAYS > 0:
+            chat_store.start_sweeper(CHAT_ARCHIVE_IDLE_DAYS * 86400, CHAT_ARCHIVE_SWEEP_INTERVAL)
+
+    if shared_redis is not None:
+        schema_cache = RedisFunctionSchemaCache(generate_function_schemas, shared_redis,
+                                                key=f"{KEY_PREFIX}function_schemas")
+        weather_cache = RedisTTLCache(shared_redis, f"{KEY_PREFIX}tool:weather", maxsize=TOOL_CACHE_SIZE,
+                                      ttl=WEATHER_CACHE_TTL)
+        news_cache = RedisTTLCache(shared_redis, f"{KEY_PREFIX}tool:news", maxsize=TOOL_CACHE_SIZE, ttl=NEWS_CACHE_TTL)
+        register_tools()
+    else:
+        schema_cache = FunctionSchemaCache(generate_function_schemas)
+
+    app.register_blueprint(bp)
+
+    if warm_up and SENTIMENT_LOAD_MODE == "preload":
+        sentiment_model.load()
+    elif warm_up and SENTIMENT_LOAD_MODE == "background":
+        sentiment_model.warm_up()
+    if warm_up and RESPONSE_CACHE_ENABLED and RESPONSE_CACHE_EMBEDDING_MODEL:
+        embedding_model.warm_up()
+
+    return app
+
+
+_default_app = None
+
+
+def __getattr__(name):
+    """ `app` is created on first access, so `from app import app` and `gunicorn app:app` keep working """
+    global _default_app
+    if name == "app":
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
+    # With debug=True the reloader's watcher process re-runs this module; only the serving child warms up the model
+    app = create_app(warm_up=os.environ.get("WERKZEUG_RUN_MAIN") == "true")
     app.run(host='0.0.0.0', port=port, debug=True, threaded=True)
@@ -0,0 +1 @@
+"""Offline benchmark harness: stub upstream servers and load scenarios for the chatbot."""
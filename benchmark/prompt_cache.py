@@ -0,0 +1,106 @@
+"""
+Prompt cache report: how much of the app's prompts the provider's automatic prompt caching can reuse.
+
+Starts the stub upstreams with simulated prefix caching (see benchmark.stubs) and a fresh app whose store is
+seeded with --conversations chats of --history messages, continues each chat for --turns turns (plain questions
+mixed with weather and news questions, so both the first and the follow-up completion occur), then reads
+/api/prompt_cache_stats and writes it to the report together with the latency of each turn number. The seeded
+history makes the prompts long enough to be cached (at least 1024 tokens). Against the real API, the same
+numbers are available from a running app at /api/prompt_cache_stats.
+
+    python -m benchmark.prompt_cache --conversations 20 --turns 8 --output prompt-cache-report.json
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark.run import (ACCESS_TOKEN, QUESTION, SERVER_COMMANDS, AppProcess, login, percentile, timed_chat,
+                           write_history_file)
+from benchmark.stubs import StubConfig, start_stub_server
+
+# The questions of a conversation, in turn order (cycled)
+TURNS = [QUESTION, "How is the weather in Shanghai?", "Thank you! Could you explain that in more detail?",
+         "Any tech news today?", "What are the most common applications of it?"]
+
+
+def run_conversation(base_url, conversation, turns):
+    """ Hold one conversation; returns the latency in seconds of each turn (None for failed turns) """
+    session = login(base_url)
+    latencies = []
+    for turn in range(turns):
+        ok, total, _ = timed_chat(session, base_url, TURNS[turn % len(TURNS)], f"seed_{conversation}")
+        latencies.append(total if ok else None)
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the prompt cache hit ratio against a caching stub")
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--history", type=int, default=40, help="Messages seeded into each chat")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--openai-latency-ms", type=float, default=200)
+    parser.add_argument("--prefill-ms-per-1k-tokens", type=float, default=100,
+                        help="Simulated prefill time of uncached prompt tokens")
+    parser.add_argument("--server", default="dev", help=f"One of {', '.join(SERVER_COMMANDS)} or a command line")
+    parser.add_argument("--output", default="prompt-cache-report.json")
+    args = parser.parse_args(argv)
+
+    stub_config = StubConfig(args.openai_latency_ms, token_delay_ms=0, tool_latency_ms=10,
+                             prefill_ms_per_1k_tokens=args.prefill_ms_per_1k_tokens, prefix_cache=True)
+    stub_server = start_stub_server(stub_config)
+    stub_url = f"http://127.0.0.1:{stub_server.server_port}"
+    env = {
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": stub_url + "/v1",
+        "OPENWEATHER_BASE_URL": stub_url,
+        "NEWS_API_BASE_URL": stub_url,
+        "OPENWEATHER_API_KEY": "benchmark",
+        "NEWS_API_KEY": "benchmark",
+        "ACCESS_TOKEN": ACCESS_TOKEN,
+        "LOG_LEVEL": "WARNING",
+        "RATE_LIMIT_PER_MINUTE": "0",
+        "SENTIMENT_BACKEND": "stub",
+        # Every turn goes to the completions API
+        "WEATHER_RENDER_MODE": "llm",
+        "NEWS_RENDER_MODE": "llm",
+        "PREFILL_MS_PER_1K_TOKENS": str(args.prefill_ms_per_1k_tokens),
+    }
+    workdir = tempfile.mkdtemp(prefix="bench-prompt-cache-")
+    write_history_file(os.path.join(workdir, "chat_history.json"), args.conversations, args.history)
+    try:
+        with AppProcess(SERVER_COMMANDS.get(args.server, args.server).split(), env, workdir) as app_process:
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                conversations = list(pool.map(lambda i: run_conversation(app_process.base_url, i, args.turns),
+                                              range(args.conversations)))
+            stats = login(app_process.base_url).get(app_process.base_url + "/api/prompt_cache_stats",
+                                                    timeout=10).json()
+    finally:
+        stub_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "settings": {key: getattr(args, key) for key in
+                     ("conversations", "turns", "history", "concurrency", "openai_latency_ms",
+                      "prefill_ms_per_1k_tokens")},
+        "errors": sum(latency is None for latencies in conversations for latency in latencies),
+        "latency_ms_by_turn": {
+            turn + 1: {f"p{p}": round(percentile(values, p) * 1000, 2) if values else None for p in (50, 95)}
+            for turn, values in enumerate([[latencies[turn] for latencies in conversations
+                                            if latencies[turn] is not None] for turn in range(args.turns)])
+        },
+        "prompt_cache": stats,
+        # The stub's own count, independent of the app's accounting
+        "upstream_prompt_tokens": dict(stub_config.prompt_tokens),
+    }
+    print(json.dumps(report["prompt_cache"]["total"], indent=2))
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
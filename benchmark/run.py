@@ -0,0 +1,297 @@
+"""
+Offline benchmark of the chatbot against local stub upstreams.
+
+Starts the stub OpenAI/OpenWeather/NewsAPI server, starts the app in a scratch directory with its upstream URLs
+pointed at the stubs and the stub sentiment backend (so no model download or network access is needed), runs
+each scenario with a pool of concurrent clients and writes a JSON report with p50/p95/p99 latency and
+throughput per scenario. With several --servers every scenario is run against each of
+them, e.g. to compare the development server with the production entry point:
+
+    python -m benchmark.run --requests 200 --concurrency 16 --servers dev,serve --output benchmark-report.json
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmark.stubs import StubConfig, start_stub_server
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ACCESS_TOKEN = "benchmark"
+
+# Named server commands for --servers; "{port}" is replaced by the chosen port
+SERVER_COMMANDS = {
+    "dev": f"{sys.executable} {os.path.join(REPO_DIR, 'app.py')}",
+    "serve": f"{sys.executable} {os.path.join(REPO_DIR, 'serve.py')} --bind 127.0.0.1:{{port}} --workers 2 --threads 16",
+}
+
+QUESTION = "Could you please explain to me in detail what natural language processing is?"
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile of a list of numbers """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def write_history_file(path, chats, messages_per_chat):
+    """ Seed a legacy chat_history.json, which the app imports into its store on start """
+    history = {}
+    for chat in range(chats):
+        messages = []
+        for turn in range(messages_per_chat // 2):
+            messages.append({"role": "user", "content": f"Question {turn} of chat {chat}: {QUESTION}"})
+            messages.append({"role": "assistant", "content": f"Answer {turn}. " * 40,
+                             "sentiment": "POSITIVE", "confidence": 0.99})
+        history[f"seed_{chat}"] = {"title": f"Seeded chat {chat}", "messages": messages}
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(history, file, ensure_ascii=False)
+
+
+class AppProcess:
+    """
+    The app under test, running in its own scratch directory.
+
+    Attributes:
+    - command (list): Command line used to start the server; "{port}" is replaced by the chosen port.
+    - env (dict): Extra environment variables.
+    """
+
+    def __init__(self, command, env, workdir):
+        self.port = free_port()
+        self.command = [part.replace("{port}", str(self.port)) for part in command]
+        pythonpath = os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")]))
+        self.env = dict(os.environ, PORT=str(self.port), PYTHONPATH=pythonpath, **env)
+        self.workdir = workdir
+        self.process = None
+        self.base_url = f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.log = open(os.path.join(self.workdir, "server.log"), "w")
+        self.process = subprocess.Popen(self.command, cwd=self.workdir, env=self.env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + 180
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with {self.process.returncode}, see {self.log.name}")
+            try:
+                # /ready answers 503 until the sentiment model has been loaded
+                if requests.get(self.base_url + "/ready", timeout=5).status_code == 200:
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.25)
+        raise RuntimeError("Server did not start within 180 seconds")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+        return False
+
+
+def login(base_url):
+    session = requests.Session()
+    session.post(base_url + "/login", data={"password": ACCESS_TOKEN}, allow_redirects=False, timeout=10)
+    return session
+
+
+def timed_chat(session, base_url, message, chat_id, stream=False):
+    """ Send one chat message; returns (ok, total seconds, seconds to first byte) """
+    started = time.perf_counter()
+    headers = {"Accept": "text/event-stream"} if stream else {}
+    response = session.post(base_url + "/api/chat", json={"message": message, "chat_id": chat_id},
+                            headers=headers, stream=stream, timeout=120)
+    first_byte = None
+    ok = response.status_code == 200
+    if stream:
+        for line in response.iter_lines():
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            if line.startswith(b"event: error"):
+                ok = False
+    else:
+        response.content
+        first_byte = time.perf_counter() - started
+        ok = ok and "reply" in response.json()
+    return ok, time.perf_counter() - started, first_byte
+
+
+# Each scenario maps a request number to the call it makes; "setup" optionally seeds the scratch directory and
+# "env" sets extra environment variables of the app
+SCENARIOS = {
+    "distinct_chats": {
+        "description": "Plain questions, every request in its own new chat",
+        "request": lambda session, url, i, run: timed_chat(session, url, QUESTION, f"bench_{run}_{i}"),
+    },
+    "streaming": {
+        "description": "Plain questions over Server-Sent Events (first_byte is time to first event)",
+        "request": lambda session, url, i, run: timed_chat(session, url, QUESTION, f"stream_{run}_{i}", stream=True),
+    },
+    "long_history": {
+        "description": "Questions appended to seeded chats with 200 messages each",
+        "setup": {"chats": 50, "messages_per_chat": 200},
+        "request": lambda session, url, i, run: timed_chat(session, url, QUESTION, f"seed_{i % 50}"),
+    },
+    "tool_cache_hit": {
+        "description": "The same weather question over and over",
+        "request": lambda session, url, i, run: timed_chat(session, url, "How is the weather in Shanghai?",
+                                                          f"weather_{run}_{i}"),
+    },
+    "tool_cache_miss": {
+        "description": "Weather questions for a different city every time",
+        "request": lambda session, url, i, run: timed_chat(session, url, f"How is the weather in city{run}x{i}?",
+                                                          f"weather_miss_{run}_{i}"),
+    },
+    "parallel_tools": {
+        "description": "Two weather lookups and a news search requested in one question",
+        "request": lambda session, url, i, run: timed_chat(
+            session, url, f"What is the weather in city{run}x{i} and shanghai, and any tech news?",
+            f"parallel_{run}_{i}"),
+    },
+    "partial_reply": {
+        "description": "Plain questions under a token budget that cuts the reply short (finish_reason \"length\")",
+        "env": {"CHAT_TOKEN_BUDGET": "120"},
+        "request": lambda session, url, i, run: timed_chat(session, url, QUESTION, f"partial_{run}_{i}"),
+    },
+    "growing_history": {
+        "description": "Sidebar refreshes and new chats against a store seeded with 2000 chats",
+        "setup": {"chats": 2000, "messages_per_chat": 10},
+        "request": lambda session, url, i, run: (
+            timed_get(session, url + "/api/get_chats") if i % 2 else
+            timed_chat(session, url, QUESTION, f"grow_{run}_{i}")),
+    },
+}
+
+
+def timed_get(session, url):
+    started = time.perf_counter()
+    response = session.get(url, timeout=60)
+    elapsed = time.perf_counter() - started
+    return response.status_code == 200, elapsed, elapsed
+
+
+def run_scenario(name, scenario, args, stub_url, server_command):
+    """ Start a fresh app for the scenario, drive it and summarize the latencies """
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    try:
+        setup = scenario.get("setup")
+        if setup:
+            write_history_file(os.path.join(workdir, "chat_history.json"), setup["chats"], setup["messages_per_chat"])
+
+        env = {
+            "OPENAI_API_KEY": "sk-benchmark",
+            "OPENAI_BASE_URL": stub_url + "/v1",
+            "OPENWEATHER_BASE_URL": stub_url,
+            "NEWS_API_BASE_URL": stub_url,
+            "OPENWEATHER_API_KEY": "benchmark",
+            "NEWS_API_KEY": "benchmark",
+            "ACCESS_TOKEN": ACCESS_TOKEN,
+            "LOG_LEVEL": "WARNING",
+            # One benchmark thread sends far more requests than a person would
+            "RATE_LIMIT_PER_MINUTE": "0",
+            # No model download: every scenario runs offline
+            "SENTIMENT_BACKEND": "stub",
+            **scenario.get("env", {}),
+        }
+        with AppProcess(server_command, env, workdir) as app_process:
+            local = threading.local()
+
+            def one_request(i):
+                if not hasattr(local, "session"):
+                    local.session = login(app_process.base_url)
+                try:
+                    return scenario["request"](local.session, app_process.base_url, i, name)
+                except requests.RequestException:
+                    return False, None, None
+
+            # Warm-up: schema generation, model load and connection setup are not part of the measurement
+            for i in range(args.warmup):
+                one_request(-1 - i)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                results = list(pool.map(one_request, range(args.requests)))
+            wall_time = time.perf_counter() - started
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [total for ok, total, _ in results if ok]
+    first_bytes = [first for ok, _, first in results if ok and first is not None]
+    to_ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        "description": scenario["description"],
+        "requests": len(results),
+        "errors": sum(1 for ok, _, _ in results if not ok),
+        "throughput_rps": round(len(latencies) / wall_time, 2) if wall_time else None,
+        "latency_ms": {f"p{p}": to_ms(percentile(latencies, p)) for p in (50, 95, 99)},
+        "first_byte_ms": {f"p{p}": to_ms(percentile(first_bytes, p)) for p in (50, 95, 99)},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline chatbot benchmark with stub upstreams")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenario names")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests before each scenario")
+    parser.add_argument("--openai-latency-ms", type=float, default=200)
+    parser.add_argument("--token-delay-ms", type=float, default=5)
+    parser.add_argument("--tool-latency-ms", type=float, default=50)
+    parser.add_argument("--servers", default="dev",
+                        help=f"Comma-separated servers to compare: {', '.join(SERVER_COMMANDS)} or a command line "
+                             f"(\"{{port}}\" is replaced by the port, which is also set as PORT)")
+    parser.add_argument("--label", default="", help="Free-form label stored in the report, e.g. a commit hash")
+    parser.add_argument("--output", default="benchmark-report.json")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directories (server logs)")
+    args = parser.parse_args(argv)
+
+    stub_config = StubConfig(args.openai_latency_ms, args.token_delay_ms, args.tool_latency_ms)
+    stub_server = start_stub_server(stub_config)
+    stub_url = f"http://127.0.0.1:{stub_server.server_port}"
+
+    report = {
+        "label": args.label,
+        "settings": {key: getattr(args, key) for key in
+                     ("requests", "concurrency", "openai_latency_ms", "token_delay_ms", "tool_latency_ms")},
+        "servers": {},
+    }
+    for server in args.servers.split(","):
+        server_command = SERVER_COMMANDS.get(server, server)
+        results = report["servers"][server] = {"server_command": server_command, "scenarios": {}}
+        for name in args.scenarios.split(","):
+            print(f"Running {name} on {server}...", flush=True)
+            results["scenarios"][name] = run_scenario(name, SCENARIOS[name], args, stub_url, server_command.split())
+            print(json.dumps(results["scenarios"][name]), flush=True)
+    report["upstream_requests"] = dict(stub_config.requests)
+    stub_server.shutdown()
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Latency of the chat search on a synthetic history.
+
+Builds an SQLite chat store with --messages messages of mixed English and Chinese text (word frequencies follow
+Zipf's law, like real text) and times a set of queries against it: common and rare words, multi-word queries,
+prefixes and CJK words.
+
+    python -m benchmark.search --messages 100000 --output search-report.json
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmark.run import percentile
+from chat_store import create_chat_store
+
+ENGLISH_WORDS = ("the weather in shanghai is sunny today please explain natural language processing model python "
+                 "flask server error news about electric cars sentiment analysis thank you very much what how why "
+                 "could would great bad slow fast answer question history search index database cache token "
+                 "summary title chat message reply stream tool function call latency memory").split()
+CHINESE_WORDS = ("今天 天气 怎么样 上海 北京 新闻 人工智能 机器学习 模型 自然语言 处理 谢谢 你好 问题 回答 "
+                 "电动车 价格 数据库 搜索 索引 缓存 延迟 内存 服务器 错误 情感 分析").split()
+
+QUERIES = ["weather", "shanghai sunny", "natural language processing", "electric cars news", "latency memory",
+           "pyth", "天气", "人工智能", "上海 weather", "自然语言处理", "nonexistentword"]
+
+
+def synthetic_text(rng, vocabulary, weights):
+    words = rng.choices(vocabulary, weights=weights, k=rng.randint(5, 40))
+    # Mixed-language messages: Chinese words are written without spaces, like real text
+    return "".join(word if word in CHINESE_WORDS else f" {word} " for word in words).strip()
+
+
+def build_store(path, messages, messages_per_chat, seed):
+    rng = random.Random(seed)
+    # The real words are the frequent head of the distribution, rare synthetic words its long tail
+    head = ENGLISH_WORDS + CHINESE_WORDS
+    rng.shuffle(head)
+    vocabulary = head + [f"term{i}" for i in range(5000)]
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    store = create_chat_store("sqlite", path=path)
+    for chat in range(messages // messages_per_chat):
+        chat_id = f"chat_{chat}"
+        store.create_chat(chat_id, synthetic_text(rng, vocabulary, weights)[:30])
+        store.append_messages(chat_id, [{"role": "user" if i % 2 == 0 else "assistant",
+                                         "content": synthetic_text(rng, vocabulary, weights)}
+                                        for i in range(messages_per_chat)])
+    return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time /api/search_chats queries on a synthetic history")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--messages-per-chat", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=50, help="Runs of each query")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="search-report.json")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="bench-search-") as workdir:
+        started = time.perf_counter()
+        store = build_store(os.path.join(workdir, "chats.db"), args.messages, args.messages_per_chat, args.seed)
+        report = {"messages": args.messages, "build_seconds": round(time.perf_counter() - started, 1),
+                  "queries": {}}
+        print(f"Indexed {args.messages} messages in {report['build_seconds']}s", flush=True)
+
+        for query in QUERIES:
+            latencies = []
+            for _ in range(args.repeat):
+                query_started = time.perf_counter()
+                results = store.search(query)
+                latencies.append(time.perf_counter() - query_started)
+            report["queries"][query] = dict(
+                {f"p{p}_ms": round(percentile(latencies, p) * 1000, 2) for p in (50, 95, 99)}, results=len(results))
+            print(json.dumps({query: report["queries"][query]}, ensure_ascii=False), flush=True)
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Parity and speed comparison of the sentiment backends.
+
+Each backend runs in its own process, so that its memory use is measured in isolation. The labels of every
+backend are compared with those of the reference backend (the current full-precision pipeline), and the report
+contains the agreement, load time, per-batch latency percentiles and peak RSS of each backend.
+
+    python -m benchmark.sentiment --backends pytorch,int8,onnx --texts messages.txt --output sentiment-report.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from benchmark.run import percentile
+from sentiment_backends import SENTIMENT_BACKENDS, load_sentiment_backend
+
+DEFAULT_MODEL = "distilbert/distilbert-base-uncased-finetuned-sst-2-english"
+
+# Used when no --texts file is given: short and long, positive, negative and neutral chat messages
+SAMPLE_TEXTS = [
+    "ok",
+    "thanks!",
+    "This is the best answer I have ever received, thank you so much.",
+    "That was completely useless and wrong.",
+    "Could you please explain to me in detail what natural language processing is?",
+    "How is the weather in Shanghai today?",
+    "I am really frustrated, the app keeps crashing every time I open it.",
+    "Not bad, but the second half of your explanation was confusing.",
+    "What are the latest news about electric cars?",
+    "I love how quickly you answered, great job.",
+    "Why is this so slow? I have been waiting for ages.",
+    "Please summarize the article in three sentences.",
+    "The movie was boring and far too long.",
+    "今天天气怎么样？",
+    "I'm not sure I understand, can you give me an example?",
+    "Absolutely fantastic, everything works now!",
+    "Your previous reply contradicted itself.",
+    "Tell me a joke about programmers.",
+    "I hate waiting in line at the airport. " * 60,
+    "This product exceeded all my expectations and I would recommend it to anyone. " * 40,
+]
+
+
+def peak_rss_mb():
+    """ Peak resident set size of this process in MiB (ru_maxrss is in KiB on Linux, bytes on macOS) """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def measure_backend(backend, model_name, texts, batch_size, repeat):
+    """
+    Load one backend and classify the texts; runs inside the worker process.
+
+    Returns:
+    - dict: The labels and scores of the texts, load time, batch latencies and peak RSS.
+    """
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    classify = load_sentiment_backend(backend, model_name)
+    classify(texts[:1])  # The first call allocates buffers and is not part of the measurement
+    load_seconds = time.perf_counter() - started
+
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    latencies, results = [], []
+    for _ in range(repeat):
+        results = []
+        for batch in batches:
+            batch_started = time.perf_counter()
+            results.extend(classify(batch))
+            latencies.append(time.perf_counter() - batch_started)
+
+    return {
+        "labels": [result["label"] for result in results],
+        "scores": [result["score"] for result in results],
+        "load_seconds": round(load_seconds, 2),
+        "batch_latency_ms": {f"p{p}": round(percentile(latencies, p) * 1000, 2) for p in (50, 95, 99)},
+        "texts_per_second": round(len(texts) * repeat / sum(latencies), 1),
+        "rss_before_load_mb": rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_worker(backend, args):
+    """ Measure a backend in a fresh interpreter and return its result """
+    command = [sys.executable, "-m", "benchmark.sentiment", "--worker", backend, "--model", args.model,
+               "--batch-size", str(args.batch_size), "--repeat", str(args.repeat)]
+    if args.texts:
+        command += ["--texts", args.texts]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(reference, result):
+    """ Label agreement and the largest score difference against the reference backend """
+    agreement = sum(a == b for a, b in zip(reference["labels"], result["labels"])) / len(reference["labels"])
+    return {
+        "agreement": round(agreement, 4),
+        "disagreements": [i for i, (a, b) in enumerate(zip(reference["labels"], result["labels"])) if a != b],
+        "max_score_delta": round(max(abs(a - b) for a, b in zip(reference["scores"], result["scores"])), 4),
+    }
+
+
+def load_texts(path):
+    if not path:
+        return SAMPLE_TEXTS
+    with open(path, "r", encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the sentiment backends for agreement, latency and memory")
+    parser.add_argument("--backends", default=",".join(SENTIMENT_BACKENDS), help="Comma-separated backend names")
+    parser.add_argument("--reference", default="pytorch", help="Backend whose labels the others are compared with")
+    parser.add_argument("--model", default=os.getenv("SENTIMENT_MODEL", DEFAULT_MODEL))
+    parser.add_argument("--texts", help="File with one text per line (default: built-in sample messages)")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the texts per backend")
+    parser.add_argument("--output", default="sentiment-report.json")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    texts = load_texts(args.texts)
+    if args.worker:
+        print(json.dumps(measure_backend(args.worker, args.model, texts, args.batch_size, args.repeat)))
+        return
+
+    backends = args.backends.split(",")
+    if args.reference not in backends:
+        backends.insert(0, args.reference)
+
+    results = {}
+    for backend in backends:
+        print(f"Measuring {backend}...", flush=True)
+        results[backend] = run_worker(backend, args)
+
+    reference = results[args.reference]
+    report = {"model": args.model, "texts": len(texts), "batch_size": args.batch_size, "reference": args.reference,
+              "backends": {}}
+    for backend, result in results.items():
+        if "error" in result:
+            report["backends"][backend] = result
+        else:
+            parity = compare(reference, result) if "error" not in reference else {}
+            report["backends"][backend] = dict(
+                {key: value for key, value in result.items() if key not in ("labels", "scores")}, **parity)
+        print(json.dumps({backend: report["backends"][backend]}), flush=True)
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
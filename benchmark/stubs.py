@@ -0,0 +1,376 @@
+"""
+Local stub servers that mimic the OpenAI chat completions API, OpenWeather and NewsAPI.
+
+The stubs are deterministic: the reply to a request depends only on the request, and every response waits for a
+fixed, configurable latency. Point the app at them with OPENAI_BASE_URL, OPENWEATHER_BASE_URL and NEWS_API_BASE_URL.
+
+The completions stub can also simulate automatic prompt caching (--prefix-cache): prompts are split into
+word and punctuation tokens (tool definitions first, then the messages), the longest prefix seen before is reported as
+usage.prompt_tokens_details.cached_tokens and only the uncached part of the prompt costs prefill time.
+
+Run standalone with:
+    python -m benchmark.stubs --port 8900
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Canned JSON Schemas returned for AutoFunctionGenerator prompts
+TOOL_SCHEMAS = {
+    "query_openweather_function": {
+        "name": "query_openweather_function",
+        "description": "查询指定城市的实时天气",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "city": {"type": "string", "description": "城市的英文名称"},
+                "units": {"type": "string", "description": "计量单位"},
+                "language": {"type": "string", "description": "输出语言"},
+            },
+            "required": ["city"],
+        },
+    },
+    "query_news_function": {
+        "name": "query_news_function",
+        "description": "查询指定主题的最新新闻",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "topic": {"type": "string", "description": "新闻主题"},
+                "language": {"type": "string", "description": "新闻语言"},
+                "page_size": {"type": "integer", "description": "返回的新闻数量"},
+            },
+            "required": ["topic"],
+        },
+    },
+}
+
+# Text streamed back for ordinary questions (split into words to simulate tokens)
+REPLY_TEXT = ("Natural language processing is a field of artificial intelligence that gives computers the ability "
+              "to understand, interpret and generate human language. ") * 3
+
+
+class StubConfig:
+    """
+    Latency settings shared by the stub handlers.
+
+    Attributes:
+    - openai_latency_ms (float): Delay before the first byte of a completion.
+    - token_delay_ms (float): Delay between streamed chunks.
+    - tool_latency_ms (float): Delay of the OpenWeather and NewsAPI stubs.
+    - prefill_ms_per_1k_tokens (float): Additional delay per thousand uncached prompt tokens.
+    - prefix_cache (PrefixCache): Simulated prompt cache, or None to report no cached tokens.
+    """
+
+    def __init__(self, openai_latency_ms=200, token_delay_ms=5, tool_latency_ms=50, prefill_ms_per_1k_tokens=0,
+                 prefix_cache=False):
+        self.openai_latency_ms = openai_latency_ms
+        self.token_delay_ms = token_delay_ms
+        self.tool_latency_ms = tool_latency_ms
+        self.prefill_ms_per_1k_tokens = prefill_ms_per_1k_tokens
+        self.prefix_cache = PrefixCache() if prefix_cache else None
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.prompt_tokens = {"prompt": 0, "cached": 0}
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def count_prompt(self, prompt_tokens, cached_tokens):
+        with self.lock:
+            self.prompt_tokens["prompt"] += prompt_tokens
+            self.prompt_tokens["cached"] += cached_tokens
+
+
+class PrefixCache:
+    """
+    Simulation of OpenAI's automatic prompt caching: prompts of at least min_tokens tokens are cached in blocks
+    of block_tokens, and a prompt is served from the longest cached prefix of whole blocks.
+
+    Attributes:
+    - min_tokens (int): Shortest prompt that is cached.
+    - block_tokens (int): Granularity of cached prefixes.
+    - max_entries (int): Cached prefixes kept (least recently used ones are evicted).
+    """
+
+    def __init__(self, min_tokens=1024, block_tokens=128, max_entries=100000):
+        self.min_tokens = min_tokens
+        self.block_tokens = block_tokens
+        self.max_entries = max_entries
+        self._prefixes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup_and_store(self, tokens):
+        """ Number of leading tokens served from the cache; the prompt's own prefixes are cached afterwards """
+        if len(tokens) < self.min_tokens:
+            return 0
+        digest = hashlib.sha256()
+        boundaries = []
+        for end in range(self.block_tokens, len(tokens) + 1, self.block_tokens):
+            digest.update("\x00".join(tokens[end - self.block_tokens:end]).encode("utf-8"))
+            boundaries.append((end, digest.hexdigest()))
+        cached = 0
+        with self._lock:
+            for end, key in boundaries:
+                if key in self._prefixes:
+                    self._prefixes.move_to_end(key)
+                    if end >= self.min_tokens:
+                        cached = end
+                else:
+                    self._prefixes[key] = True
+            while len(self._prefixes) > self.max_entries:
+                self._prefixes.popitem(last=False)
+        return cached
+
+
+# Words and single punctuation characters, a rough stand-in for the model's tokens
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def _prompt_tokens(body):
+    """ The prompt as a list of tokens: the tool definitions as sent, then each message """
+    tokens = _TOKEN.findall(json.dumps(body.get("tools") or body.get("functions") or [], ensure_ascii=False))
+    for message in body["messages"]:
+        tokens.append(f"<{message.get('role')}>")
+        tokens.extend(_TOKEN.findall(message.get("content") or ""))
+        if message.get("tool_calls"):
+            tokens.extend(_TOKEN.findall(json.dumps(message["tool_calls"], ensure_ascii=False)))
+    return tokens
+
+
+def _last_user_message(messages):
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return message.get("content") or ""
+    return ""
+
+
+def _choose_functions(body):
+    """
+    Decide which tools the stub model "calls", based on keywords in the last user message: one weather call per
+    city in "weather in X and Y" and a news call for "news". The legacy functions= interface gets the first one.
+    """
+    if not (body.get("functions") or body.get("tools")) or body["messages"][-1].get("role") in ("function", "tool"):
+        return []
+    text = _last_user_message(body["messages"]).lower()
+    calls = []
+    if "weather" in text or "天气" in text:
+        cities = re.search(r"weather in ([\w\s-]+)", text)
+        for city in re.split(r"\s+and\s+", cities.group(1).strip()) if cities else ["beijing"]:
+            calls.append(("query_openweather_function", {"city": city.strip()}))
+    if "news" in text or "新闻" in text:
+        calls.append(("query_news_function", {"topic": "technology", "page_size": 3}))
+    return calls if body.get("tools") else calls[:1]
+
+
+def _completion_text(body):
+    """ The reply content for requests that do not call a tool """
+    system = " ".join(m.get("content") or "" for m in body["messages"] if m.get("role") == "system")
+    if "JSON Schema" in body["messages"][-1].get("content", "") or "JSON Schema" in system:
+        name = re.search(r"提取函数名称：(\w+)", body["messages"][-1]["content"])
+        schema = TOOL_SCHEMAS.get(name.group(1) if name else "", {"name": "unknown", "parameters": {}})
+        return json.dumps(schema, ensure_ascii=False)
+    if body.get("max_tokens") == 10:
+        return "Benchmark chat"
+    if "summary" in system.lower() and "Current summary" in _last_user_message(body["messages"]):
+        return "The user asked a series of benchmark questions."
+    return REPLY_TEXT
+
+
+def _usage(prompt_tokens, cached_tokens, completion_text):
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(completion_text.split()),
+            "total_tokens": prompt_tokens + len(completion_text.split()),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            pass  # The app was stopped while a response was being written
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # ------------------------------------------------------------------ OpenWeather / NewsAPI
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        time.sleep(self.config.tool_latency_ms / 1000)
+
+        if url.path == "/data/2.5/weather":
+            self.config.count("weather")
+            city = params.get("q", "beijing")
+            self._send_json(200, {
+                "name": city.title(),
+                "weather": [{"main": "Clouds", "description": "多云"}],
+                "main": {"temp": 21.5, "feels_like": 21.0, "humidity": 60},
+                "wind": {"speed": 3.2},
+            })
+        elif url.path == "/v2/everything":
+            self.config.count("news")
+            page_size = int(params.get("pageSize", 5))
+            self._send_json(200, {"status": "ok", "articles": [
+                {"title": f"{params.get('q', 'news')} headline {i + 1}", "url": f"https://example.com/{i + 1}",
+                 "source": {"name": "Stub News"}}
+                for i in range(page_size)
+            ]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    # ------------------------------------------------------------------ OpenAI
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        self.config.count("openai")
+        raw_body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not raw_body:
+            # The client went away before sending its body (e.g. the app was stopped mid-request)
+            self.close_connection = True
+            return
+        body = json.loads(raw_body)
+        tokens = _prompt_tokens(body)
+        cached = self.config.prefix_cache.lookup_and_store(tokens) if self.config.prefix_cache else 0
+        prefill_ms = (len(tokens) - cached) / 1000 * self.config.prefill_ms_per_1k_tokens
+        self.config.count_prompt(len(tokens), cached)
+        time.sleep((self.config.openai_latency_ms + prefill_ms) / 1000)
+
+        functions = _choose_functions(body)
+        text = "" if functions else _completion_text(body)
+        finish_reason = "stop"
+        words = text.split(" ")
+        if body.get("max_tokens") and len(words) > body["max_tokens"]:
+            # One word is one token, so max_tokens cuts the reply off as the real API does
+            text, finish_reason = " ".join(words[:body["max_tokens"]]), "length"
+        usage = _usage(len(tokens), cached, text)
+        if body.get("stream"):
+            self._stream(body, functions, text, usage, finish_reason)
+        else:
+            self._complete(body, functions, text, usage, finish_reason)
+
+    def _function_call_message(self, body, functions):
+        if body.get("tools"):
+            return {"role": "assistant", "content": None, "tool_calls": [
+                {"id": f"call_{i}", "type": "function",
+                 "function": {"name": name, "arguments": json.dumps(arguments)}}
+                for i, (name, arguments) in enumerate(functions)
+            ]}
+        name, arguments = functions[0]
+        return {"role": "assistant", "content": None,
+                "function_call": {"name": name, "arguments": json.dumps(arguments)}}
+
+    def _complete(self, body, functions, text, usage, finish_reason="stop"):
+        message = self._function_call_message(body, functions) if functions else {"role": "assistant", "content": text}
+        self._send_json(200, {
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+            "choices": [{"index": 0, "message": message,
+                         "finish_reason": ("tool_calls" if body.get("tools") else "function_call")
+                         if functions else finish_reason}],
+            "usage": usage,
+        })
+
+    def _stream(self, body, functions, text, usage, finish_reason="stop"):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None):
+            return json.dumps({"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                               "model": body.get("model"),
+                               "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]})
+
+        if functions:
+            message = self._function_call_message(body, functions)
+            if "tool_calls" in message:
+                for index, call in enumerate(message["tool_calls"]):
+                    # The id and name come first, the arguments in a second delta, as the real API does
+                    send(chunk({"role": "assistant", "tool_calls": [
+                        {"index": index, "id": call["id"], "type": "function",
+                         "function": {"name": call["function"]["name"], "arguments": ""}}]}))
+                    send(chunk({"tool_calls": [
+                        {"index": index, "function": {"arguments": call["function"]["arguments"]}}]}))
+                send(chunk({}, "tool_calls"))
+            else:
+                send(chunk({"role": "assistant", "function_call": message["function_call"]}))
+                send(chunk({}, "function_call"))
+        else:
+            for i, word in enumerate(text.split(" ")):
+                send(chunk({"content": word if i == 0 else " " + word}))
+                time.sleep(self.config.token_delay_ms / 1000)
+            send(chunk({}, finish_reason))
+
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send(json.dumps({"id": "chatcmpl-stub", "object": "chat.completion.chunk", "choices": [],
+                             "usage": usage}))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_stub_server(config=None, host="127.0.0.1", port=0):
+    """
+    Start the stub server on a background thread.
+
+    Parameters:
+    - config (StubConfig): Latency settings; defaults are used when omitted.
+    - host (str): Interface to bind.
+    - port (int): Port to bind, 0 for any free port.
+
+    Returns:
+    - ThreadingHTTPServer: The running server; its base URL is http://host:server.server_port.
+    """
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="benchmark-stubs", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenAI / OpenWeather / NewsAPI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--openai-latency-ms", type=float, default=200)
+    parser.add_argument("--token-delay-ms", type=float, default=5)
+    parser.add_argument("--tool-latency-ms", type=float, default=50)
+    parser.add_argument("--prefill-ms-per-1k-tokens", type=float, default=0)
+    parser.add_argument("--prefix-cache", action="store_true", help="Simulate automatic prompt caching")
+    args = parser.parse_args()
+
+    stub_server = start_stub_server(StubConfig(args.openai_latency_ms, args.token_delay_ms, args.tool_latency_ms,
+                                               args.prefill_ms_per_1k_tokens, args.prefix_cache),
+                                    args.host, args.port)
+    print(f"Stub server listening on http://{args.host}:{stub_server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub_server.shutdown()
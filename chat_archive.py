@@ -0,0 +1,670 @@
+"""
+Compressed archive tier for chats nobody has opened for a while.
+
+Chats idle for longer than CHAT_ARCHIVE_IDLE_DAYS have their messages moved out of the chat store into
+append-only segment files. Titles and summaries stay in the store, so the sidebar and pagination do not change;
+the first read or write of an archived chat puts its messages back transparently.
+
+Each archived chat is one record: a columnar layout of its messages (roles and sentiment labels
+dictionary-encoded, contents and confidences as plain arrays) serialized with msgpack and compressed with zstd.
+Without the msgpack and zstandard packages, records are written as zlib-compressed JSON instead; the codec is
+stored with each record, so both kinds can be read back. An SQLite index next to the segments maps each chat to
+the segment, offset and length of its record, and holds a full-text index of the archived messages so that
+search still finds them (see ArchivingChatStore.ranked_search()).
+
+Exports use the same framing: a header followed by one record per chat (see write_export() and read_export()).
+"""
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import msgpack
+    import zstandard
+except ImportError:  # archives fall back to zlib-compressed JSON
+    msgpack = zstandard = None
+
+from chat_search import SEARCH_INDEX_VERSION, fts_query, index_terms, make_snippet, query_terms
+from chat_store import SEARCH_SEQ_BITS, ChatStore, _Transaction
+
+logger = logging.getLogger(__name__)
+
+# Frame header of a record: payload length and codec
+FRAME_HEADER = struct.Struct(">IB")
+CODEC_ZSTD_MSGPACK = 1
+CODEC_ZLIB_JSON = 2
+
+# First bytes of an export file
+EXPORT_MAGIC = b"CHATARC\x01"
+
+# A new segment file is started once the current one reaches this size
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+
+# Segments whose live records take less than this share of the file are rewritten by compact()
+COMPACT_LIVE_RATIO = 0.5
+
+# A pending record whose messages are still in the chat store is dropped once it is this old (in seconds): the
+# archiving run that wrote it was interrupted before clearing them
+PENDING_MAX_AGE = 3600
+
+# Message fields with their own column; anything else is kept per message in "extra"
+COLUMNAR_FIELDS = ("role", "content", "sentiment", "confidence")
+
+
+def _dictionary_encode(values):
+    """ ["user", "assistant", "user"] -> (["user", "assistant"], [0, 1, 0]) """
+    names, codes = [], []
+    positions = {}
+    for value in values:
+        if value not in positions:
+            positions[value] = len(names)
+            names.append(value)
+        codes.append(positions[value])
+    return names, codes
+
+
+def encode_chat(record):
+    """
+    Lay out a chat record column by column.
+
+    Parameters:
+    - record (dict): {"chat_id", "title", "summary", "summary_upto", "updated_at", "messages"}.
+
+    Returns:
+    - dict: The columnar record; decode_chat() reverses it.
+    """
+    messages = record["messages"]
+    role_names, roles = _dictionary_encode([message.get("role") for message in messages])
+    sentiment_names, sentiments = _dictionary_encode([message.get("sentiment") for message in messages])
+    extra = [{key: value for key, value in message.items() if key not in COLUMNAR_FIELDS} or None
+             for message in messages]
+    return {
+        "chat_id": record["chat_id"],
+        "title": record["title"],
+        "summary": record.get("summary", ""),
+        "summary_upto": record.get("summary_upto", 0),
+        "updated_at": record.get("updated_at"),
+        "role_names": role_names,
+        "roles": roles,
+        "contents": [message.get("content") for message in messages],
+        "sentiment_names": sentiment_names,
+        "sentiments": sentiments,
+        "confidences": [message.get("confidence") for message in messages],
+        "extra": extra if any(extra) else None,
+    }
+
+
+def decode_chat(columns):
+    """ Rebuild the chat record (with its list of message dicts) from encode_chat()'s layout """
+    messages = []
+    extra = columns["extra"] or [None] * len(columns["roles"])
+    for role, content, sentiment, confidence, fields in zip(columns["roles"], columns["contents"],
+                                                            columns["sentiments"], columns["confidences"], extra):
+        message = {"role": columns["role_names"][role], "content": content}
+        if columns["sentiment_names"][sentiment] is not None:
+            message["sentiment"] = columns["sentiment_names"][sentiment]
+        if confidence is not None:
+            message["confidence"] = confidence
+        message.update(fields or {})
+        messages.append(message)
+    return dict({key: columns[key] for key in ("chat_id", "title", "summary", "summary_upto", "updated_at")},
+                messages=messages)
+
+
+def pack_record(record):
+    """ Serialize and compress a chat record into a frame (header + payload) """
+    columns = encode_chat(record)
+    if msgpack is not None:
+        codec = CODEC_ZSTD_MSGPACK
+        payload = zstandard.ZstdCompressor(level=10).compress(msgpack.packb(columns, use_bin_type=True))
+    else:
+        codec = CODEC_ZLIB_JSON
+        payload = zlib.compress(json.dumps(columns, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 9)
+    return FRAME_HEADER.pack(len(payload), codec) + payload
+
+
+def unpack_payload(codec, payload):
+    """ Decompress and decode the payload of a frame back into a chat record """
+    if codec == CODEC_ZSTD_MSGPACK:
+        if msgpack is None:
+            raise RuntimeError("This archive record needs the msgpack and zstandard packages")
+        columns = msgpack.unpackb(zstandard.ZstdDecompressor().decompress(payload), raw=False)
+    elif codec == CODEC_ZLIB_JSON:
+        columns = json.loads(zlib.decompress(payload).decode("utf-8"))
+    else:
+        raise ValueError(f"Unknown archive codec: {codec}")
+    return decode_chat(columns)
+
+
+def read_frame(file):
+    """ Read the next record from a file positioned at a frame, or return None at the end of the file """
+    header = file.read(FRAME_HEADER.size)
+    if not header:
+        return None
+    length, codec = FRAME_HEADER.unpack(header)
+    return unpack_payload(codec, file.read(length))
+
+
+def write_export(path, records):
+    """
+    Write chat records to an export file.
+
+    Returns:
+    - int: The number of records written.
+    """
+    count = 0
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(EXPORT_MAGIC)
+        for record in records:
+            file.write(pack_record(record))
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def read_export(path):
+    """ Yield the chat records of an export file """
+    with open(path, "rb") as file:
+        if file.read(len(EXPORT_MAGIC)) != EXPORT_MAGIC:
+            raise ValueError(f"{path} is not a chat export")
+        while (record := read_frame(file)) is not None:
+            yield record
+
+
+class ChatArchive:
+    """
+    Append-only segment files of compressed chat records with an SQLite offset index.
+
+    An index entry goes through the states "pending" (written, messages not yet removed from the chat store),
+    "archived" and "restoring" (claimed by the request that puts the messages back). Writers serialize on the
+    index database (BEGIN IMMEDIATE), so several worker processes can share one archive directory.
+
+    Attributes:
+    - directory (str): Where the segments and index.db are kept.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS archived (
+                    chat_id TEXT PRIMARY KEY,
+                    segment INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    raw_length INTEGER NOT NULL,
+                    message_count INTEGER NOT NULL,
+                    archived_at REAL NOT NULL,
+                    state TEXT NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_archived_segment ON archived(segment)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+            # Rowids of the search index are (chat search id << SEARCH_SEQ_BITS) + seq + 1, as in SQLiteChatStore
+            conn.execute("CREATE TABLE IF NOT EXISTS search_ids (id INTEGER PRIMARY KEY, chat_id TEXT UNIQUE NOT NULL)")
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(terms, content='', "
+                         "tokenize='unicode61 remove_diacritics 2')")
+            indexed = conn.execute("SELECT value FROM meta WHERE key = 'search_index_version'").fetchone()
+            if indexed is None or int(indexed[0]) != SEARCH_INDEX_VERSION:
+                self._rebuild_search_index(conn)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directory, "index.db"), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connect())
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:06d}.chats")
+
+    def _current_segment(self, conn):
+        """ The segment to append to; caller holds the write transaction """
+        segment = conn.execute("SELECT MAX(segment) FROM archived").fetchone()[0] or 1
+        path = self._segment_path(segment)
+        if os.path.exists(path) and os.path.getsize(path) >= SEGMENT_MAX_BYTES:
+            segment += 1
+        return segment
+
+    def _read_entry(self, conn, chat_id):
+        row = conn.execute("SELECT segment, offset FROM archived WHERE chat_id = ?", (chat_id,)).fetchone()
+        if row is None:
+            return None
+        with open(self._segment_path(row[0]), "rb") as file:
+            file.seek(row[1])
+            return read_frame(file)
+
+    @staticmethod
+    def _index_messages(conn, chat_id, messages, delete=False):
+        """ Add a record's messages to the search index, or remove them (this needs the text that was indexed) """
+        conn.execute("INSERT OR IGNORE INTO search_ids (chat_id) VALUES (?)", (chat_id,))
+        base = conn.execute("SELECT id FROM search_ids WHERE chat_id = ?", (chat_id,)).fetchone()[0] << SEARCH_SEQ_BITS
+        statement = "INSERT INTO search_index (search_index, rowid, terms) VALUES ('delete', ?, ?)" if delete \
+            else "INSERT INTO search_index (rowid, terms) VALUES (?, ?)"
+        for seq, message in enumerate(messages[:(1 << SEARCH_SEQ_BITS) - 1]):
+            terms = index_terms(message.get("content"))
+            if terms:
+                conn.execute(statement, (base + seq + 1, terms))
+
+    def _remove_entry(self, conn, chat_id):
+        """ Drop a chat's index entry and its messages from the search index; caller holds the write transaction """
+        record = self._read_entry(conn, chat_id)
+        if record is None:
+            return
+        self._index_messages(conn, chat_id, record["messages"], delete=True)
+        conn.execute("DELETE FROM search_ids WHERE chat_id = ?", (chat_id,))
+        conn.execute("DELETE FROM archived WHERE chat_id = ?", (chat_id,))
+
+    def _rebuild_search_index(self, conn):
+        """ Index every record from scratch (archives written before the index existed or by another version) """
+        conn.execute("INSERT INTO search_index (search_index) VALUES ('delete-all')")
+        conn.execute("DELETE FROM search_ids")
+        for (chat_id,) in conn.execute("SELECT chat_id FROM archived").fetchall():
+            self._index_messages(conn, chat_id, self._read_entry(conn, chat_id)["messages"])
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('search_index_version', ?)",
+                     (SEARCH_INDEX_VERSION,))
+
+    def _append_frame(self, conn, frame):
+        segment = self._current_segment(conn)
+        with open(self._segment_path(segment), "ab") as file:
+            offset = file.tell()
+            file.write(frame)
+            file.flush()
+            os.fsync(file.fileno())
+        return segment, offset
+
+    def write(self, record):
+        """
+        Append a chat record as "pending": it is not served until commit() (the caller first removes the
+        messages from the chat store).
+        """
+        frame = pack_record(record)
+        raw_length = len(json.dumps(record["messages"], ensure_ascii=False).encode("utf-8"))
+        with self._transaction() as conn:
+            self._remove_entry(conn, record["chat_id"])
+            segment, offset = self._append_frame(conn, frame)
+            conn.execute("INSERT INTO archived VALUES (?, ?, ?, ?, ?, ?, ?, 'pending')",
+                         (record["chat_id"], segment, offset, len(frame), raw_length, len(record["messages"]),
+                          time.time()))
+            self._index_messages(conn, record["chat_id"], record["messages"])
+
+    def commit(self, chat_id):
+        """ Mark a pending record as archived """
+        with self._transaction() as conn:
+            conn.execute("UPDATE archived SET state = 'archived' WHERE chat_id = ? AND state = 'pending'", (chat_id,))
+
+    def release(self, chat_id):
+        """ Give a claimed record back, so that the next request retries the restore """
+        with self._transaction() as conn:
+            conn.execute("UPDATE archived SET state = 'archived' WHERE chat_id = ? AND state = 'restoring'",
+                         (chat_id,))
+
+    def claim(self, chat_id):
+        """ Mark an archived record as being restored; only one caller gets True """
+        with self._transaction() as conn:
+            return conn.execute("UPDATE archived SET state = 'restoring' WHERE chat_id = ? AND state = 'archived'",
+                                (chat_id,)).rowcount == 1
+
+    def remove(self, chat_id):
+        with self._transaction() as conn:
+            self._remove_entry(conn, chat_id)
+
+    def discard(self, chat_id):
+        """ Remove a record only while it is still pending; returns False if it was committed in the meantime """
+        with self._transaction() as conn:
+            if self._read_state(conn, chat_id) != "pending":
+                return False
+            self._remove_entry(conn, chat_id)
+            return True
+
+    def pending_chats(self, older_than=0):
+        """ The chat IDs of the records that have been pending for more than older_than seconds """
+        return [row[0] for row in self._connect().execute(
+            "SELECT chat_id FROM archived WHERE state = 'pending' AND archived_at < ?", (time.time() - older_than,))]
+
+    def state(self, chat_id):
+        """ "pending", "archived", "restoring", or None if the chat has no archive entry """
+        return self._read_state(self._connect(), chat_id)
+
+    @staticmethod
+    def _read_state(conn, chat_id):
+        row = conn.execute("SELECT state FROM archived WHERE chat_id = ?", (chat_id,)).fetchone()
+        return row[0] if row else None
+
+    def message_count(self, chat_id):
+        """ The number of archived messages a chat's hot messages come after (0 unless it is archived) """
+        row = self._connect().execute("SELECT message_count FROM archived WHERE chat_id = ? AND state != 'pending'",
+                                      (chat_id,)).fetchone()
+        return row[0] if row else 0
+
+    def read(self, chat_id):
+        """ Return the archived record of a chat, or None if it has none """
+        return self._read_entry(self._connect(), chat_id)
+
+    def search(self, query, limit=20):
+        """
+        Full-text search over the archived messages (pending records are skipped: the chat store still has them).
+
+        Returns:
+        - list: (rank, chat_id, seq, message) tuples, best bm25() ranks first.
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        conn = self._connect()
+        matches = conn.execute(
+            "SELECT search_index.rowid, bm25(search_index), search_ids.chat_id FROM search_index "
+            "JOIN search_ids ON search_ids.id = search_index.rowid >> ? "
+            "JOIN archived ON archived.chat_id = search_ids.chat_id "
+            "WHERE search_index MATCH ? AND archived.state != 'pending' ORDER BY bm25(search_index) LIMIT ?",
+            (SEARCH_SEQ_BITS, match, limit)).fetchall()
+        records = {}
+        results = []
+        for rowid, rank, chat_id in matches:
+            if chat_id not in records:
+                records[chat_id] = self._read_entry(conn, chat_id)
+            seq = (rowid & ((1 << SEARCH_SEQ_BITS) - 1)) - 1
+            if records[chat_id] is not None:
+                results.append((rank, chat_id, seq, records[chat_id]["messages"][seq]))
+        return results
+
+    def compact(self):
+        """
+        Rewrite sparsely used segments: their live records are appended to the current segment and the old files
+        are deleted. Pending records are kept: only the chat store can tell whether they are the last copy of
+        their messages (see ArchivingChatStore.recover_pending()).
+
+        Returns:
+        - int: Bytes freed.
+        """
+        freed = 0
+        with self._transaction() as conn:
+            current = self._current_segment(conn)
+            live = dict(conn.execute("SELECT segment, SUM(length) FROM archived GROUP BY segment").fetchall())
+            for name in sorted(os.listdir(self.directory)):
+                if not (name.startswith("segment-") and name.endswith(".chats")):
+                    continue
+                segment = int(name[len("segment-"):-len(".chats")])
+                path = self._segment_path(segment)
+                size = os.path.getsize(path)
+                if segment == current or (size and live.get(segment, 0) / size >= COMPACT_LIVE_RATIO):
+                    continue
+                rows = conn.execute("SELECT chat_id, offset, length FROM archived WHERE segment = ?",
+                                    (segment,)).fetchall()
+                with open(path, "rb") as file:
+                    for chat_id, offset, length in rows:
+                        file.seek(offset)
+                        new_segment, new_offset = self._append_frame(conn, file.read(length))
+                        conn.execute("UPDATE archived SET segment = ?, offset = ? WHERE chat_id = ?",
+                                     (new_segment, new_offset, chat_id))
+                os.remove(path)
+                freed += size - live.get(segment, 0)
+        return freed
+
+    def stats(self):
+        """ Archived chats and messages, segment files and bytes, and the compression ratio of the records """
+        chats, messages, live_bytes, raw_bytes = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(message_count), 0), COALESCE(SUM(length), 0), "
+            "COALESCE(SUM(raw_length), 0) FROM archived WHERE state = 'archived'").fetchone()
+        segments = [name for name in os.listdir(self.directory) if name.endswith(".chats")]
+        return {
+            "archived_chats": chats,
+            "archived_messages": messages,
+            "segments": len(segments),
+            "segment_bytes": sum(os.path.getsize(os.path.join(self.directory, name)) for name in segments),
+            "live_bytes": live_bytes,
+            "compression_ratio": round(raw_bytes / live_bytes, 2) if live_bytes else None,
+            "codec": "zstd-msgpack" if msgpack is not None else "zlib-json",
+        }
+
+
+class ArchivingChatStore(ChatStore):
+    """
+    A chat store (the hot tier) with cold chats moved to a ChatArchive.
+
+    Reading or appending to an archived chat first restores its messages into the chat store, so callers never
+    see the difference. Archiving and restoring are safe against concurrent requests in other threads and
+    processes: messages are only removed from the store if no message was appended since they were read, a
+    record only becomes "archived" after that, and exactly one request claims it for restoring. Restored
+    messages are inserted before any message appended in the meantime, so the order is always preserved. A run
+    interrupted between clearing the messages and committing the record is finished by recover_pending() (and by
+    the next read of the chat), so its messages are never lost.
+
+    Attributes:
+    - store (ChatStore): The hot tier.
+    - archive (ChatArchive): The cold tier.
+    """
+
+    def __init__(self, store, archive):
+        self.store = store
+        self.archive = archive
+        self._counters = {"archived": 0, "restored": 0}
+        self._lock = threading.Lock()
+        self.recover_pending()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _ensure_hot(self, chat_id, wait=2.0):
+        """ Restore the messages of an archived chat into the chat store (or wait for another request to) """
+        if chat_id is None:
+            return
+        deadline = time.monotonic() + wait
+        while (state := self.archive.state(chat_id)) == "restoring" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if state == "pending":
+            state = self._settle_pending(chat_id)
+        if state != "archived" or not self.archive.claim(chat_id):
+            return
+        try:
+            record = self.archive.read(chat_id)
+            if self.store.chat_exists(chat_id):
+                self.store.prepend_messages(chat_id, record["messages"])
+                self._count("restored")
+                logger.info("Restored %d archived messages of chat %s", len(record["messages"]), chat_id)
+            self.archive.remove(chat_id)
+        except Exception:
+            self.archive.release(chat_id)
+            raise
+
+    def read_chat(self, chat_id):
+        """ The full record of a chat from both tiers, without restoring it; None if the chat does not exist """
+        info = self.store.get_chat_info(chat_id)
+        if info is None:
+            return None
+        summary, summary_upto = self.store.get_summary(chat_id)
+        messages = self.store.get_messages(chat_id)
+        state = self.archive.state(chat_id)
+        if state == "pending":
+            state = self._settle_pending(chat_id)
+        if state in ("archived", "restoring"):
+            messages = self.archive.read(chat_id)["messages"] + messages
+        return {"chat_id": chat_id, "title": info["title"], "summary": summary, "summary_upto": summary_upto,
+                "updated_at": info["updated_at"], "messages": messages}
+
+    def archive_chat(self, chat_id):
+        """ Move a chat's messages to the archive; returns False if the chat changed in the meantime """
+        state = self.archive.state(chat_id)
+        if state == "pending":
+            state = self._settle_pending(chat_id, PENDING_MAX_AGE)
+        if state is not None:
+            return False
+        record = self.read_chat(chat_id)
+        if record is None or not record["messages"]:
+            return False
+        self.archive.write(record)
+        if not self.store.clear_messages(chat_id, len(record["messages"])):
+            self.archive.discard(chat_id)
+            return False
+        self.archive.commit(chat_id)
+        self._count("archived")
+        return True
+
+    def _settle_pending(self, chat_id, max_age=None):
+        """
+        Resolve a pending record, left by an archiving run that has not committed it (yet, or ever, if it was
+        interrupted). If its messages are no longer at the start of the chat in the store, they were cleared and
+        the record is their only copy, so it is committed. If they are still there, the run has not cleared them
+        yet: the record is only dropped once it is older than max_age seconds, as the run is then surely dead.
+
+        Returns:
+        - str: The state of the record afterwards, or None if it is gone.
+        """
+        record = self.archive.read(chat_id)
+        if record is None:
+            return None
+        stored = self.store.get_messages(chat_id, 0, len(record["messages"]))
+        if stored is None:
+            self.archive.discard(chat_id)
+        elif stored != record["messages"]:
+            self.archive.commit(chat_id)
+            logger.warning("Committed the pending archive record of chat %s left by an interrupted run", chat_id)
+        elif max_age is not None and chat_id in self.archive.pending_chats(max_age):
+            self.archive.discard(chat_id)
+        return self.archive.state(chat_id)
+
+    def recover_pending(self):
+        """ Settle the pending records of interrupted archiving runs, so that no chat reads back empty """
+        for chat_id in self.archive.pending_chats():
+            self._settle_pending(chat_id, PENDING_MAX_AGE)
+
+    def archive_idle_chats(self, idle_seconds):
+        """
+        Archive every chat not updated for idle_seconds, then compact the segments.
+
+        Returns:
+        - int: The number of chats archived.
+        """
+        self.recover_pending()
+        idle_chats = self.store.list_idle_chats(time.time() - idle_seconds)
+        archived = sum(self.archive_chat(chat_id) for chat_id in idle_chats)
+        freed = self.archive.compact()
+        if archived or freed:
+            logger.info("Archived %d idle chats, compaction freed %d bytes", archived, freed)
+        return archived
+
+    def import_chat(self, record, archived=False):
+        """
+        Add a chat from an export; existing chats are left alone.
+
+        Parameters:
+        - record (dict): A chat record as produced by read_chat() or read_export().
+        - archived (bool): Write the messages straight to the archive instead of the chat store.
+
+        Returns:
+        - bool: Whether the chat was added.
+        """
+        chat_id = record["chat_id"]
+        if self.store.chat_exists(chat_id):
+            return False
+        self.store.create_chat(chat_id, record["title"])
+        if archived and record["messages"]:
+            self.archive.write(record)
+            self.archive.commit(chat_id)
+        elif record["messages"]:
+            self.store.append_messages(chat_id, record["messages"])
+        if record.get("summary_upto"):
+            self.store.set_summary(chat_id, record["summary"], record["summary_upto"])
+        return True
+
+    def start_sweeper(self, idle_seconds, interval):
+        """ Archive idle chats every interval seconds on a daemon thread """
+        def sweep():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.archive_idle_chats(idle_seconds)
+                except Exception:
+                    logger.exception("Archiving idle chats failed")
+
+        threading.Thread(target=sweep, name="chat-archive-sweeper", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return dict(self.archive.stats(), **counters)
+
+    # ChatStore interface: reads and writes of messages restore archived chats first, the rest is delegated
+
+    def list_chats(self, limit=None, before=None, after=None):
+        return self.store.list_chats(limit, before, after)
+
+    def chats_version(self):
+        return self.store.chats_version()
+
+    def get_messages(self, chat_id, start=0, end=None):
+        self._ensure_hot(chat_id)
+        return self.store.get_messages(chat_id, start, end)
+
+    def get_chat_info(self, chat_id):
+        self._ensure_hot(chat_id)
+        return self.store.get_chat_info(chat_id)
+
+    def get_summary(self, chat_id):
+        return self.store.get_summary(chat_id)
+
+    def set_summary(self, chat_id, summary, summary_upto):
+        self.store.set_summary(chat_id, summary, summary_upto)
+
+    def create_chat(self, chat_id, title):
+        self.store.create_chat(chat_id, title)
+
+    def append_messages(self, chat_id, messages):
+        self._ensure_hot(chat_id)
+        self.store.append_messages(chat_id, messages)
+
+    def rename_chat(self, chat_id, title):
+        return self.store.rename_chat(chat_id, title)
+
+    def delete_chat(self, chat_id):
+        self.archive.remove(chat_id)
+        return self.store.delete_chat(chat_id)
+
+    def chat_exists(self, chat_id):
+        return self.store.chat_exists(chat_id)
+
+    def ranked_search(self, query, limit=20):
+        # Titles and hot messages come from the chat store, archived messages from the archive's own index; both
+        # are ranked by bm25(), so the best of both lists are the best overall
+        results = []
+        for rank, result in self.store.ranked_search(query, limit):
+            if result["seq"] is not None:
+                result["seq"] += self.archive.message_count(result["chat_id"])
+            results.append((rank, result))
+        terms = query_terms(query)
+        for rank, chat_id, seq, message in self.archive.search(query, limit):
+            info = self.store.get_chat_info(chat_id)
+            if info is not None:
+                results.append((rank, dict(make_snippet(message.get("content"), terms), chat_id=chat_id,
+                                           title=info["title"], seq=seq, role=message.get("role"))))
+        results.sort(key=lambda item: item[0])
+        return results[:limit]
+
+    def list_idle_chats(self, idle_before):
+        return self.store.list_idle_chats(idle_before)
+
+    def clear_messages(self, chat_id, expected_count):
+        return self.store.clear_messages(chat_id, expected_count)
+
+    def prepend_messages(self, chat_id, messages):
+        self._ensure_hot(chat_id)
+        self.store.prepend_messages(chat_id, messages)
+
+    def load_all(self):
+        history = {}
+        for chat in self.list_chats():
+            record = self.read_chat(chat["id"])
+            history[chat["id"]] = {"title": chat["title"], "messages": record["messages"] if record else []}
+        return history
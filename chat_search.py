@@ -0,0 +1,117 @@
+"""
+Text processing for the chat search (/api/search_chats).
+
+Chinese, Japanese and Korean text has no spaces between words, so SQLite's unicode61 tokenizer would index a
+whole sentence as one token. index_terms() therefore rewrites text before it is indexed: words in other scripts
+are kept, and every run of CJK characters becomes its overlapping character bigrams
+("今天天气" -> "今天 天天 天气").
+fts_query() applies the same rewrite to a query and turns each CJK run into a phrase of bigrams, so a query
+matches wherever its characters appear consecutively. Snippets are cut from the original text.
+"""
+import re
+import unicodedata
+
+# Bump when index_terms() changes: stores rebuild their index when the version they indexed with differs
+SEARCH_INDEX_VERSION = 1
+
+# Kana, CJK ideographs (with extension A and compatibility ideographs) and Hangul syllables
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TOKEN = re.compile(rf"[{_CJK}]+|[^\W{_CJK}]+")
+_CJK_RUN = re.compile(rf"[{_CJK}]+")
+
+
+def _runs(text):
+    """ Case-folded CJK runs and words of a text """
+    return _TOKEN.findall(unicodedata.normalize("NFKC", text).casefold())
+
+
+def _bigrams(run):
+    return [run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def index_terms(text):
+    """ The space-separated terms a text is indexed with """
+    terms = []
+    for run in _runs(text or ""):
+        terms.extend(_bigrams(run) if _CJK_RUN.fullmatch(run) else [run])
+    return " ".join(terms)
+
+
+def query_terms(query):
+    """ The case-folded words and CJK runs of a query (used for snippets and by stores without an index) """
+    return _runs(query)
+
+
+def query_parts(query):
+    """
+    The parts of a query that must all match.
+
+    Returns:
+    - list: (terms, prefix) pairs: the index terms of the part (the bigrams of a CJK run, which must be
+      consecutive, or a single word) and whether the part's single term also matches as a prefix.
+    """
+    runs = query_terms(query)
+    parts = []
+    for position, run in enumerate(runs):
+        if _CJK_RUN.fullmatch(run) and len(run) > 1:
+            parts.append((_bigrams(run), False))
+        else:
+            parts.append(([run], bool(_CJK_RUN.fullmatch(run)) or position == len(runs) - 1))
+    return parts
+
+
+def fts_query(query):
+    """
+    Translate a search query into an FTS5 MATCH expression over index_terms().
+
+    All terms must match. The last word also matches as a prefix ("python weath" finds "python weather"), so
+    results can be shown while the user types; a CJK run must appear as consecutive characters, and a single
+    CJK character matches the start of a bigram.
+
+    Returns:
+    - str: The MATCH expression, or "" if the query has no searchable terms.
+    """
+    phrases = []
+    for terms, prefix in query_parts(query):
+        phrase = '"' + " ".join(terms) + '"'
+        phrases.append(phrase + " *" if prefix else phrase)
+    return " AND ".join(phrases)
+
+
+def match_score(text, terms):
+    """ Occurrences of the terms in a text, or 0 unless every term occurs (search without an index) """
+    folded = unicodedata.normalize("NFKC", text or "").casefold()
+    counts = [folded.count(term) for term in terms]
+    return sum(counts) if counts and all(counts) else 0
+
+
+def make_snippet(text, terms, width=60):
+    """
+    Cut the part of a text around the first match of any term.
+
+    Parameters:
+    - text (str): The original text.
+    - terms (list): The query's terms, see query_terms().
+    - width (int): Characters of context on each side of the match.
+
+    Returns:
+    - dict: {"snippet": str, "highlights": [[start, end], ...]} with the offsets of all matches in the snippet.
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    folded = text.casefold()
+    positions = [position for position in (folded.find(term) for term in terms) if position >= 0]
+    first = min(positions) if positions else 0
+    start = max(0, first - width)
+    end = min(len(text), first + width * 2)
+    snippet = text[start:end]
+    offset = 1 if start else 0
+    highlights = []
+    folded_snippet = folded[start:end]
+    if len(folded) == len(text):  # Offsets only carry over if case folding kept the length
+        for term in filter(None, terms):
+            position = folded_snippet.find(term)
+            while position >= 0:
+                highlights.append([offset + position, offset + position + len(term)])
+                position = folded_snippet.find(term, position + len(term))
+    prefix, suffix = ("…" if start else ""), ("…" if end < len(text) else "")
+    return {"snippet": prefix + snippet + suffix, "highlights": sorted(highlights)}
@@ -0,0 +1,970 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import math
+import threading
+import time
+from collections import Counter
+
+from chat_search import (SEARCH_INDEX_VERSION, index_terms, fts_query, query_parts, query_terms, match_score,
+                         make_snippet)
+
+try:
+    from redis.exceptions import WatchError
+except ImportError:  # redis is only needed by RedisChatStore
+    WatchError = None
+
+logger = logging.getLogger(__name__)
+
+# Default location of the SQLite conversation store
+CHAT_STORE_FILE = "chat_history.db"
+
+# Fields stored in their own columns; everything else on a message (sentiment, confidence, ...) goes to "extra"
+MESSAGE_COLUMNS = ("role", "content")
+
+# The search index's rowid of a message is (chat search id << SEARCH_SEQ_BITS) + seq + 1; + 0 is the chat's title
+SEARCH_SEQ_BITS = 20
+
+# BM25 parameters of the Redis search index. Its length normalization uses a fixed average text length (in index
+# terms): keeping the exact average up to date would make every write to any chat conflict with every other
+SEARCH_K1 = 1.2
+SEARCH_B = 0.75
+SEARCH_AVERAGE_TERMS = 30
+
+# A prefix in a query matches at most this many indexed words (Redis search index)
+SEARCH_PREFIX_EXPANSIONS = 100
+
+
+def page_bounds(length, limit=None, before=None, after=None):
+    """
+    Select a page of a sequence by position.
+
+    Parameters:
+    - length (int): Length of the sequence.
+    - limit (int): The maximum page size, or None for no limit.
+    - before (int): Only positions below this one.
+    - after (int): Only positions above this one.
+
+    Returns:
+    - tuple: (start, end) positions of the page. Without after, the page is the last limit items before the end
+      (the newest ones); with after, it is the first limit items after it.
+    """
+    start = after + 1 if after is not None else 0
+    end = min(before, length) if before is not None else length
+    if limit is not None:
+        if after is not None:
+            end = min(end, start + limit)
+        else:
+            start = max(start, end - limit)
+    start = max(start, 0)
+    return start, max(start, end)
+
+
+class ChatStore:
+    """
+    Interface of a conversation store.
+
+    A chat is identified by its chat_id and consists of a title and an ordered list of messages. Backends must
+    be safe to use from Flask's request threads, and append_messages() must only write the new messages.
+    """
+
+    def list_chats(self, limit=None, before=None, after=None):
+        """
+        Return [{"id": ..., "title": ...}] for the chats, oldest first.
+
+        With limit, at most limit chats are returned, see page_bounds(). before and after are chat ids that page
+        backwards to older or forwards to newer chats; an unknown cursor returns no chats.
+        """
+        raise NotImplementedError
+
+    def chats_version(self):
+        """ Return a value that changes whenever a chat is created, renamed or deleted (the chat list's ETag) """
+        raise NotImplementedError
+
+    def get_messages(self, chat_id, start=0, end=None):
+        """ Return the messages of a chat from index start up to end, or None if the chat does not exist """
+        raise NotImplementedError
+
+    def get_chat_info(self, chat_id):
+        """ Return {"title": ..., "message_count": ..., "updated_at": ...}, or None if the chat does not exist """
+        raise NotImplementedError
+
+    def get_summary(self, chat_id):
+        """ Return (rolling summary, number of messages it covers), or None if the chat does not exist """
+        raise NotImplementedError
+
+    def set_summary(self, chat_id, summary, summary_upto):
+        """ Store the rolling summary of the first summary_upto messages, unless a longer one is already stored """
+        raise NotImplementedError
+
+    def create_chat(self, chat_id, title):
+        """ Create an empty chat; does nothing if it already exists """
+        raise NotImplementedError
+
+    def append_messages(self, chat_id, messages):
+        """ Append messages to an existing chat """
+        raise NotImplementedError
+
+    def rename_chat(self, chat_id, title):
+        """ Rename a chat, returning False if it does not exist """
+        raise NotImplementedError
+
+    def delete_chat(self, chat_id):
+        """ Delete a chat, returning False if it does not exist """
+        raise NotImplementedError
+
+    def chat_exists(self, chat_id):
+        return self.get_messages(chat_id) is not None
+
+    def search(self, query, limit=20):
+        """
+        Full-text search over chat titles and messages.
+
+        Parameters:
+        - query (str): The search terms; all of them must match (see chat_search.fts_query()).
+        - limit (int): The maximum number of results.
+
+        Returns:
+        - list: Best matches first, [{"chat_id", "title", "seq", "role", "snippet", "highlights"}]; seq and role
+          are None for a match in the title.
+        """
+        return [result for _, result in self.ranked_search(query, limit)]
+
+    def ranked_search(self, query, limit=20):
+        """
+        search() with the rank of each result, so that results from several stores can be merged.
+
+        This default implementation scans every chat; stores with an index override it.
+
+        Returns:
+        - list: (rank, result) pairs, lower ranks (better matches) first. Indexed stores rank with bm25().
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        scored = []
+        for chat in self.list_chats():
+            candidates = [(None, None, chat["title"])] + [
+                (seq, message.get("role"), message.get("content"))
+                for seq, message in enumerate(self.get_messages(chat["id"]) or [])]
+            for seq, role, text in candidates:
+                score = match_score(text, terms)
+                if score:
+                    scored.append((-score, chat, seq, role, text))
+        scored.sort(key=lambda item: item[0])
+        return [(rank, dict(make_snippet(text, terms), chat_id=chat["id"], title=chat["title"], seq=seq, role=role))
+                for rank, chat, seq, role, text in scored[:limit]]
+
+    def list_idle_chats(self, idle_before):
+        """ Return the ids of chats with messages that were last updated before the timestamp idle_before """
+        idle = []
+        for chat in self.list_chats():
+            info = self.get_chat_info(chat["id"])
+            if info and info["message_count"] and info["updated_at"] < idle_before:
+                idle.append(chat["id"])
+        return idle
+
+    def clear_messages(self, chat_id, expected_count):
+        """
+        Remove all messages of a chat but keep its title and summary (used when the messages are archived).
+        Nothing is removed, and False is returned, unless the chat still has exactly expected_count messages.
+        """
+        raise NotImplementedError
+
+    def prepend_messages(self, chat_id, messages):
+        """ Insert messages before the existing messages of a chat (used to restore archived messages) """
+        raise NotImplementedError
+
+    def load_all(self):
+        """ Return the whole store in the legacy chat_history.json layout """
+        return {chat["id"]: {"title": chat["title"], "messages": self.get_messages(chat["id"])}
+                for chat in self.list_chats()}
+
+    def replace_all(self, history):
+        """ Make the store match a legacy chat_history.json dictionary """
+        for chat in self.list_chats():
+            if chat["id"] not in history:
+                self.delete_chat(chat["id"])
+        for chat_id, chat in history.items():
+            stored = self.get_messages(chat_id)
+            if stored is None:
+                self.create_chat(chat_id, chat.get("title", ""))
+                stored = []
+            elif stored != chat.get("messages", [])[:len(stored)]:
+                # History was rewritten rather than extended; recreate the chat
+                self.delete_chat(chat_id)
+                self.create_chat(chat_id, chat.get("title", ""))
+                stored = []
+            self.rename_chat(chat_id, chat.get("title", ""))
+            new_messages = chat.get("messages", [])[len(stored):]
+            if new_messages:
+                self.append_messages(chat_id, new_messages)
+
+
+class SQLiteChatStore(ChatStore):
+    """
+    Embedded SQLite conversation store.
+
+    Titles live in the "chats" table (the chat_id/title index used by the sidebar) and messages in a separate
+    "messages" table keyed by (chat_id, seq), so listing chats never reads message bodies and appending a
+    message is a single-row insert. The database runs in WAL mode so readers do not block the writer.
+
+    Attributes:
+    - path (str): Path of the SQLite database file.
+    - import_file (str): Legacy chat_history.json to import the first time the database is created.
+    """
+
+    def __init__(self, path=CHAT_STORE_FILE, import_file=None):
+        self.path = path
+        self._local = threading.local()
+        self._create_schema()
+        if import_file:
+            self._import_json_once(import_file)
+
+    def _connect(self):
+        """ One connection per thread; transactions are controlled explicitly """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connect())
+
+    def _create_schema(self):
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chats (
+                    chat_id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    summary TEXT NOT NULL DEFAULT '',
+                    summary_upto INTEGER NOT NULL DEFAULT 0
+                )""")
+            # Databases created before rolling summaries existed
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(chats)")}
+            if "summary" not in columns:
+                conn.execute("ALTER TABLE chats ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+                conn.execute("ALTER TABLE chats ADD COLUMN summary_upto INTEGER NOT NULL DEFAULT 0")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    chat_id TEXT NOT NULL REFERENCES chats(chat_id) ON DELETE CASCADE,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT,
+                    extra TEXT,
+                    PRIMARY KEY (chat_id, seq)
+                ) WITHOUT ROWID""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_created ON chats(created_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('chats_version', 0)")
+
+            # Full-text index of titles and messages. It is contentless (the text lives in "chats" and
+            # "messages"), and is kept up to date in the same transactions that change the chats.
+            conn.execute("CREATE TABLE IF NOT EXISTS search_ids (id INTEGER PRIMARY KEY, chat_id TEXT UNIQUE NOT NULL)")
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(terms, content='', "
+                         "tokenize='unicode61 remove_diacritics 2')")
+            indexed = conn.execute("SELECT value FROM meta WHERE key = 'search_index_version'").fetchone()
+            if indexed is None or int(indexed[0]) != SEARCH_INDEX_VERSION:
+                self._rebuild_search_index(conn)
+
+    def _import_json_once(self, import_file):
+        """ Import a legacy chat_history.json into the database, exactly once per database """
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+                return
+            if os.path.exists(import_file):
+                with open(import_file, "r", encoding="utf-8") as file:
+                    history = json.load(file)
+                for chat_id, chat in history.items():
+                    self._insert_chat(conn, chat_id, chat.get("title", ""))
+                    self._insert_messages(conn, chat_id, chat.get("messages", []))
+                logger.info("Imported %d chats from %s into %s", len(history), import_file, self.path)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_imported', ?)", (import_file,))
+
+    @classmethod
+    def _rebuild_search_index(cls, conn):
+        """ Index every chat from scratch (new databases, and databases indexed by another index version) """
+        conn.execute("INSERT INTO search_index (search_index) VALUES ('delete-all')")
+        for chat_id, title in conn.execute("SELECT chat_id, title FROM chats").fetchall():
+            cls._index_text(conn, chat_id, [(-1, title)])
+            cls._index_text(conn, chat_id, conn.execute("SELECT seq, content FROM messages WHERE chat_id = ?",
+                                                        (chat_id,)).fetchall())
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('search_index_version', ?)",
+                     (SEARCH_INDEX_VERSION,))
+
+    @staticmethod
+    def _index_text(conn, chat_id, rows, delete=False):
+        """
+        Add (seq, text) rows of a chat to the search index, seq -1 being the title. With delete=True, remove
+        them instead; a contentless index needs the exact text that was indexed.
+        """
+        conn.execute("INSERT OR IGNORE INTO search_ids (chat_id) VALUES (?)", (chat_id,))
+        base = conn.execute("SELECT id FROM search_ids WHERE chat_id = ?", (chat_id,)).fetchone()[0] << SEARCH_SEQ_BITS
+        statement = "INSERT INTO search_index (search_index, rowid, terms) VALUES ('delete', ?, ?)" if delete \
+            else "INSERT INTO search_index (rowid, terms) VALUES (?, ?)"
+        for seq, text in rows:
+            terms = index_terms(text)
+            if terms and seq + 1 < 1 << SEARCH_SEQ_BITS:
+                conn.execute(statement, (base + seq + 1, terms))
+
+    @classmethod
+    def _unindex_messages(cls, conn, chat_id):
+        cls._index_text(conn, chat_id, conn.execute("SELECT seq, content FROM messages WHERE chat_id = ?",
+                                                    (chat_id,)).fetchall(), delete=True)
+
+    @staticmethod
+    def _bump_chats_version(conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'chats_version'")
+
+    @classmethod
+    def _insert_chat(cls, conn, chat_id, title):
+        now = time.time()
+        if conn.execute("INSERT OR IGNORE INTO chats (chat_id, title, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                        (chat_id, title, now, now)).rowcount:
+            cls._bump_chats_version(conn)
+            cls._index_text(conn, chat_id, [(-1, title)])
+
+    @classmethod
+    def _insert_messages(cls, conn, chat_id, messages, seq=None):
+        if seq is None:
+            seq = conn.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE chat_id = ?",
+                               (chat_id,)).fetchone()[0]
+        cls._index_text(conn, chat_id, [(seq + i, message.get("content")) for i, message in enumerate(messages)])
+        for message in messages:
+            extra = {key: value for key, value in message.items() if key not in MESSAGE_COLUMNS}
+            conn.execute("INSERT INTO messages (chat_id, seq, role, content, extra) VALUES (?, ?, ?, ?, ?)",
+                         (chat_id, seq, message.get("role"), message.get("content"),
+                          json.dumps(extra, ensure_ascii=False) if extra else None))
+            seq += 1
+        conn.execute("UPDATE chats SET updated_at = ? WHERE chat_id = ?", (time.time(), chat_id))
+
+    @staticmethod
+    def _row_to_message(role, content, extra):
+        message = {"role": role, "content": content}
+        if extra:
+            message.update(json.loads(extra))
+        return message
+
+    def list_chats(self, limit=None, before=None, after=None):
+        # Keyset pagination over the (created_at, rowid) index: the cost does not depend on the page's position
+        conditions, params = [], []
+        for cursor, operator in ((before, "<"), (after, ">")):
+            if cursor is not None:
+                conditions.append(f"(created_at, rowid) {operator} "
+                                  f"(SELECT created_at, rowid FROM chats WHERE chat_id = ?)")
+                params.append(cursor)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        newest_first = limit is not None and after is None
+        query = f"SELECT chat_id, title FROM chats {where} ORDER BY created_at {'DESC' if newest_first else ''}, " \
+                f"rowid {'DESC' if newest_first else ''}"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = self._connect().execute(query, params).fetchall()
+        if newest_first:
+            rows.reverse()
+        return [{"id": chat_id, "title": title} for chat_id, title in rows]
+
+    def chats_version(self):
+        return self._connect().execute("SELECT value FROM meta WHERE key = 'chats_version'").fetchone()[0]
+
+    def get_messages(self, chat_id, start=0, end=None):
+        conn = self._connect()
+        if not conn.execute("SELECT 1 FROM chats WHERE chat_id = ?", (chat_id,)).fetchone():
+            return None
+        rows = conn.execute("SELECT role, content, extra FROM messages WHERE chat_id = ? AND seq >= ? AND seq < ? "
+                            "ORDER BY seq", (chat_id, start, end if end is not None else 2 ** 62)).fetchall()
+        return [self._row_to_message(*row) for row in rows]
+
+    def get_chat_info(self, chat_id):
+        row = self._connect().execute(
+            "SELECT title, updated_at, (SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE messages.chat_id = ?) "
+            "FROM chats WHERE chat_id = ?", (chat_id, chat_id)).fetchone()
+        return {"title": row[0], "updated_at": row[1], "message_count": row[2]} if row else None
+
+    def get_summary(self, chat_id):
+        row = self._connect().execute("SELECT summary, summary_upto FROM chats WHERE chat_id = ?",
+                                      (chat_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def set_summary(self, chat_id, summary, summary_upto):
+        with self._transaction() as conn:
+            conn.execute("UPDATE chats SET summary = ?, summary_upto = ? WHERE chat_id = ? AND summary_upto <= ?",
+                         (summary, summary_upto, chat_id, summary_upto))
+
+    def chat_exists(self, chat_id):
+        return self._connect().execute("SELECT 1 FROM chats WHERE chat_id = ?", (chat_id,)).fetchone() is not None
+
+    def create_chat(self, chat_id, title):
+        with self._transaction() as conn:
+            self._insert_chat(conn, chat_id, title)
+
+    def append_messages(self, chat_id, messages):
+        with self._transaction() as conn:
+            self._insert_messages(conn, chat_id, messages)
+
+    def rename_chat(self, chat_id, title):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT title FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+            if row is None:
+                return False
+            conn.execute("UPDATE chats SET title = ? WHERE chat_id = ?", (title, chat_id))
+            self._index_text(conn, chat_id, [(-1, row[0])], delete=True)
+            self._index_text(conn, chat_id, [(-1, title)])
+            self._bump_chats_version(conn)
+            return True
+
+    def delete_chat(self, chat_id):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT title FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+            if row is None:
+                return False
+            self._index_text(conn, chat_id, [(-1, row[0])], delete=True)
+            self._unindex_messages(conn, chat_id)
+            conn.execute("DELETE FROM search_ids WHERE chat_id = ?", (chat_id,))
+            conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            conn.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
+            self._bump_chats_version(conn)
+            return True
+
+    def ranked_search(self, query, limit=20):
+        match = fts_query(query)
+        if not match:
+            return []
+        conn = self._connect()
+        matches = conn.execute("SELECT rowid, bm25(search_index) FROM search_index WHERE search_index MATCH ? "
+                               "ORDER BY bm25(search_index) LIMIT ?", (match, limit)).fetchall()
+        terms = query_terms(query)
+        results = []
+        for rowid, rank in matches:
+            seq = (rowid & ((1 << SEARCH_SEQ_BITS) - 1)) - 1
+            chat_id, title = conn.execute(
+                "SELECT chats.chat_id, title FROM search_ids JOIN chats ON chats.chat_id = search_ids.chat_id "
+                "WHERE search_ids.id = ?", (rowid >> SEARCH_SEQ_BITS,)).fetchone()
+            if seq < 0:
+                role, text, seq = None, title, None
+            else:
+                role, text = conn.execute("SELECT role, content FROM messages WHERE chat_id = ? AND seq = ?",
+                                          (chat_id, seq)).fetchone()
+            results.append((rank, dict(make_snippet(text, terms), chat_id=chat_id, title=title, seq=seq, role=role)))
+        return results
+
+    def list_idle_chats(self, idle_before):
+        rows = self._connect().execute(
+            "SELECT chat_id FROM chats WHERE updated_at < ? AND EXISTS (SELECT 1 FROM messages "
+            "WHERE messages.chat_id = chats.chat_id) ORDER BY updated_at", (idle_before,)).fetchall()
+        return [row[0] for row in rows]
+
+    def clear_messages(self, chat_id, expected_count):
+        with self._transaction() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM messages WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+            if count != expected_count:
+                return False
+            self._unindex_messages(conn, chat_id)
+            conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            return True
+
+    def prepend_messages(self, chat_id, messages):
+        with self._transaction() as conn:
+            # Shift the existing messages up in two steps, through negative numbers, so that no intermediate
+            # (chat_id, seq) collides with another row; their search index entries move with them
+            self._unindex_messages(conn, chat_id)
+            conn.execute("UPDATE messages SET seq = -seq - 1 - ? WHERE chat_id = ?", (len(messages), chat_id))
+            conn.execute("UPDATE messages SET seq = -seq - 1 WHERE chat_id = ?", (chat_id,))
+            self._insert_messages(conn, chat_id, messages, seq=0)
+            shifted = conn.execute("SELECT seq, content FROM messages WHERE chat_id = ? AND seq >= ?",
+                                   (chat_id, len(messages))).fetchall()
+            self._index_text(conn, chat_id, shifted)
+
+
+class _Transaction:
+    """ BEGIN IMMEDIATE ... COMMIT/ROLLBACK, so concurrent writers queue up instead of losing updates """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+class JSONFileChatStore(ChatStore):
+    """
+    The original whole-file chat_history.json storage, kept for small deployments and for debugging.
+    Every write rewrites the file, but a process-wide lock keeps concurrent requests from losing updates.
+    """
+
+    def __init__(self, path="chat_history.json"):
+        self.path = path
+        self._lock = threading.RLock()
+
+    def _read(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        return {}
+
+    def _write(self, history):
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as file:
+            json.dump(history, file, ensure_ascii=False, indent=4)
+        os.replace(tmp_file, self.path)
+
+    def list_chats(self, limit=None, before=None, after=None):
+        chats = [{"id": chat_id, "title": chat["title"]} for chat_id, chat in self._read().items()]
+        positions = {chat["id"]: position for position, chat in enumerate(chats)}
+        if (before is not None and before not in positions) or (after is not None and after not in positions):
+            return []
+        start, end = page_bounds(len(chats), limit, positions.get(before), positions.get(after))
+        return chats[start:end]
+
+    def chats_version(self):
+        listing = json.dumps(self.list_chats(), ensure_ascii=False).encode("utf-8")
+        return hashlib.sha1(listing).hexdigest()
+
+    def get_messages(self, chat_id, start=0, end=None):
+        chat = self._read().get(chat_id)
+        return chat["messages"][start:end] if chat is not None else None
+
+    def get_chat_info(self, chat_id):
+        chat = self._read().get(chat_id)
+        if chat is None:
+            return None
+        return {"title": chat["title"], "message_count": len(chat["messages"]),
+                "updated_at": os.path.getmtime(self.path)}
+
+    def get_summary(self, chat_id):
+        chat = self._read().get(chat_id)
+        return (chat.get("summary", ""), chat.get("summary_upto", 0)) if chat is not None else None
+
+    def set_summary(self, chat_id, summary, summary_upto):
+        with self._lock:
+            history = self._read()
+            if chat_id in history and history[chat_id].get("summary_upto", 0) <= summary_upto:
+                history[chat_id]["summary"] = summary
+                history[chat_id]["summary_upto"] = summary_upto
+                self._write(history)
+
+    def create_chat(self, chat_id, title):
+        with self._lock:
+            history = self._read()
+            if chat_id not in history:
+                history[chat_id] = {"title": title, "messages": []}
+                self._write(history)
+
+    def append_messages(self, chat_id, messages):
+        with self._lock:
+            history = self._read()
+            history[chat_id]["messages"].extend(messages)
+            self._write(history)
+
+    def rename_chat(self, chat_id, title):
+        with self._lock:
+            history = self._read()
+            if chat_id not in history:
+                return False
+            history[chat_id]["title"] = title
+            self._write(history)
+            return True
+
+    def delete_chat(self, chat_id):
+        with self._lock:
+            history = self._read()
+            if chat_id not in history:
+                return False
+            del history[chat_id]
+            self._write(history)
+            return True
+
+    def clear_messages(self, chat_id, expected_count):
+        with self._lock:
+            history = self._read()
+            if chat_id not in history or len(history[chat_id]["messages"]) != expected_count:
+                return False
+            history[chat_id]["messages"] = []
+            self._write(history)
+            return True
+
+    def prepend_messages(self, chat_id, messages):
+        with self._lock:
+            history = self._read()
+            history[chat_id]["messages"][:0] = messages
+            self._write(history)
+
+    def load_all(self):
+        return self._read()
+
+    def replace_all(self, history):
+        with self._lock:
+            self._write(history)
+
+
+class ChatConflictError(Exception):
+    """ A chat kept changing under an optimistic update until the retries ran out """
+
+
+class RedisChatStore(ChatStore):
+    """
+    Conversation store in Redis, shared by every worker process and node.
+
+    Each chat is a hash (title, timestamps, summary and a version counter) plus a list of JSON-encoded messages;
+    a sorted set ordered by creation time indexes the chats for the sidebar. Writers use optimistic concurrency
+    control: they WATCH the chat's hash, check it, and queue their changes in MULTI/EXEC together with a version
+    increment. If another worker changed the chat in between, EXEC fails and the update is retried on the new
+    state, so concurrent appends to the same chat are never lost or interleaved and a deleted chat is never
+    resurrected.
+
+    Search uses an inverted index kept in the same transactions: a sorted set per index term (see
+    chat_search.index_terms()) whose members are the "seq:chat_id" of the titles (seq -1) and messages containing
+    it, scored with the term's BM25 weight in that text, and a sorted set of all terms for prefix queries.
+
+    Attributes:
+    - redis (redis.Redis): A client created with decode_responses=True (see shared_state.connect_redis).
+    - prefix (str): Prefix of all keys.
+    - import_file (str): Legacy chat_history.json to import the first time the store is used.
+    - max_retries (int): Optimistic update attempts before ChatConflictError is raised.
+    """
+
+    def __init__(self, redis, prefix="chatbot:", import_file=None, max_retries=20):
+        if WatchError is None:
+            raise RuntimeError("RedisChatStore needs the redis package (pip install redis)")
+        self.redis = redis
+        self.prefix = prefix
+        self.max_retries = max_retries
+        self._index_key = f"{prefix}chats"
+        self._version_key = f"{prefix}chats_version"
+        self._vocabulary_key = f"{prefix}search:terms"
+        self._documents_key = f"{prefix}search:documents"
+        if self.redis.get(f"{prefix}search:version") != str(SEARCH_INDEX_VERSION) and \
+                self.redis.set(f"{prefix}search:rebuilding", 1, nx=True, ex=3600):
+            self._rebuild_search_index()
+        if import_file:
+            self._import_json_once(import_file)
+
+    def _import_json_once(self, import_file):
+        """ Import a legacy chat_history.json; the first worker to claim the import does it """
+        if not self.redis.set(f"{self.prefix}json_imported", import_file, nx=True):
+            return
+        if os.path.exists(import_file):
+            with open(import_file, "r", encoding="utf-8") as file:
+                history = json.load(file)
+            for chat_id, chat in history.items():
+                self.create_chat(chat_id, chat.get("title", ""))
+                self.append_messages(chat_id, chat.get("messages", []))
+            logger.info("Imported %d chats from %s into Redis", len(history), import_file)
+
+    def _rebuild_search_index(self):
+        """ Index every chat from scratch (data written before the index existed or by another index version) """
+        for key in self.redis.scan_iter(match=f"{self.prefix}search:term:*", count=1000):
+            self.redis.delete(key)
+        self.redis.delete(self._vocabulary_key, self._documents_key)
+        for chat_id in self.redis.zrange(self._index_key, 0, -1):
+            def update(pipe):
+                title = pipe.hget(self._chat_key(chat_id), "title")
+                if title is None:
+                    return
+                rows = [(-1, title)] + self._message_rows(pipe.lrange(self._messages_key(chat_id), 0, -1))
+                pipe.multi()
+                self._queue_index(pipe, chat_id, rows)
+
+            self._update(chat_id, update)
+        self.redis.set(f"{self.prefix}search:version", SEARCH_INDEX_VERSION)
+        self.redis.delete(f"{self.prefix}search:rebuilding")
+        logger.info("Rebuilt the Redis search index")
+
+    def _chat_key(self, chat_id):
+        return f"{self.prefix}chat:{chat_id}"
+
+    def _term_key(self, term):
+        return f"{self.prefix}search:term:{term}"
+
+    @staticmethod
+    def _message_rows(encoded_messages, start=0):
+        """ (seq, content) rows of JSON-encoded messages, the first one being message number start """
+        return [(start + i, json.loads(message).get("content")) for i, message in enumerate(encoded_messages)]
+
+    def _queue_index(self, pipe, chat_id, rows, delete=False):
+        """
+        Queue the search index changes for (seq, text) rows of a chat (seq -1 being the title) on a pipeline in
+        MULTI; with delete=True, remove the rows' entries instead.
+        """
+        documents = 0
+        vocabulary = {}
+        for seq, text in rows:
+            terms = index_terms(text).split()
+            if not terms:
+                continue
+            documents += 1
+            member = f"{seq}:{chat_id}"
+            length_norm = SEARCH_K1 * (1 - SEARCH_B + SEARCH_B * len(terms) / SEARCH_AVERAGE_TERMS)
+            for term, count in Counter(terms).items():
+                if delete:
+                    pipe.zrem(self._term_key(term), member)
+                else:
+                    pipe.zadd(self._term_key(term), {member: count * (SEARCH_K1 + 1) / (count + length_norm)})
+                    vocabulary[term] = 0
+        if vocabulary:
+            pipe.zadd(self._vocabulary_key, vocabulary)
+        if documents:
+            pipe.incrby(self._documents_key, -documents if delete else documents)
+
+    def _messages_key(self, chat_id):
+        return f"{self.prefix}chat:{chat_id}:messages"
+
+    def _update(self, chat_id, update):
+        """
+        Run update(pipe) as an optimistic transaction on a chat.
+
+        update() is called with a pipeline that is WATCHing the chat's hash, so its reads see the current state.
+        It must call pipe.multi() before queuing writes and return the result of the operation.
+        """
+        chat_key = self._chat_key(chat_id)
+        for _ in range(self.max_retries):
+            with self.redis.pipeline() as pipe:
+                try:
+                    pipe.watch(chat_key)
+                    result = update(pipe)
+                    pipe.execute()
+                    return result
+                except WatchError:
+                    continue
+        raise ChatConflictError(f"Chat {chat_id} is being modified concurrently")
+
+    def list_chats(self, limit=None, before=None, after=None):
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zcard(self._index_key)
+            pipe.zrank(self._index_key, before if before is not None else "")
+            pipe.zrank(self._index_key, after if after is not None else "")
+            length, before_rank, after_rank = pipe.execute()
+        if (before is not None and before_rank is None) or (after is not None and after_rank is None):
+            return []
+        start, end = page_bounds(length, limit, before_rank if before is not None else None,
+                                 after_rank if after is not None else None)
+        chat_ids = self.redis.zrange(self._index_key, start, end - 1) if end > start else []
+        with self.redis.pipeline(transaction=False) as pipe:
+            for chat_id in chat_ids:
+                pipe.hget(self._chat_key(chat_id), "title")
+            titles = pipe.execute()
+        return [{"id": chat_id, "title": title} for chat_id, title in zip(chat_ids, titles) if title is not None]
+
+    def chats_version(self):
+        return int(self.redis.get(self._version_key) or 0)
+
+    def get_messages(self, chat_id, start=0, end=None):
+        if end is not None and end <= start:
+            return [] if self.chat_exists(chat_id) else None
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.exists(self._chat_key(chat_id))
+            pipe.lrange(self._messages_key(chat_id), start, end - 1 if end is not None else -1)
+            exists, messages = pipe.execute()
+        return [json.loads(message) for message in messages] if exists else None
+
+    def get_chat_info(self, chat_id):
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hmget(self._chat_key(chat_id), "title", "updated_at")
+            pipe.llen(self._messages_key(chat_id))
+            (title, updated_at), message_count = pipe.execute()
+        return {"title": title, "message_count": message_count, "updated_at": float(updated_at)} \
+            if title is not None else None
+
+    def get_summary(self, chat_id):
+        title, summary, summary_upto = self.redis.hmget(self._chat_key(chat_id), "title", "summary", "summary_upto")
+        return (summary or "", int(summary_upto or 0)) if title is not None else None
+
+    def set_summary(self, chat_id, summary, summary_upto):
+        def update(pipe):
+            stored_upto = pipe.hget(self._chat_key(chat_id), "summary_upto")
+            if stored_upto is None or int(stored_upto) > summary_upto:
+                return
+            pipe.multi()
+            pipe.hset(self._chat_key(chat_id), mapping={"summary": summary, "summary_upto": summary_upto})
+            pipe.hincrby(self._chat_key(chat_id), "version", 1)
+
+        self._update(chat_id, update)
+
+    def chat_exists(self, chat_id):
+        return bool(self.redis.exists(self._chat_key(chat_id)))
+
+    def ranked_search(self, query, limit=20):
+        # Every part of the query is a set of postings (a prefix is the union of the postings of the words it
+        # expands to); ZINTERSTORE adds up their weights times each part's inverse document frequency (BM25)
+        parts = [(term, prefix) for terms, prefix in query_parts(query) for term in terms]
+        if not parts:
+            return []
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(self._documents_key)
+            for term, prefix in parts:
+                if prefix:
+                    pipe.zrangebylex(self._vocabulary_key, f"[{term}", f"[{term}\U0010ffff", 0,
+                                     SEARCH_PREFIX_EXPANSIONS)
+            documents, *expansions = pipe.execute()
+        documents = max(int(documents or 0), 1)
+        tmp = f"{self.prefix}search:tmp:{os.urandom(8).hex()}"
+        keys, unions = [], {}
+        for i, (term, prefix) in enumerate(parts):
+            keys.append(f"{tmp}:{i}" if prefix else self._term_key(term))
+            if prefix:
+                unions[keys[-1]] = [self._term_key(word) for word in expansions[len(unions)]]
+        try:
+            with self.redis.pipeline() as pipe:
+                for key, words in unions.items():
+                    if words:
+                        pipe.zunionstore(key, words, aggregate="MAX")
+                for key in keys:
+                    pipe.zcard(key)
+                counts = pipe.execute()[-len(keys):]
+            if not all(counts):
+                return []
+            weights = {key: math.log(1 + (documents - count + 0.5) / (count + 0.5)) for key, count in zip(keys, counts)}
+            with self.redis.pipeline() as pipe:
+                pipe.zinterstore(tmp, weights, aggregate="SUM")
+                # Twice the limit: the bigrams of a CJK run may occur apart, such hits are dropped below
+                pipe.zrevrange(tmp, 0, limit * 2 - 1, withscores=True)
+                hits = pipe.execute()[1]
+        finally:
+            self.redis.delete(tmp, *unions)
+        hits = [(int(seq), chat_id, score) for (seq, _, chat_id), score in
+                ((member.partition(":"), score) for member, score in hits)]
+        with self.redis.pipeline(transaction=False) as pipe:
+            for seq, chat_id, _ in hits:
+                pipe.hget(self._chat_key(chat_id), "title")
+                if seq >= 0:
+                    pipe.lindex(self._messages_key(chat_id), seq)
+            fetched = iter(pipe.execute())
+        terms = query_terms(query)
+        results = []
+        for seq, chat_id, score in hits:
+            title = next(fetched)
+            encoded = next(fetched) if seq >= 0 else None
+            message = json.loads(encoded) if encoded is not None else {}
+            text = message.get("content") if seq >= 0 else title
+            if title is not None and match_score(text, terms):
+                results.append((-score, dict(make_snippet(text, terms), chat_id=chat_id, title=title,
+                                             seq=seq if seq >= 0 else None, role=message.get("role"))))
+        return results[:limit]
+
+    def create_chat(self, chat_id, title):
+        def update(pipe):
+            if pipe.exists(self._chat_key(chat_id)):
+                return
+            now = time.time()
+            pipe.multi()
+            pipe.hset(self._chat_key(chat_id), mapping={"title": title, "created_at": now, "updated_at": now,
+                                                        "summary": "", "summary_upto": 0, "version": 1})
+            pipe.zadd(self._index_key, {chat_id: now})
+            pipe.incr(self._version_key)
+            self._queue_index(pipe, chat_id, [(-1, title)])
+
+        self._update(chat_id, update)
+
+    def append_messages(self, chat_id, messages):
+        def update(pipe):
+            if not pipe.exists(self._chat_key(chat_id)):
+                raise KeyError(chat_id)
+            start = pipe.llen(self._messages_key(chat_id))
+            pipe.multi()
+            pipe.rpush(self._messages_key(chat_id),
+                       *[json.dumps(message, ensure_ascii=False) for message in messages])
+            self._queue_index(pipe, chat_id, [(start + i, message.get("content"))
+                                              for i, message in enumerate(messages)])
+            pipe.hset(self._chat_key(chat_id), "updated_at", time.time())
+            pipe.hincrby(self._chat_key(chat_id), "version", 1)
+
+        if messages:
+            self._update(chat_id, update)
+
+    def rename_chat(self, chat_id, title):
+        def update(pipe):
+            old_title = pipe.hget(self._chat_key(chat_id), "title")
+            if old_title is None:
+                return False
+            pipe.multi()
+            pipe.hset(self._chat_key(chat_id), "title", title)
+            self._queue_index(pipe, chat_id, [(-1, old_title)], delete=True)
+            self._queue_index(pipe, chat_id, [(-1, title)])
+            pipe.hincrby(self._chat_key(chat_id), "version", 1)
+            pipe.incr(self._version_key)
+            return True
+
+        return self._update(chat_id, update)
+
+    def delete_chat(self, chat_id):
+        def update(pipe):
+            title = pipe.hget(self._chat_key(chat_id), "title")
+            if title is None:
+                return False
+            rows = [(-1, title)] + self._message_rows(pipe.lrange(self._messages_key(chat_id), 0, -1))
+            pipe.multi()
+            pipe.delete(self._chat_key(chat_id), self._messages_key(chat_id))
+            self._queue_index(pipe, chat_id, rows, delete=True)
+            pipe.zrem(self._index_key, chat_id)
+            pipe.incr(self._version_key)
+            return True
+
+        return self._update(chat_id, update)
+
+    def clear_messages(self, chat_id, expected_count):
+        def update(pipe):
+            if not pipe.exists(self._chat_key(chat_id)) or pipe.llen(self._messages_key(chat_id)) != expected_count:
+                return False
+            rows = self._message_rows(pipe.lrange(self._messages_key(chat_id), 0, -1))
+            pipe.multi()
+            pipe.delete(self._messages_key(chat_id))
+            self._queue_index(pipe, chat_id, rows, delete=True)
+            pipe.hincrby(self._chat_key(chat_id), "version", 1)
+            return True
+
+        return self._update(chat_id, update)
+
+    def prepend_messages(self, chat_id, messages):
+        def update(pipe):
+            if not pipe.exists(self._chat_key(chat_id)):
+                raise KeyError(chat_id)
+            encoded = pipe.lrange(self._messages_key(chat_id), 0, -1)
+            pipe.multi()
+            pipe.lpush(self._messages_key(chat_id),
+                       *[json.dumps(message, ensure_ascii=False) for message in reversed(messages)])
+            # The existing messages move up; their index entries move with them
+            self._queue_index(pipe, chat_id, self._message_rows(encoded), delete=True)
+            self._queue_index(pipe, chat_id, [(i, message.get("content")) for i, message in enumerate(messages)] +
+                              self._message_rows(encoded, start=len(messages)))
+            pipe.hset(self._chat_key(chat_id), "updated_at", time.time())
+            pipe.hincrby(self._chat_key(chat_id), "version", 1)
+
+        if messages:
+            self._update(chat_id, update)
+
+
+# Available storage backends, selected with the CHAT_STORE_BACKEND environment variable
+CHAT_STORE_BACKENDS = {
+    "sqlite": SQLiteChatStore,
+    "json": JSONFileChatStore,
+    "redis": RedisChatStore,
+}
+
+
+def create_chat_store(backend="sqlite", **kwargs):
+    """
+    Create a conversation store.
+
+    Parameters:
+    - backend (str): Name of the backend in CHAT_STORE_BACKENDS.
+    - kwargs: Passed to the backend's constructor.
+
+    Returns:
+    - ChatStore: The storage backend.
+    """
+    if backend not in CHAT_STORE_BACKENDS:
+        raise ValueError(f"Unknown chat store backend: {backend}")
+    return CHAT_STORE_BACKENDS[backend](**kwargs)
@@ -0,0 +1,123 @@
+import logging
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; fall back to an estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Tokens added by the chat format around every message
+TOKENS_PER_MESSAGE = 4
+
+# Only these fields are sent to the API; sentiment/confidence stay in the chat history
+API_MESSAGE_FIELDS = ("role", "content", "name")
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:  # The BPE file could not be loaded (e.g. offline)
+            logger.warning("tiktoken unavailable, estimating token counts: %s", e)
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    """
+    Count the tokens of a text with the GPT-4o tokenizer, or estimate them if tiktoken is not available.
+    The estimate counts each CJK character as one token and every four other characters as one token.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding() if tiktoken is not None else False
+    if encoding:
+        return len(encoding.encode(text))
+    wide = sum(1 for char in text if ord(char) > 0x2E80)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def count_message_tokens(message):
+    return TOKENS_PER_MESSAGE + count_tokens(message.get("content") or "")
+
+
+def to_api_message(message):
+    """ Strip a stored message down to the fields the API accepts """
+    return {field: message[field] for field in API_MESSAGE_FIELDS if field in message}
+
+
+class ContextBuilder:
+    """
+    Build the message list sent to GPT-4o within a token budget.
+
+    The most recent messages are kept verbatim. Once they no longer fit, the older ones are folded into a rolling
+    summary that is stored with the chat, so every message is summarized only once. Trimming goes down to
+    keep_ratio of the budget (and of max_messages), which leaves room for the next few turns before the summary
+    has to be updated again; until then the start of the context stays the same, so its prompt prefix can be
+    served from the provider's prompt cache.
+
+    Attributes:
+    - token_budget (int): The maximum number of prompt tokens for the history (summary included).
+    - max_messages (int): The maximum number of verbatim messages.
+    - summarize (callable): Receives (previous summary, messages to fold in) and returns the new summary.
+    - keep_ratio (float): Share of the budget kept verbatim after trimming.
+    """
+
+    def __init__(self, token_budget=3000, max_messages=20, summarize=None, keep_ratio=0.5):
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self.summarize = summarize
+        self.keep_ratio = keep_ratio
+
+    def _window_start(self, messages, budget, max_messages):
+        """ Index of the oldest message that still fits in the budget (the newest message is always kept) """
+        used = 0
+        start = len(messages)
+        while start > 0 and len(messages) - start < max_messages:
+            cost = count_message_tokens(messages[start - 1])
+            if used + cost > budget and start < len(messages):
+                break
+            used += cost
+            start -= 1
+        return start
+
+    def build(self, messages, summary="", offset=0, summarize=None):
+        """
+        Select the context for the next completion.
+
+        Parameters:
+        - messages (list): The stored messages that are not yet summarized, newest last (including the new user
+          message).
+        - summary (str): The rolling summary of the messages before them.
+        - offset (int): Index of messages[0] in the whole chat, i.e. how many messages the summary covers.
+        - summarize (callable): Replaces the builder's summarize for this call (e.g. to bind it to a request).
+
+        Returns:
+        - tuple: (API messages, summary, offset). The summary and offset differ from the input when older
+          messages were folded into the summary and should be stored with the chat.
+        """
+        summary_tokens = count_tokens(summary) + TOKENS_PER_MESSAGE if summary else 0
+        start = self._window_start(messages, self.token_budget - summary_tokens, self.max_messages)
+
+        if start > 0:
+            # Over budget: trim further than necessary so that the summary is not updated on every turn
+            start = max(start, self._window_start(messages, int(self.token_budget * self.keep_ratio),
+                                                  max(1, int(self.max_messages * self.keep_ratio))))
+            summarize = summarize or self.summarize
+            if summarize:
+                try:
+                    summary = summarize(summary, [to_api_message(m) for m in messages[:start]])
+                    offset += start
+                    messages = messages[start:]
+                    start = 0
+                except Exception as e:
+                    logger.warning("Failed to summarize conversation, dropping older messages instead: %s", e)
+
+        context = [to_api_message(message) for message in messages[start:]]
+        if summary:
+            context.insert(0, {"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        return context, summary, offset
@@ -1,3 +1,4 @@
+import uuid
 from locust import HttpUser, task, between
 
 class ChatbotLoadTest(HttpUser):
@@ -7,21 +8,23 @@ class ChatbotLoadTest(HttpUser):
         """ Each user must log in upon startup to obtain a Session """
         response = self.client.post("/login", data={"password": "hanliangdeng"})
         print(f"Login response: {response.status_code}, {response.text}")
+        # Every simulated user writes to its own chat, so users do not contend for the same record
+        self.chat_id = f"locust_{uuid.uuid4().hex}"
 
     @task
     def test_chat(self):
         """Simulate a user sending a message"""
-        self.client.post("/api/chat", json={"message": "Could you please explain to me in detail what natural language processing is?", "chat_id": "test_chat"})
+        self.client.post("/api/chat", json={"message": "Could you please explain to me in detail what natural language processing is?", "chat_id": self.chat_id})
 
     @task
     def test_news_request(self):
         """Simulate querying the news API"""
-        self.client.post("/api/chat", json={"message": "Give me the latest three news items.", "chat_id": "test_chat"})
+        self.client.post("/api/chat", json={"message": "Give me the latest three news items.", "chat_id": self.chat_id})
 
     @task
     def test_weather_request(self):
         """Simulate querying the weather API"""
-        self.client.post("/api/chat", json={"message": "How is the weather in Shanghai?", "chat_id": "test_chat"})
+        self.client.post("/api/chat", json={"message": "How is the weather in Shanghai?", "chat_id": self.chat_id})
 
 if __name__ == "__main__":
     import os
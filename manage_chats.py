@@ -0,0 +1,63 @@
+"""
+Maintenance commands for the chat store, using the same configuration (environment variables) as the app.
+
+    python manage_chats.py archive --idle-days 30       # move idle chats to the archive now
+    python manage_chats.py export --output chats.export  # every chat, hot or archived, in the archive format
+    python manage_chats.py import --input chats.export [--archived]
+    python manage_chats.py stats
+
+Exports can be imported into a store of any backend, which makes them the migration path between backends
+(e.g. export from SQLite, set CHAT_STORE_BACKEND=redis, import). Chats that already exist are skipped.
+"""
+import argparse
+import json
+import logging
+import sys
+
+from chat_archive import ArchivingChatStore, ChatArchive, read_export, write_export
+
+
+def open_store():
+    """ The configured chat store, always with the archive tier attached """
+    import app as chatbot
+
+    chatbot.create_app(warm_up=False)
+    store = chatbot.chat_store
+    if not isinstance(store, ArchivingChatStore):
+        store = ArchivingChatStore(store, ChatArchive(chatbot.CHAT_ARCHIVE_DIR))
+    return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive, export and import chats")
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive = commands.add_parser("archive", help="Archive chats idle for the given number of days")
+    archive.add_argument("--idle-days", type=float, required=True)
+    export = commands.add_parser("export", help="Write every chat to an export file")
+    export.add_argument("--output", required=True)
+    load = commands.add_parser("import", help="Add the chats of an export file")
+    load.add_argument("--input", required=True)
+    load.add_argument("--archived", action="store_true", help="Write the messages straight to the archive")
+    commands.add_parser("stats", help="Print the size of the archive")
+    args = parser.parse_args(argv)
+
+    store = open_store()
+    if args.command == "archive":
+        print(f"Archived {store.archive_idle_chats(args.idle_days * 86400)} chats")
+    elif args.command == "export":
+        records = (store.read_chat(chat["id"]) for chat in store.list_chats())
+        print(f"Exported {write_export(args.output, filter(None, records))} chats to {args.output}")
+    elif args.command == "import":
+        imported = skipped = 0
+        for record in read_export(args.input):
+            if store.import_chat(record, archived=args.archived):
+                imported += 1
+            else:
+                skipped += 1
+        print(f"Imported {imported} chats, skipped {skipped} existing ones")
+    print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    main()
@@ -0,0 +1,120 @@
+"""
+Prompt assembly for the GPT-4o calls of /api/chat, ordered for the provider's automatic prompt caching.
+
+OpenAI caches the longest previously seen prefix of a prompt (tool definitions first, then the messages, in
+blocks of 128 tokens once a prompt exceeds 1024 tokens) and bills and prefills the cached part faster and at a
+discount. A prefix only matches if it is byte-for-byte identical, so every prompt is built as
+
+    tool definitions (canonical serialization) | fixed system prompt | rolling summary | history | per-turn hints
+
+The parts change from least to most often: the tools only when a schema is regenerated, the summary when older
+messages are folded into it, the history grows at its end, and hints such as the sentiment instruction differ
+from turn to turn. The follow-up call after tool calls extends the first call's prompt and sends the same tools,
+so it shares the whole prefix.
+"""
+import json
+import threading
+
+
+def canonical_tools(tools):
+    """
+    Tool definitions in a canonical order: sorted by function name, object keys sorted at every level.
+
+    Parameters:
+    - tools (list): Definitions in the tools= format of the chat completions API.
+
+    Returns:
+    - list: Equal definitions whose JSON serialization depends only on their content.
+    """
+    ordered = sorted(tools, key=lambda tool: tool.get("function", {}).get("name", ""))
+    return json.loads(json.dumps(ordered, sort_keys=True, ensure_ascii=False))
+
+
+class PromptBuilder:
+    """
+    Builds the messages of a completion in the cache-friendly order described above.
+
+    Attributes:
+    - system_prompt (str): The fixed system prompt every chat completion starts with ("" for none).
+    """
+
+    def __init__(self, system_prompt=""):
+        self.system_prompt = system_prompt
+        self._tools_key = None
+        self._tools = None
+        self._lock = threading.Lock()
+
+    def tools(self, tools):
+        """ canonical_tools(), computed once per distinct set of definitions """
+        key = json.dumps(tools, sort_keys=True, ensure_ascii=False)
+        with self._lock:
+            if key != self._tools_key:
+                self._tools_key, self._tools = key, canonical_tools(tools)
+            return self._tools
+
+    def messages(self, context, hints=()):
+        """
+        Parameters:
+        - context (list): The summary and history from ContextBuilder, ending with the new user message.
+        - hints (list): Per-turn system messages (e.g. the sentiment instruction), placed after the history.
+
+        Returns:
+        - list: The messages of the first completion. The follow-up completion appends the tool messages.
+        """
+        prefix = [{"role": "system", "content": self.system_prompt}] if self.system_prompt else []
+        return prefix + list(context) + list(hints)
+
+
+class PromptCacheStats:
+    """
+    Prompt and cached prompt tokens (usage.prompt_tokens_details.cached_tokens) per kind of call, with estimates
+    of what the cache saved.
+
+    Attributes:
+    - price_per_mtok (float): Price of a million uncached prompt tokens.
+    - cached_price_per_mtok (float): Price of a million cached prompt tokens.
+    - prefill_ms_per_1k_tokens (float): Estimated prefill time of a thousand uncached prompt tokens; cached
+      tokens are assumed to cost no prefill time.
+    """
+
+    def __init__(self, price_per_mtok=2.5, cached_price_per_mtok=1.25, prefill_ms_per_1k_tokens=25):
+        self.price_per_mtok = price_per_mtok
+        self.cached_price_per_mtok = cached_price_per_mtok
+        self.prefill_ms_per_1k_tokens = prefill_ms_per_1k_tokens
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def record(self, call, prompt_tokens, cached_tokens):
+        with self._lock:
+            stats = self._calls.setdefault(call, {"calls": 0, "calls_with_hits": 0, "prompt_tokens": 0,
+                                                  "cached_tokens": 0})
+            stats["calls"] += 1
+            stats["calls_with_hits"] += 1 if cached_tokens else 0
+            stats["prompt_tokens"] += prompt_tokens
+            stats["cached_tokens"] += cached_tokens
+
+    def _summarize(self, stats):
+        prompt, cached = stats["prompt_tokens"], stats["cached_tokens"]
+        return dict(
+            stats,
+            hit_ratio=round(cached / prompt, 4) if prompt else 0.0,
+            estimated_cost_saved=round(cached * (self.price_per_mtok - self.cached_price_per_mtok) / 1e6, 6),
+            estimated_latency_saved_ms=round(cached * self.prefill_ms_per_1k_tokens / 1000, 1),
+            estimated_latency_saved_ms_per_call=round(
+                cached * self.prefill_ms_per_1k_tokens / 1000 / stats["calls"], 1) if stats["calls"] else 0.0,
+        )
+
+    def report(self):
+        """
+        Returns:
+        - dict: {"calls": {call name: stats}, "total": stats}. The stats hold the counts and token sums, the
+          hit ratio (cached / prompt tokens) and the estimated cost and prefill latency saved.
+        """
+        with self._lock:
+            calls = {call: dict(stats) for call, stats in self._calls.items()}
+        total = {"calls": 0, "calls_with_hits": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        for stats in calls.values():
+            for key in total:
+                total[key] += stats[key]
+        return {"calls": {call: self._summarize(stats) for call, stats in sorted(calls.items())},
+                "total": self._summarize(total)}
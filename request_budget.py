@@ -0,0 +1,171 @@
+"""
+Request-scoped limits for /api/chat: stop spending OpenAI tokens on replies nobody will read.
+
+A RequestBudget is created when a chat request is admitted and checked before and during every OpenAI call of
+the request. It ends the pipeline early (RequestAborted) when
+
+- the client has disconnected ("client_disconnected"): the connection's socket is probed without blocking, and
+  in streaming mode the server closing the response generator has the same effect;
+- the request's deadline has passed ("deadline"): each call's timeout is also cut to the time left;
+- the request's token budget is spent ("token_budget"): each call's max_tokens is also cut to the tokens left,
+  so a completion that reaches it ends as a partial answer.
+"""
+import socket
+import threading
+import time
+
+
+class RequestAborted(Exception):
+    """
+    Raised when a chat request has to stop early.
+
+    Attributes:
+    - reason (str): "client_disconnected", "deadline" or "token_budget".
+    - partial_reply (str): The part of the reply generated before the request stopped, if any.
+    """
+
+    def __init__(self, reason, partial_reply=""):
+        super().__init__(f"Request aborted: {reason}")
+        self.reason = reason
+        self.partial_reply = partial_reply or ""
+
+
+def connection_probe(environ):
+    """
+    A function telling whether the client of a WSGI request has closed its connection.
+
+    gunicorn and the Werkzeug development server expose the connection's socket in the environ. A socket
+    whose peer has closed it is readable and returns b"" when peeked at; any other outcome (no data yet, a
+    pipelined request, a TLS socket that does not support peeking) counts as still connected.
+
+    Returns:
+    - callable or None: The probe, or None if the server does not expose the socket.
+    """
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    dont_wait = getattr(socket, "MSG_DONTWAIT", None)  # Not available on Windows
+    if sock is None or dont_wait is None:
+        return None
+    flags = socket.MSG_PEEK | dont_wait
+
+    def is_disconnected():
+        try:
+            return sock.recv(1, flags) == b""
+        except (BlockingIOError, InterruptedError, ValueError):
+            return False
+        except OSError:
+            return True
+
+    return is_disconnected
+
+
+class RequestBudget:
+    """
+    The deadline, token budget and connection state of one chat request.
+
+    Attributes:
+    - deadline (float): Seconds the request may take from its creation, 0 for no deadline.
+    - token_budget (int): Prompt and completion tokens its OpenAI calls may use together, 0 for no budget.
+    - is_disconnected (callable): Returns True once the client is gone (see connection_probe()), or None.
+    - tokens_used (int): Tokens charged so far.
+    - aborted (str): The reason the request was stopped (the first one, if several apply), None until then.
+    """
+
+    # A call that could not even produce this many completion tokens is not started
+    MIN_COMPLETION_TOKENS = 16
+
+    def __init__(self, deadline=0, token_budget=0, is_disconnected=None):
+        self.deadline = deadline
+        self.token_budget = token_budget
+        self.is_disconnected = is_disconnected
+        self.tokens_used = 0
+        self.aborted = None
+        self._expires = time.monotonic() + deadline if deadline > 0 else None
+        self._lock = threading.Lock()
+
+    def remaining_seconds(self):
+        """ Seconds until the deadline, None without one """
+        return None if self._expires is None else self._expires - time.monotonic()
+
+    def remaining_tokens(self):
+        """ Tokens left in the budget, None without one """
+        return None if not self.token_budget else self.token_budget - self.tokens_used
+
+    def expired(self):
+        """ Whether the deadline has passed """
+        remaining = self.remaining_seconds()
+        return remaining is not None and remaining <= 0
+
+    def abort(self, reason, partial_reply=""):
+        """ Record that the request stops and return the RequestAborted to raise, with the first recorded reason """
+        with self._lock:
+            self.aborted = self.aborted or reason
+        return RequestAborted(self.aborted, partial_reply)
+
+    def check(self):
+        """
+        Raises:
+        - RequestAborted: If the request was stopped before, the client disconnected or the deadline passed.
+        """
+        if self.aborted is not None:
+            raise RequestAborted(self.aborted)
+        if self.is_disconnected is not None and self.is_disconnected():
+            raise self.abort("client_disconnected")
+        if self.expired():
+            raise self.abort("deadline")
+
+    def call_limits(self, prompt_tokens, timeout):
+        """
+        Check the request before an OpenAI call and cut the call's limits to what is left of the budget.
+
+        Parameters:
+        - prompt_tokens (int): The (estimated) prompt size of the call.
+        - timeout (float): The call's own timeout in seconds.
+
+        Returns:
+        - dict: Keyword arguments for the call: "timeout", plus "max_tokens" under a token budget.
+
+        Raises:
+        - RequestAborted: If the request must stop instead of making the call.
+        """
+        self.check()
+        limits = {"timeout": timeout}
+        remaining = self.remaining_seconds()
+        if remaining is not None:
+            limits["timeout"] = min(timeout, remaining)
+        tokens = self.remaining_tokens()
+        if tokens is not None:
+            if tokens - prompt_tokens < self.MIN_COMPLETION_TOKENS:
+                raise self.abort("token_budget")
+            limits["max_tokens"] = tokens - prompt_tokens
+        return limits
+
+    def charge(self, tokens):
+        """ Count tokens spent by one of the request's calls """
+        with self._lock:
+            self.tokens_used += tokens
+
+
+class CompletionLengths:
+    """
+    Moving average of the completion tokens of each kind of OpenAI call, used to estimate the tokens that an
+    aborted or skipped call did not spend.
+
+    Attributes:
+    - default (int): The estimate for a call that has not been observed yet.
+    - alpha (float): Weight of the newest observation.
+    """
+
+    def __init__(self, default=150, alpha=0.1):
+        self.default = default
+        self.alpha = alpha
+        self._averages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, call, tokens):
+        with self._lock:
+            average = self._averages.get(call)
+            self._averages[call] = tokens if average is None else average + self.alpha * (tokens - average)
+
+    def expected(self, call):
+        with self._lock:
+            return self._averages.get(call, self.default)
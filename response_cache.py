@@ -0,0 +1,210 @@
+"""
+Opt-in cache of complete chat replies (RESPONSE_CACHE_ENABLED=1).
+
+A question asked again in the same conversation state is answered without calling the model. Matching is on the
+normalized question; with RESPONSE_CACHE_EMBEDDING_MODEL set, paraphrases are matched too by the cosine
+similarity of local sentence embeddings, searched in an in-process vector index (no network service).
+
+Only answers that cannot go stale are cached: replies that used a tool (weather, news) are never stored, and
+questions about the present ("today", "latest", "现在", ...) are neither looked up nor stored.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# Questions whose answer depends on the current time or on live data are never cached
+TIME_SENSITIVE_PATTERN = re.compile(
+    r"\b(today|tonight|tomorrow|yesterday|now|current(ly)?|latest|recent|this (week|month|year)|weather|news|"
+    r"price|stock|score)\b|今天|明天|昨天|现在|目前|当前|最新|最近|天气|新闻|价格|股价",
+    re.IGNORECASE)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text):
+    """ Unicode-normalize, case-fold and collapse whitespace; trailing punctuation does not change the key """
+    text = _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip().casefold()
+    return text.rstrip("?!.。？！ ")
+
+
+def context_scope(messages):
+    """
+    Hash the messages that precede the user's question (system hints, summary, earlier turns). A cached reply is
+    only reused under the same scope, i.e. for the same question asked in the same conversation state; the first
+    question of every new chat shares one scope.
+    """
+    payload = json.dumps([[message.get("role"), message.get("content")] for message in messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_sentence_embedder(model_name):
+    """
+    Load a local sentence-transformers model.
+
+    Returns:
+    - callable: Maps a text to its unit-length embedding (a numpy vector), so that a dot product is the cosine
+      similarity.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name)
+
+    def embed(text):
+        return model.encode(text, normalize_embeddings=True)
+
+    return embed
+
+
+class _VectorIndex:
+    """ In-process exact nearest-neighbour search over unit vectors (cosine similarity as a dot product) """
+
+    def __init__(self):
+        self._keys = []
+        self._vectors = {}
+        self._matrix = None
+
+    def add(self, key, vector):
+        if key not in self._vectors:
+            self._keys.append(key)
+        self._vectors[key] = vector
+        self._matrix = None
+
+    def remove(self, key):
+        if self._vectors.pop(key, None) is not None:
+            self._keys.remove(key)
+            self._matrix = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def similar(self, vector, threshold):
+        """ Return the keys of the vectors with a similarity of at least threshold, most similar first """
+        import numpy as np
+
+        if not self._keys:
+            return []
+        if self._matrix is None:
+            self._matrix = np.stack([self._vectors[key] for key in self._keys])
+        similarities = self._matrix @ vector
+        matches = np.flatnonzero(similarities >= threshold)
+        return [self._keys[i] for i in matches[np.argsort(-similarities[matches], kind="stable")]]
+
+
+class ResponseCache:
+    """
+    Cache of chat replies keyed on the normalized question within a conversation scope (see context_scope()).
+
+    With an embedding function, a question that is not cached verbatim is also matched against the cached
+    questions of the same scope, and the reply of the most similar unexpired one is reused if the cosine
+    similarity reaches similarity_threshold. Entries expire after ttl seconds and the least recently used entry is evicted
+    once maxsize is reached.
+
+    The caller decides what may be cached: replies that used tools and time-sensitive questions
+    (is_cacheable_question()) must not be stored.
+
+    Attributes:
+    - maxsize (int): The maximum number of cached replies.
+    - ttl (float): Lifetime of a cached reply in seconds.
+    - embed (callable): Optional; maps a normalized question to a unit-length numpy vector.
+    - similarity_threshold (float): The minimum cosine similarity of a semantic hit.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, embed=None, similarity_threshold=0.92):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @staticmethod
+    def is_cacheable_question(question):
+        return not TIME_SENSITIVE_PATTERN.search(question)
+
+    def _remove(self, key):
+        """ Drop an entry and its vector; caller holds the lock """
+        del self._entries[key]
+        index = self._indexes.get(key[0])
+        if index is not None:
+            index.remove(key)
+            if not len(index):
+                del self._indexes[key[0]]
+
+    def _get_fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def lookup(self, scope, question):
+        """
+        Return the cached reply for a question, or None.
+
+        Parameters:
+        - scope (str): The conversation scope of the question.
+        - question (str): The user's message.
+
+        Returns:
+        - str: The cached reply, or None on a miss.
+        """
+        normalized = normalize_prompt(question)
+        with self._lock:
+            reply = self._get_fresh((scope, normalized))
+            if reply is not None:
+                self._stats["hits"] += 1
+                return reply
+            has_candidates = scope in self._indexes
+
+        if self.embed is not None and has_candidates:
+            vector = self.embed(normalized)
+            with self._lock:
+                index = self._indexes.get(scope)
+                # Expired entries are dropped on the way, the next similar enough question may still be fresh
+                for key in index.similar(vector, self.similarity_threshold) if index is not None else []:
+                    reply = self._get_fresh(key)
+                    if reply is not None:
+                        self._stats["semantic_hits"] += 1
+                        return reply
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def store(self, scope, question, reply):
+        """ Cache the reply to a question """
+        normalized = normalize_prompt(question)
+        vector = self.embed(normalized) if self.embed is not None else None
+        key = (scope, normalized)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, reply)
+            self._entries.move_to_end(key)
+            if vector is not None:
+                self._indexes.setdefault(scope, _VectorIndex()).add(key, vector)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._indexes.clear()
+
+    def stats(self):
+        """ Return hit (exact and semantic), miss, store and eviction counters and the current size """
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries), maxsize=self.maxsize, ttl=self.ttl,
+                         semantic=self.embed is not None)
+        lookups = stats["hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,143 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# File for storing generated function schemas
+SCHEMA_CACHE_FILE = "function_schemas.json"
+
+
+def function_fingerprint(function):
+    """
+    Hash everything that the generated JSON Schema depends on: the name, the signature and the docstring.
+
+    Parameters:
+    - function (callable): The functional function to fingerprint.
+
+    Returns:
+    - str: A hex digest that changes whenever the function's declaration changes.
+    """
+    declaration = "\n".join([
+        function.__name__,
+        str(inspect.signature(function)),
+        inspect.getdoc(function) or "",
+    ])
+    return hashlib.sha256(declaration.encode("utf-8")).hexdigest()
+
+
+class FunctionSchemaCache:
+    """
+    Content-addressed cache for the JSON Schema descriptions of functional functions.
+
+    Schemas are kept in memory and mirrored to a JSON file, keyed by function name and stored together with
+    the fingerprint of the declaration they were generated from. Only functions whose fingerprint changed
+    (or that were never generated) are sent to the generator again.
+
+    Attributes:
+    - generate (callable): Receives a list of functions and returns a list of JSON Schema descriptions.
+    - cache_file (str): Path of the on-disk cache, or None to keep the cache in memory only.
+    """
+
+    def __init__(self, generate, cache_file=SCHEMA_CACHE_FILE):
+        self.generate = generate
+        self.cache_file = cache_file
+        self._entries = self._load()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """ Load cached schemas from disk, ignoring a missing or corrupt file """
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as file:
+                entries = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("Ignoring unreadable schema cache %s: %s", self.cache_file, e)
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _save(self):
+        """ Write the cache atomically so that a crash never leaves a truncated file behind """
+        if not self.cache_file:
+            return
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as file:
+            json.dump(self._entries, file, ensure_ascii=False, indent=4)
+        os.replace(tmp_file, self.cache_file)
+
+    def _lookup(self, functions_list):
+        """ Split functions into cached schemas and functions that still need to be generated """
+        schemas, stale = {}, []
+        for function in functions_list:
+            entry = self._entries.get(function.__name__)
+            if entry and entry.get("hash") == function_fingerprint(function):
+                schemas[function.__name__] = entry["schema"]
+            else:
+                stale.append(function)
+        return schemas, stale
+
+    def get_schemas(self, functions_list):
+        """
+        Return the JSON Schema descriptions for the given functions, generating only the missing ones.
+
+        Parameters:
+        - functions_list (list): A list containing multiple functional functions.
+
+        Returns:
+        - list: The JSON Schema descriptions, in the order of functions_list. Functions whose schema could
+          not be generated are left out.
+        """
+        schemas, stale = self._lookup(functions_list)
+
+        if stale:
+            with self._lock:
+                # Another request (or worker process) may have generated the schemas while we were waiting
+                self._entries.update(self._load())
+                schemas, stale = self._lookup(functions_list)
+                if stale:
+                    generated = {schema.get("name"): schema for schema in self.generate(stale)
+                                 if isinstance(schema, dict)}
+                    for function in stale:
+                        schema = generated.get(function.__name__)
+                        if schema is None:
+                            logger.error("No JSON Schema generated for %s", function.__name__)
+                            continue
+                        self._entries[function.__name__] = {"hash": function_fingerprint(function),
+                                                            "schema": schema}
+                        schemas[function.__name__] = schema
+                    self._save()
+
+        return [schemas[function.__name__] for function in functions_list if function.__name__ in schemas]
+
+
+class RedisFunctionSchemaCache(FunctionSchemaCache):
+    """
+    FunctionSchemaCache kept in a Redis hash instead of a file, so that every worker process and node generates
+    a schema once for all of them.
+
+    Attributes:
+    - generate (callable): Receives a list of functions and returns a list of JSON Schema descriptions.
+    - redis (redis.Redis): A client created with decode_responses=True.
+    - key (str): The Redis hash holding the entries.
+    """
+
+    def __init__(self, generate, redis, key="chatbot:function_schemas"):
+        self.redis = redis
+        self.key = key
+        super().__init__(generate, cache_file=None)
+
+    def _load(self):
+        try:
+            return {name: json.loads(entry) for name, entry in self.redis.hgetall(self.key).items()}
+        except Exception as e:
+            logger.warning("Ignoring unreadable schema cache in Redis: %s", e)
+            return {}
+
+    def _save(self):
+        if self._entries:
+            self.redis.hset(self.key, mapping={name: json.dumps(entry, ensure_ascii=False)
+                                               for name, entry in self._entries.items()})
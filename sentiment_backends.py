@@ -0,0 +1,155 @@
+"""
+Interchangeable implementations of the sentiment classifier.
+
+Every backend loader receives the Hugging Face model name and returns a callable that classifies a list of texts
+into [{"label": ..., "score": ...}, ...], the same shape as a transformers pipeline. The backend is chosen with
+SENTIMENT_BACKEND; compare them with `python -m benchmark.sentiment`.
+
+- "pytorch": the full-precision transformers pipeline
+- "int8":    the same model with its Linear layers dynamically quantized to int8 (CPU only)
+- "onnx":    the model exported to ONNX once and run with ONNX Runtime
+- "stub":    a keyword lookup that needs no model download, for offline benchmarks and tests
+"""
+import inspect
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Maximum input length of the sentiment model; longer inputs are truncated
+MAX_SEQUENCE_LENGTH = 512
+
+# Directory for exported ONNX models
+ONNX_MODEL_DIR = os.getenv("SENTIMENT_ONNX_DIR", "onnx_models")
+
+
+def load_pytorch_backend(model_name):
+    """ The full-precision transformers pipeline """
+    from transformers import pipeline
+
+    sentiment_pipeline = pipeline("sentiment-analysis", model=model_name)
+
+    def classify(texts):
+        return sentiment_pipeline(texts, batch_size=len(texts), truncation=True)
+
+    return classify
+
+
+def load_int8_backend(model_name):
+    """ The transformers pipeline with dynamically quantized int8 Linear layers """
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    sentiment_pipeline = pipeline("sentiment-analysis", model=model,
+                                  tokenizer=AutoTokenizer.from_pretrained(model_name))
+
+    def classify(texts):
+        return sentiment_pipeline(texts, batch_size=len(texts), truncation=True)
+
+    return classify
+
+
+def export_onnx_model(model_name, path):
+    """
+    Export a sequence classification model to ONNX with dynamic batch and sequence axes.
+
+    Parameters:
+    - model_name (str): The Hugging Face model name.
+    - path (str): Where to write the .onnx file.
+    """
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model.eval()
+    inputs = AutoTokenizer.from_pretrained(model_name)(["an example input"], return_tensors="pt")
+    export_options = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        export_options["dynamo"] = False  # The TorchScript exporter handles dynamic_axes without extra packages
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            model, (inputs["input_ids"], inputs["attention_mask"]), tmp_path,
+            input_names=["input_ids", "attention_mask"], output_names=["logits"],
+            dynamic_axes={"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"},
+                          "logits": {0: "batch"}},
+            opset_version=14, **export_options)
+    os.replace(tmp_path, path)
+    logger.info("Exported %s to %s", model_name, path)
+
+
+def load_onnx_backend(model_name):
+    """ The model exported to ONNX (once, on first use) and run with ONNX Runtime """
+    import numpy as np
+    import onnxruntime
+    from transformers import AutoConfig, AutoTokenizer
+
+    path = os.path.join(ONNX_MODEL_DIR, model_name.replace("/", "__"), "model.onnx")
+    if not os.path.exists(path):
+        export_onnx_model(model_name, path)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    id2label = AutoConfig.from_pretrained(model_name).id2label
+    session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+    def classify(texts):
+        inputs = tokenizer(texts, padding=True, truncation=True, max_length=MAX_SEQUENCE_LENGTH, return_tensors="np")
+        logits = session.run(["logits"], {"input_ids": inputs["input_ids"].astype(np.int64),
+                                          "attention_mask": inputs["attention_mask"].astype(np.int64)})[0]
+        probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        return [{"label": id2label[int(row.argmax())], "score": float(row.max())} for row in probabilities]
+
+    return classify
+
+
+# Simulated forward pass time of the stub backend per batch, in milliseconds
+STUB_BATCH_MS = float(os.getenv("SENTIMENT_STUB_BATCH_MS", 0))
+
+STUB_NEGATIVE_WORDS = ("bad", "terrible", "awful", "hate", "sad", "angry", "wrong", "broken", "讨厌", "难过", "糟糕",
+                       "生气", "失望")
+STUB_POSITIVE_WORDS = ("good", "great", "love", "thank", "happy", "awesome", "nice", "喜欢", "开心", "谢谢", "好棒")
+
+
+def load_stub_backend(model_name):
+    """ Keyword sentiment without a model: NEGATIVE if a negative word occurs, POSITIVE otherwise """
+    def label(text):
+        folded = text.lower()
+        if any(word in folded for word in STUB_NEGATIVE_WORDS):
+            return {"label": "NEGATIVE", "score": 0.95}
+        return {"label": "POSITIVE", "score": 0.95 if any(word in folded for word in STUB_POSITIVE_WORDS) else 0.6}
+
+    def classify(texts):
+        time.sleep(STUB_BATCH_MS / 1000)
+        return [label(text) for text in texts]
+
+    return classify
+
+
+SENTIMENT_BACKENDS = {
+    "pytorch": load_pytorch_backend,
+    "int8": load_int8_backend,
+    "onnx": load_onnx_backend,
+    "stub": load_stub_backend,
+}
+
+
+def load_sentiment_backend(backend, model_name):
+    """
+    Load a sentiment backend by name.
+
+    Parameters:
+    - backend (str): One of SENTIMENT_BACKENDS.
+    - model_name (str): The Hugging Face model name.
+
+    Returns:
+    - callable: Classifies a list of texts into a list of {"label": ..., "score": ...} dicts.
+    """
+    if backend not in SENTIMENT_BACKENDS:
+        raise ValueError(f"Unknown sentiment backend {backend!r}, expected one of {', '.join(SENTIMENT_BACKENDS)}")
+    return SENTIMENT_BACKENDS[backend](model_name)
@@ -0,0 +1,373 @@
+import logging
+import queue
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class SentimentBatcher:
+    """
+    Micro-batching front end for the sentiment analysis model.
+
+    Request threads submit single texts and get a Future back. A single worker thread collects pending texts
+    for at most max_wait_ms (or until max_batch_size texts are waiting), runs one batched forward pass and
+    resolves the futures. This keeps concurrent Flask threads from each running their own forward pass and
+    competing for the same CPU cores.
+
+    Attributes:
+    - classify (callable): Receives a list of texts and returns a list of {"label": ..., "score": ...} dicts.
+    - max_batch_size (int): The maximum number of texts in one forward pass.
+    - max_wait_ms (float): How long the worker waits for more texts after the first one arrives.
+    """
+
+    def __init__(self, classify, max_batch_size=16, max_wait_ms=5):
+        self.classify = classify
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "batches_total": 0,
+            "requests_total": 0,
+            "errors_total": 0,
+            "batch_size_max": 0,
+            "batch_latency_ms_total": 0.0,
+            "batch_latency_ms_max": 0.0,
+            "batch_latency_ms_last": 0.0,
+        }
+
+    def _ensure_worker(self):
+        """ Start the worker thread on first use (not at import, so that forked workers get their own) """
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="sentiment-batcher", daemon=True)
+                self._worker.start()
+
+    def submit(self, text):
+        """
+        Queue a text for classification.
+
+        Parameters:
+        - text (str): The text to classify.
+
+        Returns:
+        - Future: Resolves to a (label, score) tuple.
+        """
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def analyze(self, text, timeout=None):
+        """ Classify a text and wait for the result; returns (label, score) """
+        return self.submit(text).result(timeout=timeout)
+
+    def _collect_batch(self):
+        """ Block for the first text, then gather more until the window closes or the batch is full """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            texts = [text for text, _ in batch]
+            started = time.perf_counter()
+            try:
+                results = self.classify(texts)
+            except Exception as e:
+                logger.error("Sentiment batch of %d failed: %s", len(batch), e)
+                for _, future in batch:
+                    future.set_exception(e)
+                self._record(len(batch), time.perf_counter() - started, failed=True)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result((result["label"], result["score"]))
+            self._record(len(batch), time.perf_counter() - started)
+
+    def _record(self, batch_size, elapsed, failed=False):
+        latency_ms = elapsed * 1000
+        with self._stats_lock:
+            self._stats["batches_total"] += 1
+            self._stats["requests_total"] += batch_size
+            self._stats["errors_total"] += 1 if failed else 0
+            self._stats["batch_size_max"] = max(self._stats["batch_size_max"], batch_size)
+            self._stats["batch_latency_ms_total"] += latency_ms
+            self._stats["batch_latency_ms_max"] = max(self._stats["batch_latency_ms_max"], latency_ms)
+            self._stats["batch_latency_ms_last"] = latency_ms
+
+    def stats(self):
+        """
+        Return the batching metrics.
+
+        Returns:
+        - dict: Current queue depth, batch counts and sizes, and per-batch latency in milliseconds.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        batches = stats["batches_total"] or 1
+        stats["queue_depth"] = self._queue.qsize()
+        stats["batch_size_avg"] = stats["requests_total"] / batches
+        stats["batch_latency_ms_avg"] = stats.pop("batch_latency_ms_total") / batches
+        return stats
+
+
+class LazyModel:
+    """
+    A model that is loaded on first use, or ahead of time by a background warm-up thread.
+
+    The state ("cold", "warming", "ready" or "failed") is reported by the readiness endpoint. Callers of get()
+    during warm-up block until the model is available.
+
+    Attributes:
+    - loader (callable): Loads and returns the model.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.state = "cold"
+        self.error = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """ Load the model in the calling thread (or wait for a load in progress) and return it """
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                self.state = "warming"
+                started = time.perf_counter()
+                try:
+                    self._model = self.loader()
+                except Exception as e:
+                    self.state, self.error = "failed", str(e)
+                    raise
+                self.state = "ready"
+                logger.info("Sentiment model loaded in %.1fs", time.perf_counter() - started)
+        return self._model
+
+    get = load
+
+    def warm_up(self):
+        """ Start loading the model on a background thread """
+        def load_quietly():
+            try:
+                self.load()
+            except Exception as e:
+                logger.error("Sentiment model warm-up failed: %s", e)
+
+        if self._model is not None:
+            return
+        self.state = "warming"
+        threading.Thread(target=load_quietly, name="sentiment-warm-up", daemon=True).start()
+
+
+# Replies the pre-classifier gives without running the model, keyed by normalized text
+TRIVIAL_SENTIMENTS = {
+    **dict.fromkeys(["thanks", "thank you", "thx", "ty", "great", "awesome", "cool", "nice", "perfect", "good",
+                     "love it", "谢谢", "多谢", "太好了", "很好", "棒", "👍", "😊", "😀", "😄", "😁", "🙂", "❤️", "🎉",
+                     "🙏", ":)", ":-)", ":d"], ("POSITIVE", 0.9)),
+    **dict.fromkeys(["bad", "terrible", "awful", "useless", "wrong", "糟糕", "太差了", "不好", "不行", "差", "👎", "😢", "😞", "😡", "😭",
+                     "😠", ":(", ":-("], ("NEGATIVE", 0.9)),
+    **dict.fromkeys(["ok", "okay", "k", "yes", "no", "sure", "hi", "hello", "hey", "好的", "好", "嗯", "是的",
+                     "你好", "?", "？"], ("NEUTRAL", 1.0)),
+}
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Kana, CJK ideographs and Hangul: one or two of these characters are a whole word, often a sentiment-bearing one
+_CJK = re.compile("[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]")
+
+
+def normalize_sentiment_text(text):
+    """ Case-fold and collapse whitespace (the key of the memo and the pre-classifier) """
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip().lower()
+
+
+def preclassify(text, max_chars=2):
+    """
+    Cheap sentiment for input the model would only guess at: known short replies, emoji and input without any
+    letters. Other texts of at most max_chars characters are NEUTRAL unless they contain CJK characters
+    ("讨厌", "好棒"), which go to the model.
+
+    Parameters:
+    - text (str): The normalized text.
+    - max_chars (int): Texts up to this length without CJK characters are never sent to the model.
+
+    Returns:
+    - tuple: (label, score), or None if the model should classify the text.
+    """
+    text = text.rstrip("!.。！~ ") or text
+    if text in TRIVIAL_SENTIMENTS:
+        return TRIVIAL_SENTIMENTS[text]
+    if (len(text) <= max_chars and not _CJK.search(text)) or not any(char.isalpha() for char in text):
+        return "NEUTRAL", 1.0
+    return None
+
+
+def split_into_chunks(text, max_chars):
+    """ Split a long text into pieces of at most max_chars characters, preferring whitespace boundaries """
+    chunks = []
+    while len(text) > max_chars:
+        cut = text.rfind(" ", 0, max_chars)
+        cut = cut if cut > max_chars // 2 else max_chars
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+def combine_chunk_sentiments(chunks, results):
+    """ Length-weighted average of the signed chunk scores (POSITIVE positive, NEGATIVE negative) """
+    total = sum(len(chunk) for chunk in chunks)
+    signed = sum(len(chunk) * (score if label == "POSITIVE" else -score)
+                 for chunk, (label, score) in zip(chunks, results)) / total
+    return ("POSITIVE" if signed >= 0 else "NEGATIVE"), 0.5 + abs(signed) / 2
+
+
+class SentimentAnalyzer:
+    """
+    Front end of the sentiment batcher that avoids forward passes.
+
+    - Trivial input (see preclassify()) is answered without the model.
+    - Results are memoized in a bounded LRU keyed on the normalized text. The memo holds futures, so identical
+      texts submitted while the first one is still being classified share its forward pass.
+    - Texts longer than chunk_chars are either truncated by the backend ("truncate") or split into chunks whose
+      scores are combined ("chunk").
+
+    Attributes:
+    - batcher (SentimentBatcher): Classifies the remaining texts.
+    - memo_size (int): The maximum number of memoized texts; 0 disables the memo.
+    - preclassify_chars (int): Texts up to this length without CJK characters skip the model; -1 disables the
+      pre-classifier.
+    - long_input (str): "truncate" or "chunk".
+    - chunk_chars (int): The chunk size for long_input="chunk".
+    """
+
+    def __init__(self, batcher, memo_size=4096, preclassify_chars=2, long_input="truncate", chunk_chars=1000):
+        self.batcher = batcher
+        self.memo_size = memo_size
+        self.preclassify_chars = preclassify_chars
+        self.long_input = long_input
+        self.chunk_chars = chunk_chars
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"analyzed_total": 0, "memo_hits": 0, "preclassified": 0, "chunked": 0, "model_texts": 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _classify(self, text):
+        """ Send a text (or its chunks) to the batcher; returns a Future of (label, score) """
+        if self.long_input != "chunk" or len(text) <= self.chunk_chars:
+            self._count("model_texts")
+            return self.batcher.submit(text)
+
+        chunks = split_into_chunks(text, self.chunk_chars)
+        self._count("chunked")
+        self._count("model_texts", len(chunks))
+        chunk_futures = [self.batcher.submit(chunk) for chunk in chunks]
+        future = Future()
+
+        def on_chunk_done(_):
+            if all(chunk_future.done() for chunk_future in chunk_futures) and not future.done():
+                try:
+                    future.set_result(combine_chunk_sentiments(chunks, [f.result() for f in chunk_futures]))
+                except Exception as e:
+                    future.set_exception(e)
+
+        for chunk_future in chunk_futures:
+            chunk_future.add_done_callback(on_chunk_done)
+        return future
+
+    def submit(self, text):
+        """
+        Classify a text, from the pre-classifier or memo when possible.
+
+        Parameters:
+        - text (str): The text to classify.
+
+        Returns:
+        - Future: Resolves to a (label, score) tuple.
+        """
+        self._count("analyzed_total")
+        key = normalize_sentiment_text(text)
+
+        if self.preclassify_chars >= 0:
+            result = preclassify(key, self.preclassify_chars)
+            if result is not None:
+                self._count("preclassified")
+                future = Future()
+                future.set_result(result)
+                return future
+
+        if not self.memo_size:
+            return self._classify(text)
+
+        with self._lock:
+            future = self._memo.get(key)
+            if future is not None:
+                self._memo.move_to_end(key)
+                self._stats["memo_hits"] += 1
+                return future
+            future = Future()
+            self._memo[key] = future
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+        def on_done(result_future):
+            if result_future.exception() is not None:
+                with self._lock:
+                    if self._memo.get(key) is future:
+                        del self._memo[key]  # Do not memoize failures
+                future.set_exception(result_future.exception())
+            else:
+                future.set_result(result_future.result())
+
+        try:
+            self._classify(text).add_done_callback(on_done)
+        except Exception as e:
+            with self._lock:
+                self._memo.pop(key, None)
+            future.set_exception(e)
+        return future
+
+    def analyze(self, text, timeout=None):
+        """ Classify a text and wait for the result; returns (label, score) """
+        return self.submit(text).result(timeout=timeout)
+
+    def stats(self):
+        """
+        Return the short-circuit metrics.
+
+        Returns:
+        - dict: Analyzed text, memo hit, pre-classified, chunked and model text counts, the memo size and the share of
+          requests that did not need a forward pass.
+        """
+        with self._lock:
+            stats = dict(self._stats, memo_size=len(self._memo))
+        saved = stats["memo_hits"] + stats["preclassified"]
+        stats["memo_hit_rate"] = stats["memo_hits"] / (stats["analyzed_total"] - stats["preclassified"] or 1)
+        stats["forward_passes_saved_ratio"] = saved / (stats["analyzed_total"] or 1)
+        return stats
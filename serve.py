@@ -0,0 +1,105 @@
+"""
+Production entry point: serve the chatbot with gunicorn instead of the Flask development server.
+
+    python serve.py --workers 4 --threads 32 --timeout 120
+
+Flask is a WSGI app and a chat request spends almost all of its time waiting on OpenAI and the tool APIs, so
+the workers use gunicorn's "gthread" class: every worker process serves --threads requests concurrently, and
+the number of processes only has to cover the CPU-bound part (sentiment analysis, JSON, templates).
+
+- The sentiment model is loaded once in the master before the workers are forked, so they share its memory
+  (copy-on-write) and are ready as soon as they start. --no-preload loads it in every worker instead.
+- SIGTERM stops accepting connections and gives in-flight chats --graceful-timeout seconds to finish; titles
+  still being generated in the background are completed before a worker exits.
+- --timeout bounds a request: it becomes the deadline of every chat request (CHAT_DEADLINE), which cuts the
+  timeouts of its OpenAI and tool calls to the time left and ends it with a partial answer once it passes.
+  Each OpenAI call also gets at most half of it (LLM_TIMEOUT), and workers that stop responding for that long
+  are restarted.
+
+Every option can also be set with the environment variable shown in --help.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+
+logger = logging.getLogger("chatbot.serve")
+
+
+def default_workers():
+    """ One worker per CPU core (at most 8): the threads, not the processes, absorb the I/O waits """
+    return min(multiprocessing.cpu_count(), 8)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the chatbot with gunicorn")
+    parser.add_argument("--bind", default=os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', 5000)}"),
+                        help="Address to listen on (BIND, default 0.0.0.0:$PORT)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", default_workers())),
+                        help="Worker processes (WEB_CONCURRENCY)")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("WORKER_THREADS", 32)),
+                        help="Request threads per worker (WORKER_THREADS)")
+    parser.add_argument("--timeout", type=int, default=int(os.getenv("REQUEST_TIMEOUT", 120)),
+                        help="Per-request timeout in seconds (REQUEST_TIMEOUT)")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", 60)),
+                        help="Seconds in-flight requests get to finish on shutdown (GRACEFUL_TIMEOUT)")
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv("KEEP_ALIVE", 5)),
+                        help="Seconds to keep idle client connections open (KEEP_ALIVE)")
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("MAX_REQUESTS", 0)),
+                        help="Restart a worker after this many requests, 0 to never restart (MAX_REQUESTS)")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        default=os.getenv("PRELOAD_MODEL", "1") != "0",
+                        help="Load the sentiment model in each worker instead of once in the master (PRELOAD_MODEL=0)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.setdefault("LLM_TIMEOUT", str(args.timeout / 2))
+    os.environ.setdefault("CHAT_DEADLINE", str(args.timeout))
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit("serve.py needs gunicorn (pip install gunicorn); use `python app.py` for the development server")
+
+    # Imported after LLM_TIMEOUT and CHAT_DEADLINE are set, because app.py reads its configuration at import
+    import app as chatbot
+
+    class ChatbotApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": args.bind,
+                "workers": args.workers,
+                "worker_class": "gthread",
+                "threads": args.threads,
+                "timeout": args.timeout,
+                "graceful_timeout": args.graceful_timeout,
+                "keepalive": args.keep_alive,
+                "max_requests": args.max_requests,
+                "max_requests_jitter": args.max_requests // 10,
+                "worker_exit": worker_exit,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Runs in each worker after the fork: services with sockets, threads or SQLite connections are
+            # created here and not inherited from the master
+            return chatbot.create_app()
+
+    def worker_exit(server, worker):
+        """ Let background title generation finish before the worker process exits """
+        chatbot.background_executor.shutdown(wait=True)
+
+    if args.preload:
+        chatbot.sentiment_model.load()
+        logger.info("Sentiment model preloaded, forking %d workers x %d threads", args.workers, args.threads)
+
+    ChatbotApplication().run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    main()
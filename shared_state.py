@@ -0,0 +1,32 @@
+"""
+Connection to the Redis server that holds state shared by all worker processes and nodes: chat history
+(CHAT_STORE_BACKEND=redis), tool responses and generated function schemas.
+
+REDIS_URL takes any redis:// or rediss:// URL. "fakeredis://" runs an in-process fake server instead, which
+is useful for tests but of course not shared between processes.
+"""
+try:
+    import redis
+except ImportError:  # redis is only needed when REDIS_URL is set
+    redis = None
+
+# Prefix of every key written by the app, so that one Redis database can be shared with other applications
+KEY_PREFIX = "chatbot:"
+
+
+def connect_redis(url):
+    """
+    Connect to Redis.
+
+    Parameters:
+    - url (str): A redis://, rediss:// or unix:// URL, or fakeredis:// for an in-process fake.
+
+    Returns:
+    - redis.Redis: A client that returns str values (decode_responses=True).
+    """
+    if url.startswith("fakeredis://"):
+        import fakeredis
+        return fakeredis.FakeRedis(decode_responses=True)
+    if redis is None:
+        raise RuntimeError("REDIS_URL is set but the redis package is not installed (pip install redis)")
+    return redis.Redis.from_url(url, decode_responses=True, health_check_interval=30)
@@ -1,37 +1,96 @@
-document.getElementById('send-btn').addEventListener('click', () => {
-    const userInput = document.getElementById('user-input').value;
-    if (!userInput.trim()) return;
-
-    const chatBox = document.getElementById('chat-box');
-    const escapeHTML = (str) => {
-        const div = document.createElement('div');
-        div.textContent = str;
-        return div.innerHTML;
-    };
-
-    const sanitizedInput = escapeHTML(userInput);
-    chatBox.innerHTML += `<div class="user-message"><b>You:</b> ${sanitizedInput}</div>`;
-    document.getElementById('user-input').value = '';
-
-    fetch('/api/chat', {
+/**
+ * Send a message to /api/chat and render the reply incrementally.
+ * The server streams Server-Sent Events: "delta" events carry the next piece of the reply,
+ * the final "done" event carries the same fields as the JSON response ({reply, sentiment, confidence}).
+ * If the server answers with plain JSON instead (errors, non-streaming mode), that JSON is returned as-is.
+ */
+async function streamChat(payload, onDelta) {
+    const response = await fetch('/api/chat', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ message: userInput })
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data.reply) {
-            chatBox.innerHTML += `<div class="bot-message"><b>Bot:</b> ${escapeHTML(data.reply)}</div>`;
-        } else if (data.error) {
-            chatBox.innerHTML += `<div class="bot-message"><b>Bot:</b> Error: ${data.error}</div>`;
-        } else {
-            chatBox.innerHTML += `<div class="bot-message"><b>Bot:</b> Unexpected response</div>`;
+        headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+        body: JSON.stringify(payload)
+    });
+
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.startsWith('text/event-stream')) {
+        return response.json();
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = { error: 'The reply stream ended unexpectedly' };
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (!data) continue;
+
+            const eventData = JSON.parse(data);
+            if (eventName === 'delta') onDelta(eventData.content);
+            else if (eventName === 'done') result = eventData;
+            else if (eventName === 'error') result = { error: eventData.error };
         }
-        setTimeout(() => {
+    }
+    return result;
+}
+
+const sendButton = document.getElementById('send-btn');
+if (sendButton && document.getElementById('user-input')) {
+    sendButton.addEventListener('click', () => {
+        const userInput = document.getElementById('user-input').value;
+        if (!userInput.trim()) return;
+
+        const chatBox = document.getElementById('chat-box');
+        const escapeHTML = (str) => {
+            const div = document.createElement('div');
+            div.textContent = str;
+            return div.innerHTML;
+        };
+
+        const sanitizedInput = escapeHTML(userInput);
+        chatBox.innerHTML += `<div class="user-message"><b>You:</b> ${sanitizedInput}</div>`;
+        document.getElementById('user-input').value = '';
+
+        // The bot message is created up front and filled in as the reply streams in
+        const botMessage = document.createElement('div');
+        botMessage.className = 'bot-message';
+        botMessage.innerHTML = '<b>Bot:</b> ';
+        const botText = document.createElement('span');
+        botMessage.appendChild(botText);
+        chatBox.appendChild(botMessage);
+
+        streamChat({ message: userInput }, (delta) => {
+            botText.textContent += delta;
             chatBox.scrollTop = chatBox.scrollHeight;
-        }, 100);
-    })
-    .catch(error => {
-        chatBox.innerHTML += `<div class="bot-message"><b>Bot:</b> Sorry, something went wrong. Please try again later.</div>`;
+        })
+        .then(data => {
+            if (data.reply) {
+                botText.textContent = data.reply;
+            } else if (data.error) {
+                botText.textContent = `Error: ${data.error}`;
+            } else {
+                botText.textContent = 'Unexpected response';
+            }
+            setTimeout(() => {
+                chatBox.scrollTop = chatBox.scrollHeight;
+            }, 100);
+        })
+        .catch(error => {
+            botText.textContent = 'Sorry, something went wrong. Please try again later.';
+        });
     });
-});
+}
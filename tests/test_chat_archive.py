@@ -0,0 +1,57 @@
+import os
+import time
+
+from chat_archive import ArchivingChatStore, ChatArchive, PENDING_MAX_AGE
+from chat_store import SQLiteChatStore
+
+MESSAGES = [{"role": "user", "content": "How is the weather in Taipei?"},
+            {"role": "assistant", "content": "Sunny, 28°C."}]
+
+
+def make_store(tmp_path):
+    store = SQLiteChatStore(os.path.join(tmp_path, "chats.db"))
+    store.create_chat("chat-1", "Weather")
+    store.append_messages("chat-1", MESSAGES)
+    return store
+
+
+def interrupted_run(store, archive):
+    """ An archiving run that crashed after clearing the messages but before committing the record """
+    archive.write({"chat_id": "chat-1", "title": "Weather", "summary": None, "summary_upto": 0,
+                   "updated_at": time.time(), "messages": store.get_messages("chat-1")})
+    assert store.clear_messages("chat-1", len(MESSAGES))
+
+
+def test_compact_keeps_interrupted_archive_run(tmp_path):
+    store = make_store(tmp_path)
+    archive = ChatArchive(os.path.join(tmp_path, "archive"))
+    interrupted_run(store, archive)
+    archive.compact()
+    chats = ArchivingChatStore(store, archive)
+    assert archive.state("chat-1") == "archived"
+    assert chats.archive_idle_chats(0) == 0
+    assert chats.get_messages("chat-1") == MESSAGES
+
+
+def test_read_commits_interrupted_archive_run(tmp_path):
+    store = make_store(tmp_path)
+    archive = ChatArchive(os.path.join(tmp_path, "archive"))
+    chats = ArchivingChatStore(store, archive)
+    interrupted_run(store, archive)
+    assert chats.read_chat("chat-1")["messages"] == MESSAGES
+    chats.append_messages("chat-1", [{"role": "user", "content": "And tomorrow?"}])
+    assert chats.get_messages("chat-1") == MESSAGES + [{"role": "user", "content": "And tomorrow?"}]
+
+
+def test_stale_pending_record_is_dropped_if_messages_are_hot(tmp_path):
+    store = make_store(tmp_path)
+    archive = ChatArchive(os.path.join(tmp_path, "archive"))
+    chats = ArchivingChatStore(store, archive)
+    archive.write(chats.read_chat("chat-1"))
+    chats.recover_pending()
+    assert archive.state("chat-1") == "pending"
+    with archive._transaction() as conn:
+        conn.execute("UPDATE archived SET archived_at = archived_at - ?", (PENDING_MAX_AGE + 1,))
+    chats.recover_pending()
+    assert archive.state("chat-1") is None
+    assert chats.get_messages("chat-1") == MESSAGES
@@ -0,0 +1,34 @@
+import json
+
+import app
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, articles):
+        self._articles = articles
+
+    def json(self):
+        return {"articles": self._articles}
+
+
+def test_zero_articles_fall_back_to_the_llm(monkeypatch):
+    monkeypatch.setenv("NEWS_API_KEY", "test-key")
+    monkeypatch.setattr(app.news_http, "get", lambda path, params=None: FakeResponse([]))
+    result = app.query_news_function(topic="nothing")
+    assert json.loads(result) == {"summary": ""}
+    assert app.render_news_summary(result) is None
+    calls = [("query_news_function", json.dumps({"topic": "nothing"}))]
+    assert app.tool_registry.render(calls, [result], language="en") is None
+
+
+def test_whitespace_summary_falls_back_to_the_llm():
+    assert app.render_news_summary(json.dumps({"summary": "  \n"})) is None
+
+
+def test_articles_are_rendered_as_the_reply(monkeypatch):
+    monkeypatch.setenv("NEWS_API_KEY", "test-key")
+    article = {"title": "Title", "url": "https://example.com", "source": {"name": "Example"}}
+    monkeypatch.setattr(app.news_http, "get", lambda path, params=None: FakeResponse([article]))
+    assert app.render_news_summary(app.query_news_function(topic="x")).startswith("**[Title](https://example.com)**")
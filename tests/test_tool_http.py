@@ -0,0 +1,33 @@
+import pytest
+import requests
+
+from tool_http import CircuitBreaker, ToolHTTPClient
+
+
+def failing_client(monkeypatch, error):
+    client = ToolHTTPClient("https://upstream.example", max_retries=2, backoff_base=0,
+                            breaker=CircuitBreaker(failure_threshold=1))
+    calls = []
+
+    def get(url, params=None, timeout=None):
+        calls.append(url)
+        raise error
+
+    monkeypatch.setattr(client.session, "get", get)
+    return client, calls
+
+
+def test_truncated_body_is_retried_then_opens_the_circuit(monkeypatch):
+    client, calls = failing_client(monkeypatch, requests.exceptions.ChunkedEncodingError("truncated"))
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        client.get("/data")
+    assert len(calls) == 3
+    assert client.breaker.state == "open"
+
+
+def test_other_request_errors_fail_at_once_and_open_the_circuit(monkeypatch):
+    client, calls = failing_client(monkeypatch, requests.exceptions.ContentDecodingError("bad gzip"))
+    with pytest.raises(requests.exceptions.ContentDecodingError):
+        client.get("/data")
+    assert len(calls) == 1
+    assert client.breaker.state == "open"
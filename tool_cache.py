@@ -0,0 +1,193 @@
+import hashlib
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+def call_key(function, kwargs, normalize=None, exclude=("api_key",)):
+    """
+    Build a cache key from a tool call: the function name plus its arguments with defaults filled in.
+
+    Parameters:
+    - function (callable): The tool function.
+    - kwargs (dict): Arguments of the call.
+    - normalize (callable): Optional; receives the argument dict and returns a normalized copy.
+    - exclude (tuple): Arguments that do not affect the result (credentials).
+
+    Returns:
+    - tuple: A hashable key.
+    """
+    bound = inspect.signature(function).bind(**kwargs)
+    bound.apply_defaults()
+    arguments = {name: value for name, value in bound.arguments.items() if name not in exclude}
+    if normalize:
+        arguments = normalize(arguments)
+    return (function.__name__,) + tuple(sorted(arguments.items()))
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a fixed time-to-live.
+
+    get_or_compute() coalesces concurrent misses: while one thread computes a key, other threads asking for
+    the same key wait for that result instead of calling the upstream themselves.
+
+    Attributes:
+    - maxsize (int): The maximum number of entries; the least recently used entry is evicted first.
+    - ttl (float): Lifetime of an entry in seconds.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _get_fresh(self, key):
+        """ Return (True, value) for a live entry, evicting it if it expired; caller holds the lock """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute, should_cache=None):
+        """
+        Return the cached value for key, or compute it once and cache it.
+
+        Parameters:
+        - key (hashable): The cache key.
+        - compute (callable): Called without arguments on a miss.
+        - should_cache (callable): Optional; receives the computed value and returns False to skip caching it
+          (e.g. upstream errors).
+
+        Returns:
+        - object: The cached or freshly computed value.
+        """
+        with self._lock:
+            found, value = self._get_fresh(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = Future()
+                owner = True
+            else:
+                self.coalesced += 1
+                owner = False
+
+        if not owner:
+            return pending.result()
+
+        try:
+            value = compute()
+        except Exception as e:
+            with self._lock:
+                del self._pending[key]
+            pending.set_exception(e)
+            raise
+
+        with self._lock:
+            if should_cache is None or should_cache(value):
+                self._put(key, value)
+            del self._pending[key]
+        pending.set_result(value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ Return hit/miss counters and the current size """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+            }
+
+
+class RedisTTLCache(TTLCache):
+    """
+    Two-level cache for deployments with several worker processes: a short-lived in-process TTLCache in front of
+    entries shared through Redis. A miss in one worker is answered from Redis if any other worker fetched the
+    same key within ttl, and concurrent misses within a worker are still coalesced. Redis errors degrade to a
+    per-process cache. Values must be JSON-serializable.
+
+    Attributes:
+    - redis (redis.Redis): A client created with decode_responses=True.
+    - namespace (str): Key prefix of this cache's entries.
+    - maxsize (int): The maximum number of in-process entries.
+    - ttl (float): Lifetime of a shared entry in seconds.
+    - local_ttl (float): Lifetime of an in-process entry in seconds.
+    """
+
+    def __init__(self, redis, namespace, maxsize=1024, ttl=300, local_ttl=30):
+        super().__init__(maxsize=maxsize, ttl=min(ttl, local_ttl))
+        self.redis = redis
+        self.namespace = namespace
+        self.shared_ttl = ttl
+        self.shared_hits = 0
+
+    def _redis_key(self, key):
+        digest = hashlib.sha256(json.dumps(key, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{digest}"
+
+    def get_or_compute(self, key, compute, should_cache=None):
+        redis_key = self._redis_key(key)
+
+        def compute_shared():
+            try:
+                cached = self.redis.get(redis_key)
+            except Exception as e:
+                logger.warning("Shared cache %s unavailable: %s", self.namespace, e)
+                return compute()
+            if cached is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                return json.loads(cached)
+
+            value = compute()
+            if should_cache is None or should_cache(value):
+                try:
+                    self.redis.set(redis_key, json.dumps(value, ensure_ascii=False), ex=max(1, int(self.shared_ttl)))
+                except Exception as e:
+                    logger.warning("Failed to share %s cache entry: %s", self.namespace, e)
+            return value
+
+        return super().get_or_compute(key, compute_shared, should_cache)
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats["shared_hits"] = self.shared_hits
+        stats["shared_ttl"] = self.shared_ttl
+        return stats
@@ -0,0 +1,146 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Upstream responses worth retrying: rate limiting and server-side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Request errors worth retrying (SSLError is a ConnectionError); any other RequestException fails at once
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+class CircuitOpenError(Exception):
+    """ Raised instead of calling an upstream whose circuit breaker is open """
+
+
+class CircuitBreaker:
+    """
+    Fail fast while an upstream is down.
+
+    After failure_threshold consecutive failures the circuit opens and calls are rejected for reset_timeout
+    seconds. The next call after that is let through as a probe: success closes the circuit, failure opens
+    it again. A call that is still rate limited (429) after all retries counts as a failure.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        """ Return True if a call may go upstream """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Let one probe through and keep rejecting the others until it reports back
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class ToolHTTPClient:
+    """
+    Pooled HTTP client for one upstream API used by a tool.
+
+    Keeps a keep-alive connection pool, applies connect/read timeouts to every request, retries 429 and 5xx
+    responses (and connection errors, timeouts and truncated bodies) with jittered exponential backoff, and
+    guards the upstream with a circuit breaker that counts every request that finally failed.
+
+    Attributes:
+    - base_url (str): Scheme and host of the upstream, e.g. "https://api.openweathermap.org".
+    - timeout (tuple): (connect timeout, read timeout) in seconds.
+    - max_retries (int): Retries after the first attempt.
+    - backoff_base (float): Base delay in seconds; attempt n waits up to backoff_base * 2**n.
+    - backoff_max (float): Upper bound for a single delay, also applied to Retry-After.
+    - breaker (CircuitBreaker): Circuit breaker of this upstream.
+    """
+
+    def __init__(self, base_url, connect_timeout=3.05, read_timeout=10, max_retries=2, backoff_base=0.5,
+                 backoff_max=4, pool_size=10, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _backoff(self, attempt, response=None):
+        """ Full-jitter backoff, or the upstream's Retry-After when it sends one """
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def get(self, path, params=None):
+        """
+        Send a GET request to the upstream.
+
+        Parameters:
+        - path (str): Path relative to base_url.
+        - params (dict): Query parameters.
+
+        Returns:
+        - requests.Response: The final response. 429/5xx responses are returned once retries are exhausted.
+
+        Exceptions:
+        - CircuitOpenError: The upstream is considered down.
+        - requests.RequestException: The request kept failing (retried first if the error is in RETRY_ERRORS).
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.base_url} is unavailable, circuit breaker is open")
+
+        url = self.base_url + path
+        attempt = 0
+        while True:
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                # Every failed request counts, so that a half-open probe always reports back to the breaker
+                if attempt >= self.max_retries or not isinstance(e, RETRY_ERRORS):
+                    self.breaker.record_failure()
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code not in RETRY_STATUSES:
+                self.breaker.record_success()
+                return response
+            if attempt >= self.max_retries:
+                # Still rate limited or failing after every retry: either way the upstream needs a break, and a
+                # half-open probe must report back so that the breaker leaves that state
+                self.breaker.record_failure()
+                return response
+            time.sleep(self._backoff(attempt, response))
+            attempt += 1
@@ -0,0 +1,162 @@
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from tool_cache import call_key
+
+logger = logging.getLogger(__name__)
+
+# Seconds a tool call may take unless the tool sets its own timeout
+DEFAULT_TOOL_TIMEOUT = 15
+
+
+class Tool:
+    """
+    A function the model can call.
+
+    Attributes:
+    - function (callable): The tool function; it returns a JSON string.
+    - cache (TTLCache): Optional cache of the function's results.
+    - normalize (callable): Normalizes the arguments into the cache key (see tool_cache.call_key).
+    - should_cache (callable): Receives a result and returns False to keep it out of the cache.
+    - timeout (float): Seconds the tool may take before the model is told it timed out.
+    - render (callable): Optional; turns a result and the language of the user's message into the final
+      Markdown reply, or returns None if it cannot (e.g. for an error). Tools with a renderer skip the
+      follow-up completion that rephrases their result.
+    """
+
+    def __init__(self, function, cache=None, normalize=None, should_cache=None, timeout=DEFAULT_TOOL_TIMEOUT,
+                 render=None):
+        self.function = function
+        self.name = function.__name__
+        self.cache = cache
+        self.normalize = normalize
+        self.should_cache = should_cache
+        self.timeout = timeout
+        self.render = render
+
+    def __call__(self, arguments):
+        if self.cache is None:
+            return self.function(**arguments)
+        key = call_key(self.function, arguments, self.normalize)
+        return self.cache.get_or_compute(key, lambda: self.function(**arguments), should_cache=self.should_cache)
+
+
+def format_tool_result(result):
+    """ The text the model gets back: the Markdown "summary" if there is one, pretty-printed JSON otherwise """
+    try:
+        data = json.loads(result)
+    except (TypeError, json.JSONDecodeError):
+        return result
+    if isinstance(data, dict) and "summary" in data:
+        return data["summary"]
+    if isinstance(data, dict):
+        return json.dumps(data, ensure_ascii=False, indent=2)
+    return result
+
+
+class ToolRegistry:
+    """
+    The tools offered to the model, and the engine that runs the calls of one completion.
+
+    All tool calls of a turn are run at the same time on a bounded thread pool. Each call gets its tool's
+    timeout; a call that fails or times out produces an error result for the model instead of failing the turn.
+
+    Attributes:
+    - max_workers (int): Size of the thread pool shared by all requests.
+    """
+
+    def __init__(self, max_workers=16):
+        self._tools = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool-call")
+
+    def register(self, function, **options):
+        """ Register a tool function; options are passed to Tool """
+        tool = Tool(function, **options)
+        self._tools[tool.name] = tool
+        return tool
+
+    def get(self, name):
+        return self._tools.get(name)
+
+    def functions(self):
+        """ The registered tool functions, in registration order (input of the schema generator) """
+        return [tool.function for tool in self._tools.values()]
+
+    @staticmethod
+    def tool_definitions(schemas):
+        """ Wrap generated function schemas into the tools= format of the chat completions API """
+        return [{"type": "function", "function": schema} for schema in schemas]
+
+    def _run(self, name, arguments):
+        tool = self._tools.get(name)
+        if tool is None:
+            return json.dumps({"error": f"Unknown Function: {name}"})
+        return tool(arguments)
+
+    def render(self, calls, results, language=None):
+        """
+        Build the reply locally from the results of a turn's tool calls.
+
+        Parameters:
+        - calls (list): (name, arguments JSON string) tuples, as passed to run_calls().
+        - results (list): The raw results returned by run_calls().
+        - language (str): The language of the user's message ("zh", "en", or None if it is neither).
+
+        Returns:
+        - str: The Markdown reply, or None if any of the tools has no renderer or a result could not be rendered;
+          the results then go to the model.
+        """
+        parts = []
+        for (name, _), result in zip(calls, results):
+            tool = self._tools.get(name)
+            if tool is None or tool.render is None:
+                return None
+            try:
+                part = tool.render(result, language)
+            except Exception as e:
+                logger.warning("Rendering the %s result failed: %s", name, e)
+                return None
+            if part is None:
+                return None
+            parts.append(part)
+        return "\n\n".join(parts) if parts else None
+
+    def run_calls(self, calls, max_seconds=None):
+        """
+        Run the tool calls of one completion in parallel.
+
+        Parameters:
+        - calls (list): (name, arguments JSON string) tuples in the order the model requested them.
+        - max_seconds (float): Optional cap on every call's timeout (the time left of the request).
+
+        Returns:
+        - list: The raw result (a JSON string) of each call, in the same order; see format_tool_result().
+        """
+        started = time.monotonic()
+        futures = []
+        for name, arguments in calls:
+            try:
+                futures.append(self._executor.submit(self._run, name, json.loads(arguments or "{}")))
+            except json.JSONDecodeError as e:
+                futures.append(json.dumps({"error": f"Invalid arguments: {e}"}))
+
+        results = []
+        for (name, _), future in zip(calls, futures):
+            if isinstance(future, str):
+                results.append(future)
+                continue
+            tool = self._tools.get(name)
+            timeout = tool.timeout if tool else DEFAULT_TOOL_TIMEOUT
+            if max_seconds is not None:
+                timeout = max(0, min(timeout, max_seconds))
+            try:
+                results.append(future.result(timeout=max(0, started + timeout - time.monotonic())))
+            except TimeoutError:
+                logger.warning("Tool %s timed out after %ss", name, timeout)
+                results.append(json.dumps({"error": f"{name} timed out"}))
+            except Exception as e:
+                logger.warning("Tool %s failed: %s", name, e)
+                results.append(json.dumps({"error": f"{name} failed: {e}"}))
+        return results